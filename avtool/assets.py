@@ -1,35 +1,155 @@
 import codecs
+import hashlib
 import json
 import mimetypes
+import mmap
 import os
+import shutil
+import struct
+import tempfile
+import warnings
 import zipfile
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
 from io import BytesIO
+from multiprocessing.pool import Pool
+from threading import RLock
 from typing import *
 
 import mltk
-import requests
 from lxml import etree
 from PIL import Image
 
+from .blobstore import *
 from .crawler import *
+from .fetching import *
+from .imaging import *
+from .records import *
 
 __all__ = [
-    'AssetsFetcher', 'AssetsDBMaker', 'AssetsDB',
+    'DownloadedAsset', 'AssetsFetcher', 'AssetsDBMaker', 'AssetsDB',
+    'MappedAssetsDB', 'MappedAssetsDBCache',
     'make_av_assets', 'make_nfo_file',
 ]
 
 
+class DownloadedAsset(object):
+    """
+    An asset downloaded into a spooled temporary file.
+
+    The content is hashed on the fly as it is written.  Small assets stay
+    in memory, while larger ones are rolled over to disk, so the memory
+    usage does not grow with the image sizes.
+    """
+
+    def __init__(self, uri: str, spool_size: int):
+        self.uri = uri
+        self.file_name: Optional[str] = None
+        self.size: int = 0
+        self.file = tempfile.SpooledTemporaryFile(max_size=spool_size)
+        self._hash = hashlib.sha256()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    @property
+    def sha256(self) -> str:
+        return self._hash.hexdigest()
+
+    # the file-like methods used by :meth:`FetchEngine.download_async`
+    def seek(self, pos: int):
+        self.file.seek(pos)
+
+    def truncate(self):
+        self.file.truncate()
+        self.size = 0
+        self._hash = hashlib.sha256()
+
+    def write(self, data: bytes):
+        self.file.write(data)
+        self.size += len(data)
+        self._hash.update(data)
+
+    def read_all(self) -> bytes:
+        """Read the whole content into memory, for post-processing."""
+        self.file.seek(0)
+        return self.file.read()
+
+
 class AssetsFetcher(object):
 
+    SPOOL_SIZE: int = 256 * 1024
+    """Downloads larger than this number of bytes are spooled to disk."""
+
+    def __init__(self, engine: Optional[FetchEngine] = None):
+        self.engine = engine or get_default_engine()
+
     def fetch(self, uri: str, base_name: Optional[str] = None) -> Tuple[str, bytes]:
-        r = requests.get(uri)
+        r = self.engine.get(uri)
+        r.raise_for_status()
+        return self._get_file_name(uri, r, base_name), r.content
 
+    def fetch_many(self,
+                   items: Sequence[Tuple[str, Optional[str]]]
+                   ) -> List[Tuple[str, bytes]]:
+        """
+        Fetch many assets concurrently through the fetch engine.
+
+        Args:
+            items: The ``(uri, base_name)`` of the assets.
+
+        Returns:
+            The ``(file_name, content)`` of the assets, in the order of `items`.
+        """
+        responses = self.engine.get_many([uri for uri, _ in items])
+        ret = []
+        for (uri, base_name), r in zip(items, responses):
+            r.raise_for_status()
+            ret.append((self._get_file_name(uri, r, base_name), r.content))
+        return ret
+
+    def download_many(self,
+                      items: Sequence[Tuple[str, Optional[str]]]
+                      ) -> List[DownloadedAsset]:
+        """
+        Download many assets concurrently into spooled temporary files.
+
+        Args:
+            items: The ``(uri, base_name)`` of the assets.
+
+        Returns:
+            The downloaded assets, in the order of `items`.  The caller
+            should close them after use.
+        """
+        assets = [DownloadedAsset(uri, self.SPOOL_SIZE) for uri, _ in items]
+        try:
+            responses = self.engine.download_many(
+                [(asset.uri, asset) for asset in assets])
+            for (uri, base_name), asset, r in zip(items, assets, responses):
+                r.raise_for_status()
+                asset.file_name = self._get_file_name(uri, r, base_name)
+        except BaseException:
+            for asset in assets:
+                asset.close()
+            raise
+        return assets
+
+    def _get_file_name(self,
+                       uri: str,
+                       r: Optional[FetchResponse],
+                       base_name: Optional[str]) -> str:
         file_name = uri.rsplit('/', 1)[-1] or ''
         ext = ''
         if file_name and '.' in file_name:
             ext = os.path.splitext(file_name)[-1]
-        elif 'content-type' in r.headers:
+        elif r is not None and 'content-type' in r.headers:
             mime_type = r.headers['content-type'].split(';')[0].strip() or ''
             if mime_type:
                 ext = mimetypes.guess_extension(mime_type)
@@ -39,15 +159,124 @@ class AssetsFetcher(object):
         elif not file_name:
             file_name = f'noname{ext}'
 
-        return file_name, r.content
+        return file_name
+
+
+MANIFEST_NAME = '.manifest.json'
+"""The name of the manifest entry in the assets archive."""
+
+MANIFEST_VERSION = 2
+"""
+The version of the manifest written by :class:`AssetsDBMaker`.
+Version 2 adds the assets stored in a :class:`BlobStore`.
+"""
+
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+"""
+The timestamp of the entries written by :class:`AssetsDBMaker`, fixed
+such that the same assets always produce the same archive.
+"""
+
+
+def _read_manifest(zip_file: zipfile.ZipFile
+                   ) -> Tuple[Optional[Dict[str, Dict[str, Any]]], Optional[str]]:
+    # returns the asset entries (name -> entry) in the manifest and the
+    # root of the blob store, or (None, None) if the archive has the
+    # legacy layout, i.e., a sidecar per asset
+    try:
+        content = zip_file.read(MANIFEST_NAME)
+    except KeyError:
+        return None, None
+    manifest = json.loads(content)
+    if manifest.get('version') not in (1, 2):
+        raise ValueError(f'Unsupported assets manifest version: '
+                         f'{manifest.get("version")!r}')
+    entries = {e['name']: e for e in manifest['assets']}
+    return entries, manifest.get('blob_store')
+
+
+def _get_image_size(file: BinaryIO) -> Optional[Tuple[int, int]]:
+    file.seek(0)
+    try:
+        with Image.open(file) as img:  # only the header is read
+            return img.size
+    except Exception:  # not an image, or not supported
+        return None
 
 
 class AssetsDBMaker(object):
+    """
+    Maker of the assets archive.
+
+    Besides the assets, the archive contains a manifest entry (see
+    :data:`MANIFEST_NAME`), which holds the meta data, the size, the
+    SHA-256 digest and the image dimensions of every asset.
+
+    In ``mode='w'``, a new archive is created.  In ``mode='a'``, the
+    existing archive is updated: the existing entries may be kept via
+    :meth:`reuse`, the new entries are appended, and the entries neither
+    reused nor added become dead.  Since a zip file cannot drop entries
+    in place, the updated manifest is appended as well, and the archive
+    is compacted on closing only if the dead entries exceed
+    `compact_threshold` of the archive size.  Archives of the legacy
+    layout (with a ``<name>.json`` sidecar per asset) are upgraded.
+
+    If a :class:`BlobStore` is specified, the assets are stored in it
+    instead of in the archive, and the manifest references them by hash.
+    """
 
-    def __init__(self, path: str):
+    def __init__(self,
+                 path: str,
+                 mode: str = 'w',
+                 compact_threshold: float = .25,
+                 blob_store: Optional[BlobStore] = None):
+        """
+        Construct a new :class:`AssetsDBMaker`.
+
+        Args:
+            path: The path of the archive.
+            mode: "w" to create a new archive, or "a" to update the
+                existing archive (created if not exist).
+            compact_threshold: The fraction of the dead bytes in the
+                archive, above which the archive is compacted on closing.
+            blob_store: The blob store for the new assets.  Defaults to
+                the blob store referenced by the existing archive, if any.
+        """
+        if mode not in ('w', 'a'):
+            raise ValueError(f'Unsupported mode: {mode!r}')
         self.path = path
-        self.zip_file = zipfile.ZipFile(path, mode='w')
-        self.meta_dict: Dict[str, Any] = {}
+        self.mode = mode
+        self.compact_threshold = compact_threshold
+        self.zip_file = zipfile.ZipFile(path, mode=mode)
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        """The manifest entries of the live assets, in the archive order."""
+        self.existing_entries: Dict[str, Dict[str, Any]] = {}
+        """The manifest entries of the assets already in the archive."""
+        self.blob_store = blob_store
+        self._upgrade = False
+        self._own_blob_store = False
+
+        if mode == 'a' and self.zip_file.namelist():
+            entries, blob_root = _read_manifest(self.zip_file)
+            if entries is None:
+                self._upgrade = True
+                entries = self._read_legacy_entries()
+            elif blob_store is None and blob_root is not None:
+                self.blob_store = BlobStore(blob_root)
+                self._own_blob_store = True
+            self.existing_entries = entries
+
+    def _read_legacy_entries(self) -> Dict[str, Dict[str, Any]]:
+        names = set(self.zip_file.namelist())
+        ret = {}
+        for info in self.zip_file.infolist():
+            name = info.filename
+            if not name.endswith('.json'):
+                meta = {}
+                if f'{name}.json' in names:
+                    meta = dict(json.loads(self.zip_file.read(f'{name}.json')))
+                ret[name] = {'name': name, 'size': info.file_size, 'meta': meta}
+        return ret
 
     def __enter__(self):
         return self
@@ -56,35 +285,246 @@ class AssetsDBMaker(object):
         self.close()
 
     def close(self):
-        self.zip_file.close()
+        if self.zip_file is not None:
+            try:
+                if self.mode == 'w' or self._upgrade or \
+                        self.entries != self.existing_entries:
+                    self._write_manifest()
+            finally:
+                self.zip_file.close()
+                self.zip_file = None
+                if self._own_blob_store:
+                    self.blob_store.close()
+            if self.mode == 'a':
+                self._compact_if_necessary()
 
-    def add(self, name: str, content: bytes, meta: Optional[Dict[str, Any]] = None) -> str:
-        # uniquify the name
-        if name in self.meta_dict:
+    def _make_zip_info(self, name: str) -> zipfile.ZipInfo:
+        # the same as the `ZipInfo` made by `writestr`, except for the timestamp
+        zinfo = zipfile.ZipInfo(name, date_time=ZIP_DATE_TIME)
+        zinfo.compress_type = self.zip_file.compression
+        zinfo.external_attr = 0o600 << 16
+        return zinfo
+
+    def _write_manifest(self):
+        manifest = {'version': MANIFEST_VERSION, 'assets': list(self.entries.values())}
+        if self.blob_store is not None:
+            manifest['blob_store'] = self.blob_store.root
+        manifest_json = json.dumps(manifest, ensure_ascii=False).encode('utf-8')
+        with warnings.catch_warnings():
+            # the outdated manifest is superseded by the last one
+            warnings.filterwarnings('ignore', 'Duplicate name', UserWarning)
+            self.zip_file.writestr(self._make_zip_info(MANIFEST_NAME), manifest_json)
+
+    def _compact_if_necessary(self):
+        with zipfile.ZipFile(self.path, mode='r') as src:
+            # the live entries are the assets not in the blob store, and
+            # the last manifest
+            live_names = {n for n, e in self.entries.items() if not e.get('blob')}
+            live_names.add(MANIFEST_NAME)
+            infos = src.infolist()
+            live_infos = [i for i in infos
+                          if i.filename in live_names and src.getinfo(i.filename) is i]
+            total_size = sum(i.compress_size for i in infos)
+            dead_size = total_size - sum(i.compress_size for i in live_infos)
+            if not dead_size or dead_size <= total_size * self.compact_threshold:
+                return
+
+            # copy the live entries in their original order to a new archive
+            tmp_path = f'{self.path}.tmp'
+            try:
+                with zipfile.ZipFile(tmp_path, mode='w') as dst:
+                    for info in live_infos:
+                        zinfo = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+                        zinfo.compress_type = info.compress_type
+                        zinfo.external_attr = info.external_attr
+                        zinfo.file_size = info.file_size
+                        with src.open(info, mode='r') as fin, \
+                                dst.open(zinfo, mode='w') as fout:
+                            shutil.copyfileobj(fin, fout)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+        os.replace(tmp_path, self.path)
+
+    def _get_unique_name(self, name: str) -> str:
+        def exists(n):
+            return (n in self.entries or n in self.existing_entries or
+                    n == MANIFEST_NAME)
+
+        if exists(name):
             base_name, ext = os.path.splitext(name)
             idx = 1
             while True:
-                new_name = f'{base_name}_{idx}'
-                if new_name not in self.meta_dict:
-                    base_name = new_name
+                new_name = f'{base_name}_{idx}{ext}'
+                if not exists(new_name):
+                    name = new_name
+                    break
+                idx += 1
+        return name
+
+    def _add_entry(self,
+                   name: str,
+                   file: BinaryIO,
+                   size: int,
+                   sha256: str,
+                   meta: Optional[Dict[str, Any]],
+                   blob: bool = False):
+        entry = {'name': name, 'size': size, 'sha256': sha256}
+        if blob:
+            entry['blob'] = True
+        image_size = _get_image_size(file)
+        if image_size is not None:
+            entry['width'], entry['height'] = image_size
+        entry['meta'] = dict(meta or {})
+        self.entries[name] = entry
+
+    def reuse(self, **meta) -> Optional[str]:
+        """
+        Keep an existing entry whose meta data matches `meta`.
+
+        Args:
+            \**meta: The meta data items to match, e.g., ``uri=...``.
+
+        Returns:
+            The name of the kept entry, or :obj:`None` if not found.
+        """
+        for name, entry in self.existing_entries.items():
+            if name not in self.entries and \
+                    all(entry['meta'].get(k) == v for k, v in meta.items()):
+                if entry.get('blob') and (self.blob_store is None or
+                                          not self.blob_store.has(entry['sha256'])):
+                    continue  # the blob has been removed from the store
+                if self.blob_store is not None and not entry.get('blob'):
+                    # move the entry of the archive into the blob store
+                    with BytesIO(self.zip_file.read(name)) as f:
+                        sha256, size = self.blob_store.put_file(f, entry.get('sha256'))
+                        self._add_entry(name, f, size, sha256, entry['meta'], blob=True)
+                elif 'sha256' not in entry:
+                    # an entry of the legacy layout, being upgraded
+                    hasher = hashlib.sha256()
+                    with self.zip_file.open(name, mode='r') as f:
+                        for chunk in iter(lambda: f.read(65536), b''):
+                            hasher.update(chunk)
+                        self._add_entry(name, f, entry['size'],
+                                        hasher.hexdigest(), entry['meta'])
+                else:
+                    self.entries[name] = entry
+                return name
+
+    def read(self, name: str) -> bytes:
+        """Read the content of an entry, e.g., a reused one."""
+        entry = self.entries.get(name) or self.existing_entries.get(name)
+        if entry is not None and entry.get('blob'):
+            return self.blob_store.read(entry['sha256'])
+        return self.zip_file.read(name)
+
+    def add(self, name: str, content: bytes, meta: Optional[Dict[str, Any]] = None) -> str:
+        if self.blob_store is not None:
+            with BytesIO(content) as f:
+                return self.add_file(name, f, meta)
+        name = self._get_unique_name(name)
+        self.zip_file.writestr(self._make_zip_info(name), content)
+        with BytesIO(content) as f:
+            self._add_entry(name, f, len(content),
+                            hashlib.sha256(content).hexdigest(), meta)
+        return name
+
+    def add_file(self,
+                 name: str,
+                 file: BinaryIO,
+                 meta: Optional[Dict[str, Any]] = None,
+                 sha256: Optional[str] = None) -> str:
+        """
+        Add an entry by copying `file` into the archive (or the blob
+        store) in chunks.
+
+        Args:
+            name: The name of the entry, uniquified if already exists.
+            file: The binary file object, copied from its beginning.
+            meta: The meta data of the entry.
+            sha256: The SHA-256 hex digest of the content, if known.
+
+        Returns:
+            The actual name of the entry.
+        """
+        name = self._get_unique_name(name)
+        if self.blob_store is not None:
+            sha256, size = self.blob_store.put_file(file, sha256)
+            self._add_entry(name, file, size, sha256, meta, blob=True)
+            return name
+
+        # the same as `writestr`, except for the content is copied in chunks
+        # from `file`.  the size must be known in advance to decide whether
+        # or not to use the zip64 extension.
+        zinfo = self._make_zip_info(name)
+        # `SpooledTemporaryFile.seek` returns the position only since Python 3.11
+        file.seek(0, os.SEEK_END)
+        zinfo.file_size = file.tell()
+        file.seek(0)
+        hasher = hashlib.sha256()
+        with self.zip_file.open(zinfo, mode='w') as dst:
+            while True:
+                chunk = file.read(65536)
+                if not chunk:
                     break
-            name = f'{base_name}{ext}'
+                if sha256 is None:
+                    hasher.update(chunk)
+                dst.write(chunk)
+        if sha256 is None:
+            sha256 = hasher.hexdigest()
+        self._add_entry(name, file, zinfo.file_size, sha256, meta)
+        return name
 
-        # add the entry
-        meta = dict(meta or {})
-        meta_json = json.dumps(meta, ensure_ascii=False, indent=2, separators=(', ', ': ')).encode('utf-8')
-        self.zip_file.writestr(name, content)
-        self.zip_file.writestr(f'{name}.json', meta_json)
-        self.meta_dict[name] = meta
+    def add_blob(self,
+                 name: str,
+                 sha256: str,
+                 meta: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Add an entry referencing a blob already in the blob store.
 
+        Args:
+            name: The name of the entry, uniquified if already exists.
+            sha256: The SHA-256 hex digest of the blob.
+            meta: The meta data of the entry.
+
+        Returns:
+            The actual name of the entry.
+        """
+        name = self._get_unique_name(name)
+        with self.blob_store.open(sha256) as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            self._add_entry(name, f, size, sha256, meta, blob=True)
         return name
 
 
 class AssetsDB(object):
+    """
+    Reader of the assets archive.
+
+    The manifest is loaded once on opening, and answers the iteration and
+    the meta data queries from memory.  Archives of the legacy layout are
+    read via the ``<name>.json`` sidecars.
+    """
 
-    def __init__(self, path: str):
+    def __init__(self, path: str, blob_store: Optional[BlobStore] = None):
+        """
+        Construct a new :class:`AssetsDB`.
+
+        Args:
+            path: The path of the archive.
+            blob_store: The blob store of the assets referenced by hash.
+                Defaults to the blob store recorded in the manifest.
+        """
         self.path = path
         self.zip_file = zipfile.ZipFile(path, mode='r')
+        self.entries: Optional[Dict[str, Dict[str, Any]]]
+        """The manifest entries, or :obj:`None` for the legacy layout."""
+        self.entries, blob_root = _read_manifest(self.zip_file)
+        self.blob_store = blob_store
+        if blob_store is None and blob_root is not None:
+            self.blob_store = BlobStore(blob_root)
 
     def __enter__(self):
         return self
@@ -93,14 +533,27 @@ class AssetsDB(object):
         self.close()
 
     def __iter__(self):
-        for info in self.zip_file.infolist():
-            if not info.name.endswith('.json'):
-                yield info.name
+        if self.entries is not None:
+            yield from self.entries
+        else:
+            for info in self.zip_file.infolist():
+                if not info.filename.endswith('.json'):
+                    yield info.filename
 
     def close(self):
         self.zip_file.close()
 
+    def get_blob(self, file_name: str) -> Optional[str]:
+        """Get the hash of an asset stored in the blob store, if it is."""
+        if self.entries is not None:
+            entry = self.entries.get(file_name)
+            if entry is not None and entry.get('blob'):
+                return entry['sha256']
+
     def get_content(self, file_name: str) -> Optional[bytes]:
+        sha256 = self.get_blob(file_name)
+        if sha256 is not None:
+            return self.blob_store.read(sha256)
         try:
             info = self.zip_file.getinfo(file_name)
         except KeyError:
@@ -113,97 +566,464 @@ class AssetsDB(object):
                 if hasattr(f, 'close'):
                     f.close()
 
+    def get_entry(self, file_name: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the manifest entry of an asset, with the keys "name", "size",
+        "sha256", "width", "height" (the latter three may be absent) and
+        "meta".  For the legacy layout, only "name", "size" and "meta"
+        are available.
+        """
+        if self.entries is not None:
+            return self.entries.get(file_name)
+        try:
+            info = self.zip_file.getinfo(file_name)
+        except KeyError:
+            return None
+        return {'name': file_name, 'size': info.file_size,
+                'meta': self.get_meta(file_name) or {}}
+
     def get_meta(self, file_name: str) -> Optional[Dict[str, Any]]:
-        cnt = self.get_content(f'{file_name}.json')
-        if cnt:
-            return dict(json.loads(cnt))
+        if self.entries is not None:
+            entry = self.entries.get(file_name)
+            if entry is not None:
+                return dict(entry['meta'])
+        else:
+            cnt = self.get_content(f'{file_name}.json')
+            if cnt:
+                return dict(json.loads(cnt))
+
+
+_ZIP_LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+
 
+class MappedAssetsDB(object):
+    """
+    Zero-copy reader of the assets archive, backed by :mod:`mmap`.
 
-def crop_cover_image(input_content: bytes) -> bytes:
-    with BytesIO(input_content) as input_stream:
-        img: Image.Image = Image.open(input_stream, mode='r')
+    Since :class:`AssetsDBMaker` stores the assets uncompressed, their
+    contents are contiguous ranges of the archive file, which are exposed
+    as :class:`memoryview` slices of the map (:meth:`get_view`), or as
+    ``(fd, offset, length)`` for :func:`os.sendfile` (:meth:`get_span`).
+    The central directory and the manifest are read once on opening.
+    The assets in a :class:`BlobStore` are mapped on first access.
+    """
+
+    def __init__(self, path: str, blob_store: Optional[BlobStore] = None):
+        self.path = path
+        self.blob_store = blob_store
+        self._blob_maps: Dict[str, Tuple[int, Optional[mmap.mmap]]] = {}
+        self._fd = os.open(path, os.O_RDONLY)
         try:
-            cropped_img = img.crop((round(img.width - img.height * 0.704), 0, img.width, img.height))
+            self.stat = os.fstat(self._fd)
+            self._mmap = mmap.mmap(self._fd, 0, access=mmap.ACCESS_READ) \
+                if self.stat.st_size else None
+            with zipfile.ZipFile(BytesIO(b'') if self._mmap is None else
+                                 _MmapReader(self._mmap)) as zip_file:
+                self._infos = {i.filename: i for i in zip_file.infolist()}
+                self.entries, blob_root = _read_manifest(zip_file)
+                """The manifest entries, or :obj:`None` for the legacy layout."""
+                if blob_store is None and blob_root is not None:
+                    self.blob_store = BlobStore(blob_root)
+                self._legacy_meta: Dict[str, Optional[Dict[str, Any]]] = {}
+                if self.entries is None:
+                    for name in self._infos:
+                        if not name.endswith('.json'):
+                            cnt = zip_file.read(f'{name}.json') \
+                                if f'{name}.json' in self._infos else None
+                            self._legacy_meta[name] = \
+                                dict(json.loads(cnt)) if cnt else None
+        except BaseException:
+            self.close()
+            raise
+        self._spans: Dict[str, Optional[Tuple[int, int]]] = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __iter__(self):
+        if self.entries is not None:
+            yield from self.entries
+        else:
+            yield from self._legacy_meta
+
+    def close(self):
+        maps = [(getattr(self, '_fd', None), getattr(self, '_mmap', None))]
+        maps.extend(self._blob_maps.values())
+        self._blob_maps.clear()
+        for fd, m in maps:
+            if m is not None:
+                try:
+                    m.close()
+                except BufferError:
+                    pass  # closed on garbage collection, after the views are released
+            if fd is not None:
+                os.close(fd)
+        self._mmap = self._fd = None
+
+    def _get_blob_map(self, file_name: str) -> Optional[Tuple[int, Optional[mmap.mmap]]]:
+        # the (fd, map) of an asset in the blob store
+        entry = self.entries.get(file_name) if self.entries is not None else None
+        if entry is None or not entry.get('blob'):
+            return None
+        sha256 = entry['sha256']
+        if sha256 not in self._blob_maps:
+            fd = os.open(self.blob_store.get_path(sha256), os.O_RDONLY)
             try:
-                with BytesIO() as output_stream:
-                    cropped_img.save(output_stream, format='JPEG')
-                    return output_stream.getvalue()
-            finally:
-                cropped_img.close()
+                m = mmap.mmap(fd, 0, access=mmap.ACCESS_READ) \
+                    if os.fstat(fd).st_size else None
+            except BaseException:
+                os.close(fd)
+                raise
+            self._blob_maps[sha256] = (fd, m)
+        return self._blob_maps[sha256]
+
+    def _get_data_span(self, file_name: str) -> Optional[Tuple[int, int]]:
+        # the offset and the length of the data of a stored entry
+        if file_name not in self._spans:
+            span = None
+            info = self._infos.get(file_name)
+            if info is not None and info.compress_type == zipfile.ZIP_STORED and \
+                    not info.flag_bits & 0x1:
+                header = _ZIP_LOCAL_HEADER.unpack_from(self._mmap, info.header_offset)
+                if header[0] != b'PK\x03\x04':
+                    raise zipfile.BadZipFile(f'Bad local file header: {file_name}')
+                name_len, extra_len = header[-2:]
+                offset = info.header_offset + _ZIP_LOCAL_HEADER.size + name_len + extra_len
+                span = (offset, info.file_size)
+            self._spans[file_name] = span
+        return self._spans[file_name]
+
+    def get_view(self, file_name: str) -> Optional[memoryview]:
+        """
+        Get the content of an entry as a read-only :class:`memoryview`.
+
+        The view of a stored entry is a zero-copy slice of the map, while
+        a compressed entry is decompressed into a new buffer.  Returns
+        :obj:`None` if the entry does not exist.
+        """
+        blob = self._get_blob_map(file_name)
+        if blob is not None:
+            return memoryview(blob[1] if blob[1] is not None else b'')
+        span = self._get_data_span(file_name)
+        if span is not None:
+            offset, length = span
+            return memoryview(self._mmap)[offset: offset + length]
+        content = self.get_content(file_name)
+        if content is not None:
+            return memoryview(content)
+
+    def get_span(self, file_name: str) -> Optional[Tuple[int, int, int]]:
+        """
+        Get ``(fd, offset, length)`` of a stored entry, for :func:`os.sendfile`.
+
+        Returns :obj:`None` if the entry does not exist or is compressed.
+        The file descriptor is owned by this object.
+        """
+        blob = self._get_blob_map(file_name)
+        if blob is not None:
+            return blob[0], 0, (len(blob[1]) if blob[1] is not None else 0)
+        span = self._get_data_span(file_name)
+        if span is not None:
+            return (self._fd,) + span
+
+    def get_content(self, file_name: str) -> Optional[bytes]:
+        blob = self._get_blob_map(file_name)
+        if blob is not None:
+            return blob[1][:] if blob[1] is not None else b''
+        span = self._get_data_span(file_name)
+        if span is not None:
+            offset, length = span
+            return self._mmap[offset: offset + length]
+        if file_name in self._infos:
+            with zipfile.ZipFile(_MmapReader(self._mmap)) as zip_file:
+                return zip_file.read(file_name)
+
+    def get_entry(self, file_name: str) -> Optional[Dict[str, Any]]:
+        """See :meth:`AssetsDB.get_entry`."""
+        if self.entries is not None:
+            return self.entries.get(file_name)
+        if file_name in self._legacy_meta:
+            return {'name': file_name, 'size': self._infos[file_name].file_size,
+                    'meta': self._legacy_meta[file_name] or {}}
+
+    def get_meta(self, file_name: str) -> Optional[Dict[str, Any]]:
+        if self.entries is not None:
+            entry = self.entries.get(file_name)
+            if entry is not None:
+                return dict(entry['meta'])
+        else:
+            meta = self._legacy_meta.get(file_name)
+            if meta is not None:
+                return dict(meta)
+
+
+class _MmapReader(object):
+    """Minimal seekable file over a :class:`mmap.mmap`, for :mod:`zipfile`."""
+
+    def __init__(self, mm: mmap.mmap):
+        self._mm = mm
+        self._pos = 0
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence == os.SEEK_END:
+            offset += len(self._mm)
+        self._pos = offset
+        return offset
+
+    def read(self, n: int = -1) -> bytes:
+        end = len(self._mm) if n is None or n < 0 else self._pos + n
+        ret = self._mm[self._pos: end]
+        self._pos += len(ret)
+        return ret
+
+    def close(self):
+        pass
+
+
+class MappedAssetsDBCache(object):
+    """
+    LRU cache of the open :class:`MappedAssetsDB`, for serving hot images
+    without opening the archives per request.
+
+    The archives are validated against their stat results on every
+    acquisition, thus a rewritten archive is mapped again.  An evicted
+    archive is closed once it is no longer acquired.
+    """
+
+    def __init__(self, max_size: int = 16, blob_store: Optional[BlobStore] = None):
+        self.max_size = max_size
+        self.blob_store = blob_store
+        self._lock = RLock()
+        self._dbs: 'OrderedDict[str, MappedAssetsDB]' = OrderedDict()
+        self._refs: Dict[int, int] = {}  # id(db) -> number of acquisitions
+        self._retired: Dict[int, MappedAssetsDB] = {}
+
+    @staticmethod
+    def _is_fresh(db: MappedAssetsDB, st: os.stat_result) -> bool:
+        return (db.stat.st_ino == st.st_ino and db.stat.st_size == st.st_size and
+                db.stat.st_mtime_ns == st.st_mtime_ns)
+
+    @contextmanager
+    def acquire(self, path: str) -> Generator[MappedAssetsDB, None, None]:
+        """
+        Acquire the mapped archive of `path`.
+
+        The views and the spans obtained from the archive are valid only
+        within this context.
+        """
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        with self._lock:
+            db = self._dbs.pop(path, None)
+            if db is not None and not self._is_fresh(db, st):
+                self._retire(db)
+                db = None
+            if db is None:
+                db = MappedAssetsDB(path, self.blob_store)
+            self._dbs[path] = db
+            self._refs[id(db)] = self._refs.get(id(db), 0) + 1
+            while len(self._dbs) > self.max_size:
+                self._retire(self._dbs.popitem(last=False)[1])
+        try:
+            yield db
         finally:
-            img.close()
+            with self._lock:
+                self._refs[id(db)] -= 1
+                if not self._refs[id(db)]:
+                    del self._refs[id(db)]
+                    if self._retired.pop(id(db), None) is not None:
+                        db.close()
+
+    def _retire(self, db: MappedAssetsDB):
+        if self._refs.get(id(db)):
+            self._retired[id(db)] = db
+        else:
+            db.close()
+
+    def clear(self):
+        """Close all the archives not acquired, and retire the others."""
+        with self._lock:
+            while self._dbs:
+                self._retire(self._dbs.popitem(last=False)[1])
+
 
+def make_av_assets(info: AVInfo,
+                   parent_dir: str,
+                   base_name: str,
+                   fetcher: Optional[AssetsFetcher] = None,
+                   update: bool = False,
+                   blob_store: Optional[BlobStore] = None,
+                   image_pool: Optional[Pool] = None):
+    """
+    Fetch the images of an AV, and save them with its information.
 
-def make_av_assets(info: AVInfo, parent_dir: str, base_name: str):
+    Args:
+        info: The AV information.  The image URIs will be replaced by
+            the names of the entries in the assets archive.
+        parent_dir: The directory where to save the assets.
+        base_name: The base name of the assets files.
+        fetcher: The assets fetcher.
+        update: Whether or not to update the existing assets archive?
+            If :obj:`True`, the images with the same URIs in the existing
+            archive are kept instead of downloaded again.
+        blob_store: If specified, store the images in this blob store
+            instead of the archive.  The images whose URIs are known to
+            the blob store are not downloaded again.
+        image_pool: The process pool for cropping the cover, such that
+            the fetcher threads are not stalled by the CPU bound work.
+    """
     os.makedirs(parent_dir, exist_ok=True)
 
     # generate the assets archive
-    fetcher = AssetsFetcher()
-
-    def fetch_asset(asset: AVInfoImage, base_name: str):
-        c1, c2 = None, None
-        if asset.file:
-            n, c1 = fetcher.fetch(asset.file, base_name)
-            asset.file = db.add(n, c1, {'uri': asset.file})
-        if asset.thumbnail:
-            n, c2 = fetcher.fetch(asset.thumbnail, f'{base_name}.thumbnail')
-            asset.thumbnail = db.add(n, c2, {'uri': asset.thumbnail})
-        return c1, c2
-
-    with AssetsDBMaker(os.path.join(parent_dir, f'{base_name}.zip')) as db:
-        # fanarts
-        buf: List[Tuple[bytes, bytes]] = []
-        if info.fanart_images:
-            for i, fanart_image in enumerate(info.fanart_images):
-                buf.append(fetch_asset(fanart_image, f'fanart_{i}'))
-
-        # cover
-        if info.cover_image is not None:
-            fetch_asset(info.cover_image, 'cover')
-        elif buf:
-            info.cover_image = AVInfoImage()
-
-            # generate the cover image from fanart images, if not given
-            if buf[0][0]:
-                info.cover_image.file = db.add('cover.jpg', crop_cover_image(buf[0][0]))
-            if buf[0][1]:
-                info.cover_image.thumbnail = db.add('cover.thumbnail.jpg', crop_cover_image(buf[0][1]))
-        buf.clear()
-
-        # screenshots
-        if info.screenshot_images:
-            for i, screenshot_image in enumerate(info.screenshot_images):
-                fetch_asset(screenshot_image, f'screenshot_{i}')
+    fetcher = fetcher or AssetsFetcher()
+    zip_path = os.path.join(parent_dir, f'{base_name}.zip')
+    db = None
+    if update and os.path.isfile(zip_path):
+        try:
+            db = AssetsDBMaker(zip_path, mode='a', blob_store=blob_store)
+        except zipfile.BadZipFile:
+            pass
+    if db is None:
+        db = AssetsDBMaker(zip_path, blob_store=blob_store)
 
-    # save the meta json
-    meta_dict = mltk.config_to_dict(info)
-    if info.cover_image is not None:
-        meta_dict['cover_image'] = mltk.config_to_dict(info.cover_image)
-    for key in ('fanart_images', 'screenshot_images'):
-        if getattr(info, key):
-            meta_dict[key] = [mltk.config_to_dict(i) for i in getattr(info, key)]
+    with db:
+        # plan the images, in the order of the archive members.  the
+        # images already in the archive are reused, the images already in
+        # the blob store are referenced, and the others downloaded.
+        def plan(images: Iterable[AVInfoImage], name: str):
+            ret = []
+            for i, img in enumerate(images):
+                for attr, suffix in (('file', ''), ('thumbnail', '.thumbnail')):
+                    uri = getattr(img, attr)
+                    if uri:
+                        existing = db.reuse(uri=uri)
+                        if existing is None and blob_store is not None:
+                            sha256 = blob_store.get_url(uri)
+                            if sha256 is not None:
+                                existing = db.add_blob(
+                                    fetcher._get_file_name(uri, None, f'{name.format(i)}{suffix}'),
+                                    sha256, {'uri': uri}
+                                )
+                        ret.append((img, attr, uri, existing))
+                        if existing is None:
+                            items.append((uri, f'{name.format(i)}{suffix}'))
+            return ret
+
+        items: List[Tuple[str, str]] = []
+        fanart_slots = plan(info.fanart_images or (), 'fanart_{}')
+        cover_slots = plan([info.cover_image] if info.cover_image else (), 'cover')
+        screenshot_slots = plan(info.screenshot_images or (), 'screenshot_{}')
+
+        # download all the images concurrently into spooled temporary files,
+        # bounded by the host limits of the fetch engine, and then copy them
+        # into the archive in the planned order, such that the archive does
+        # not depend on the completion order.  only the fanart for generating
+        # the cover is read into memory.
+        downloads = fetcher.download_many(items)
+        try:
+            assets = iter(downloads)
+
+            def add_images(slots):
+                for img, attr, uri, name in slots:
+                    if name is None:
+                        a = next(assets)
+                        name = db.add_file(a.file_name, a.file, {'uri': uri},
+                                           sha256=a.sha256)
+                        if blob_store is not None:
+                            blob_store.set_url(uri, a.sha256)
+                        downloaded[name] = a
+                    setattr(img, attr, name)
 
+            def read_image(name):
+                if name in downloaded:
+                    return downloaded[name].read_all()
+                return db.read(name)
+
+            downloaded: Dict[str, DownloadedAsset] = {}
+
+            # fanarts
+            add_images(fanart_slots)
+
+            # cover
+            if info.cover_image is not None:
+                add_images(cover_slots)
+            elif info.fanart_images:
+                info.cover_image = AVInfoImage()
+
+                # generate the cover image from fanart images, if not given.
+                # the crops run in the image pool, off the fetcher threads.
+                def crop_cover(content):
+                    if image_pool is not None:
+                        return image_pool.apply_async(crop_cover_image, (content,)).get
+                    ret = crop_cover_image(content)
+                    return lambda: ret
+
+                crops = []
+                for img, attr, uri, _ in fanart_slots:
+                    if img is not info.fanart_images[0]:
+                        break
+                    name = db.reuse(derived_from=uri)
+                    crops.append((attr, uri, name, None if name is not None else
+                                  crop_cover(read_image(getattr(img, attr)))))
+                for attr, uri, name, get_cover in crops:
+                    if name is None:
+                        cover_name = 'cover.jpg' if attr == 'file' else 'cover.thumbnail.jpg'
+                        name = db.add(cover_name, get_cover(), {'derived_from': uri})
+                    setattr(info.cover_image, attr, name)
+
+            # screenshots
+            add_images(screenshot_slots)
+        finally:
+            for asset in downloads:
+                asset.close()
+
+    # save the meta json
+    meta_dict = info_to_dict(info)
     meta_json = json.dumps(meta_dict, ensure_ascii=False, indent=2, separators=(', ', ': '))
     with codecs.open(os.path.join(parent_dir, f'{base_name}.json'), 'wb', 'utf-8') as f:
         f.write(meta_json)
 
 
-def make_nfo_file(parent_dir: str, base_name: str):
+def make_nfo_file(parent_dir: str,
+                  base_name: str,
+                  blob_store: Optional[BlobStore] = None):
     # load the av info object
     loader = mltk.ConfigLoader(AVInfo)
     loader.load_file(os.path.join(parent_dir, f'{base_name}.json'))
     info = loader.get()
 
-    # load the cover and the fanarts
-    with AssetsDB(os.path.join(parent_dir, f'{base_name}.zip')) as db:
-        def load_image(img: Optional[AVInfoImage]) -> Optional[bytes]:
+    # save the cover and the fanart.  the images in the blob store are
+    # hard-linked instead of copied.
+    with AssetsDB(os.path.join(parent_dir, f'{base_name}.zip'), blob_store) as db:
+        def save_image(img: Optional[AVInfoImage], file_name: str) -> Optional[str]:
             if img is not None:
-                file_name = img.file or img.thumbnail
-                if file_name:
-                    return db.get_content(file_name)
+                name = img.file or img.thumbnail
+                if name:
+                    path = os.path.join(parent_dir, file_name)
+                    sha256 = db.get_blob(name)
+                    if sha256 is not None:
+                        db.blob_store.link(sha256, path)
+                        return file_name
+                    content = db.get_content(name)
+                    if content is not None:
+                        with open(path, 'wb') as f:
+                            f.write(content)
+                        return file_name
 
-        cover = load_image(info.cover_image)
-        fanart = load_image((info.fanart_images and info.fanart_images[0]) or None)
+        cover = save_image(info.cover_image, f'{base_name}.jpg')
+        fanart = save_image((info.fanart_images and info.fanart_images[0]) or None,
+                            f'{base_name}.jpeg')
 
     # generate the nfo file
     # see: https://kodi.wiki/view/NFO_files/Movies
@@ -245,15 +1065,9 @@ def make_nfo_file(parent_dir: str, base_name: str):
         for i, actor in enumerate(info.actors):
             add_node('actor', {'name': actor, 'order': str(i)})
     if cover is not None:
-        file_name = f'{base_name}.jpg'
-        with open(os.path.join(parent_dir, file_name), 'wb') as f:
-            f.write(cover)
-        add_node('thumb', file_name)
+        add_node('thumb', cover)
     if fanart is not None:
-        file_name = f'{base_name}.jpeg'
-        with open(os.path.join(parent_dir, file_name), 'wb') as f:
-            f.write(fanart)
-        add_node('fanart', {'thumb': file_name})
+        add_node('fanart', {'thumb': fanart})
 
     s = etree.tostring(root, pretty_print=True, encoding='utf-8')
     with open(os.path.join(parent_dir, f'{base_name}.nfo'), 'wb') as f:
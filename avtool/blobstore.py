@@ -0,0 +1,156 @@
+"""Content-addressed store of the asset files, shared across the library."""
+import errno
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+from io import BytesIO
+from threading import RLock
+from typing import *
+
+from .utils import *
+
+__all__ = ['BlobStore']
+
+
+class BlobStore(object):
+    """
+    Content-addressed store of the asset files, keyed by SHA-256.
+
+    The blobs are stored as read-only files ``<root>/<h[:2]>/<h[2:]>``,
+    thus identical images are stored only once across the library, and
+    can be hard-linked to anywhere on the same file system.  The store
+    also remembers the hash of the content of each downloaded URL in
+    ``<root>/urls.db``, such that known URLs need not be downloaded again.
+    """
+
+    def __init__(self, root: str):
+        """
+        Construct a new :class:`BlobStore`.
+
+        Args:
+            root: The root directory of the store, created if not exist.
+        """
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+        self._lock = RLock()
+        self._conn = None  # opened on first use, readers of blobs do not need it
+
+    def _get_conn(self):
+        with self._lock:
+            if self._conn is None:
+                self._conn = open_sqlite(os.path.join(self.root, 'urls.db'))
+                with self._conn:
+                    self._conn.execute(
+                        'CREATE TABLE IF NOT EXISTS urls ('
+                        'url TEXT PRIMARY KEY, sha256 TEXT NOT NULL, '
+                        'updated_at REAL NOT NULL)'
+                    )
+            return self._conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def get_path(self, sha256: str) -> str:
+        """Get the path of the blob file."""
+        return os.path.join(self.root, sha256[:2], sha256[2:])
+
+    def has(self, sha256: str) -> bool:
+        return os.path.isfile(self.get_path(sha256))
+
+    def open(self, sha256: str) -> BinaryIO:
+        """Open the blob for reading."""
+        return open(self.get_path(sha256), 'rb')
+
+    def read(self, sha256: str) -> bytes:
+        with self.open(sha256) as f:
+            return f.read()
+
+    def put_file(self,
+                 file: BinaryIO,
+                 sha256: Optional[str] = None) -> Tuple[str, int]:
+        """
+        Store the content of `file`, copied from its beginning.
+
+        Args:
+            file: The binary file object.
+            sha256: The SHA-256 hex digest of the content, if known.
+                If the blob already exists, nothing will be copied.
+
+        Returns:
+            ``(sha256, size)`` of the blob.
+        """
+        if sha256 is not None and self.has(sha256):
+            return sha256, os.path.getsize(self.get_path(sha256))
+
+        # copy into a temporary file, and then move it to the blob path
+        file.seek(0)
+        hasher = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as dst:
+                for chunk in iter(lambda: file.read(65536), b''):
+                    hasher.update(chunk)
+                    size += len(chunk)
+                    dst.write(chunk)
+            os.chmod(tmp_path, 0o444)
+            sha256 = hasher.hexdigest()
+            path = self.get_path(sha256)
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return sha256, size
+
+    def put(self, content: bytes) -> str:
+        """Store `content`, and return its SHA-256 hex digest."""
+        with BytesIO(content) as f:
+            return self.put_file(f)[0]
+
+    def link(self, sha256: str, path: str):
+        """
+        Hard-link the blob to `path`, replacing the existing file.
+        Falls back to copying if hard links are not possible, e.g.,
+        across file systems.
+        """
+        src = self.get_path(sha256)
+        tmp_path = f'{path}.tmp'
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+        try:
+            os.link(src, tmp_path)
+        except OSError as ex:
+            if ex.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+                raise
+            shutil.copyfile(src, tmp_path)
+        os.replace(tmp_path, path)
+
+    def get_url(self, url: str) -> Optional[str]:
+        """Get the hash of the content of `url`, if known and stored."""
+        with self._lock:
+            row = self._get_conn().execute(
+                'SELECT sha256 FROM urls WHERE url = ?', (url,)).fetchone()
+        if row is not None and self.has(row[0]):
+            return row[0]
+
+    def set_url(self, url: str, sha256: str):
+        """Remember the hash of the content of `url`."""
+        with self._lock, self._get_conn() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO urls (url, sha256, updated_at) '
+                'VALUES (?, ?, ?)',
+                (url, sha256, time.time())
+            )
@@ -1,10 +1,15 @@
+import json
+import multiprocessing
 import os
 import shutil
+import sqlite3
 import subprocess
 import sys
+import time
 import traceback
 from contextlib import contextmanager
-from multiprocessing.pool import ThreadPool
+from datetime import datetime
+from multiprocessing.pool import Pool, ThreadPool
 from threading import RLock
 from typing import *
 
@@ -13,10 +18,19 @@ import mltk
 
 from avtool.indexing import JSONIndexer
 from .assets import *
+from .blobstore import *
 from .crawler import *
+from .failcache import *
+from .fetching import *
+from .httpcache import *
+from .probecache import *
+from .ratelimit import *
+from .records import *
 from .renamer import *
+from .scancache import *
 from .scanner import *
 from .transcode import *
+from .watcher import *
 
 __all__ = ['entry']
 
@@ -44,13 +58,167 @@ class AtomicCounter(object):
             return self.value
 
 
-def load_info_by_entry(e: AVEntry) -> AVInfo:
+def load_info_by_entry(e: AVEntryRecord) -> AVInfo:
     base_name = os.path.splitext(e.movie_files[0])[0]
     loader = mltk.ConfigLoader(AVInfo)
     loader.load_file(os.path.join(e.parent_dir, f'{base_name}.json'))
     return loader.get()
 
 
+@contextmanager
+def open_scanner():
+    """Open an :class:`AVScanner` backed by the persistent scan cache."""
+    cache = None
+    try:
+        cache = ScanCache()
+    except (OSError, sqlite3.Error) as ex:
+        print(f'Scan cache is not available, fallback to full scan: {ex}')
+    try:
+        yield AVScanner(cache=cache)
+    finally:
+        if cache is not None:
+            cache.close()
+
+
+@contextmanager
+def open_failure_cache(enabled: bool = True):
+    """Open the persistent :class:`FailureCache`, or :obj:`None` if not available."""
+    cache = None
+    if enabled:
+        try:
+            cache = FailureCache()
+        except (OSError, sqlite3.Error) as ex:
+            print(f'Failure cache is not available: {ex}')
+    try:
+        yield cache
+    finally:
+        if cache is not None:
+            cache.close()
+
+
+@contextmanager
+def open_probe_cache():
+    """Open the persistent :class:`ProbeCache`, or :obj:`None` if not available."""
+    cache = None
+    try:
+        cache = ProbeCache()
+    except (OSError, sqlite3.Error) as ex:
+        print(f'Probe cache is not available: {ex}')
+    try:
+        yield cache
+    finally:
+        if cache is not None:
+            cache.close()
+
+
+@contextmanager
+def open_image_pool(processes: int):
+    """
+    Open the process pool for the image processing, or :obj:`None` if
+    `processes` is zero.  The workers are spawned rather than forked, since
+    the fetch engine runs an event loop thread.
+    """
+    pool = multiprocessing.get_context('spawn').Pool(processes) if processes else None
+    try:
+        yield pool
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+
+@contextmanager
+def open_blob_store(root: Optional[str]):
+    """Open the :class:`BlobStore` at `root`, or :obj:`None` if not specified."""
+    store = BlobStore(root) if root else None
+    try:
+        yield store
+    finally:
+        if store is not None:
+            store.close()
+
+
+@contextmanager
+def open_fetch_engine(http_cache: bool = True,
+                      revalidate: bool = False,
+                      offline: bool = False,
+                      **kwargs):
+    """
+    Open a :class:`FetchEngine` backed by the persistent response cache.
+
+    Args:
+        http_cache: Whether or not to use the response cache?
+        revalidate: Revalidate all the cached responses before use.
+        offline: Serve the requests from the response cache only.
+        \**kwargs: Other arguments passed to :class:`FetchEngine`.
+    """
+    cache = None
+    if http_cache or offline:
+        try:
+            cache = ResponseCache()
+        except (OSError, sqlite3.Error) as ex:
+            print(f'HTTP cache is not available: {ex}')
+        else:
+            if revalidate:
+                cache.ttl = 0
+    try:
+        with FetchEngine(cache=cache, offline=offline, **kwargs) as engine:
+            yield engine
+    finally:
+        if cache is not None:
+            cache.close()
+
+
+http_cache_options = [
+    click.option('--no-http-cache', required=False, default=False, is_flag=True,
+                 help='Do not use the HTTP response cache.'),
+    click.option('--offline', required=False, default=False, is_flag=True,
+                 help='Do not touch the network, serve the pages from the '
+                      'HTTP response cache only.'),
+]
+
+
+def apply_options(options):
+    def wrapper(fn):
+        for option in reversed(options):
+            fn = option(fn)
+        return fn
+    return wrapper
+
+
+rescan_option = click.option(
+    '--rescan', required=False, default=False, is_flag=True,
+    help='Ignore the scan cache and rescan the whole directory tree.')
+
+mirror_option = click.option(
+    '--mirror', 'mirrors', required=False, multiple=True,
+    help='Base URL of a mirror site, may be specified multiple times.  '
+         'The pages are crawled from the mirrors with hedged requests.')
+
+
+def create_crawler(engine: FetchEngine,
+                   parser: str = 'lxml',
+                   mirrors: Sequence[str] = ()) -> AVInfoCrawler:
+    """
+    Create the AV information crawler.
+
+    Args:
+        engine: The fetch engine.
+        parser: The HTML parser backend.
+        mirrors: The base URLs of the mirror sites.  If specified, a
+            :class:`MultiSourceCrawler` is created over the main site
+            and the mirrors.
+    """
+    crawler = JavBusCrawler(engine, parser=parser)
+    if mirrors:
+        crawler = MultiSourceCrawler(
+            [crawler] +
+            [JavBusCrawler(engine, parser=parser, base_url=m) for m in mirrors],
+            engine=engine,
+        )
+    return crawler
+
+
 @contextmanager
 def try_execute(fn):
     try:
@@ -59,6 +227,183 @@ def try_execute(fn):
         print(''.join(traceback.format_exception(*sys.exc_info())).rstrip())
 
 
+def move_entry(e: AVEntryRecord,
+               target_dir: str,
+               input_dir: str,
+               cleanup: bool = True,
+               simulate: bool = False,
+               log_padding: str = ''):
+    """
+    Move the files of an AV entry into `target_dir`.
+
+    Args:
+        e: The AV entry.
+        target_dir: The target directory.
+        input_dir: The input directory, where `e` is discovered.
+        cleanup: Whether or not to remove the source directories under
+            `input_dir` which become empty?
+        simulate: Simulate, do not remove the directories.
+        log_padding: Padding of the log messages.
+    """
+    def get_file_list_without_trivial_files(parent_dir, trivial_files=('.DS_Store', 'Thumbs.db')):
+        return [f for f in os.listdir(parent_dir) if f not in trivial_files]
+
+    # prepare for the move jobs
+    actions = {}
+
+    for i, movie_file in enumerate(e.movie_files):
+        base_name, ext = os.path.splitext(movie_file)
+        if i >= 1:
+            target_file = f'{e.movie_id}-{i}{ext}'
+        else:
+            target_file = f'{e.movie_id}{ext}'
+        target_path = os.path.join(target_dir, target_file)
+        if os.path.exists(target_path):
+            raise IOError(f'Target file already exists: {target_path}')
+        actions[movie_file] = target_path
+
+    if e.asset_files:
+        for asset_file in e.asset_files:
+            base_name, ext = os.path.splitext(asset_file)
+            target_path = os.path.join(target_dir, f'{base_name}{ext}')
+            if os.path.exists(target_path):
+                raise IOError(f'Target file already exists: {target_path}')
+            actions[asset_file] = target_path
+
+    # do execute the moving actions
+    if not os.path.exists(target_dir):
+        os.makedirs(target_dir, exist_ok=True)
+    for source_file, target_path in actions.items():
+        shutil.move(os.path.join(e.parent_dir, source_file), target_path)
+
+    # cleanup source directories
+    if cleanup:
+        the_input_dir = os.path.realpath(os.path.abspath(input_dir))
+        this_dir = os.path.realpath(os.path.abspath(e.parent_dir))
+        while this_dir.startswith(the_input_dir) and this_dir != the_input_dir and \
+                not get_file_list_without_trivial_files(this_dir):
+            print(log_padding + f'  Remove dir: {this_dir}')
+            if not simulate:
+                shutil.rmtree(this_dir)
+            this_dir = os.path.split(this_dir)[0]
+
+
+def has_entry_assets(e: AVEntryRecord, allow_partial: bool = False) -> bool:
+    """
+    Whether or not the assets of an AV entry are present?
+
+    Args:
+        e: The AV entry.
+        allow_partial: Whether or not to accept the assets whose information
+            is partial (see :attr:`AVInfo.partial_fields`)?  If :obj:`False`,
+            such assets are regarded as absent, so that the detail page
+            is fetched for the missing fields.
+    """
+    base_name = os.path.splitext(e.movie_files[0])[0]
+    info_path = os.path.join(e.parent_dir, f'{base_name}.json')
+    if not all(os.path.isfile(path)
+               for path in (info_path, os.path.join(e.parent_dir, f'{base_name}.zip'))):
+        return False
+    if allow_partial:
+        return True
+    try:
+        with open(info_path, 'rb') as f:
+            return not json.load(f).get('partial_fields')
+    except (OSError, ValueError, AttributeError):
+        return False  # a broken info file is fetched again
+
+
+def fetch_entry_assets(e: AVEntryRecord,
+                       force: bool = False,
+                       simulate: bool = False,
+                       crawler: Optional[AVInfoCrawler] = None,
+                       fetcher: Optional[AssetsFetcher] = None,
+                       failure_cache: Optional[FailureCache] = None,
+                       blob_store: Optional[BlobStore] = None,
+                       image_pool: Optional[Pool] = None,
+                       info: Optional[Union[AVInfo, Exception]] = None) -> bool:
+    """
+    Fetch the information and the assets of an AV entry.
+
+    Args:
+        e: The AV entry.
+        force: Force fetching the assets even if present.
+        simulate: Simulate, do not fetch.
+        crawler: The AV information crawler.  Defaults to :class:`JavBusCrawler`.
+        fetcher: The assets fetcher.
+        failure_cache: If specified, the crawling failures of the movie
+            ID are recorded into it, and a success clears the record.
+        blob_store: If specified, store the images in this blob store.
+        image_pool: The process pool for the image processing.
+        info: The information already fetched (e.g., by
+            :meth:`JavBusCrawler.fetch_bulk`), or the error of fetching it.
+            If specified, `crawler` is not used.
+
+    Returns:
+        Whether or not the assets are fetched, i.e., not skipped.
+    """
+    # the failed requests are retried individually by the fetch engine
+    base_name = os.path.splitext(e.movie_files[0])[0]
+    if force or not has_entry_assets(e):
+        if not simulate:
+            try:
+                if info is None:
+                    info = (crawler or JavBusCrawler()).fetch(e.movie_id)
+                elif isinstance(info, Exception):
+                    raise info
+            except Exception as ex:
+                if failure_cache is not None:
+                    failure_cache.add_failure(
+                        e.movie_id, classify_crawl_error(ex), str(ex))
+                raise
+            if failure_cache is not None:
+                failure_cache.remove(e.movie_id)
+            # the images already in the existing archive are kept
+            make_av_assets(info, e.parent_dir, base_name, fetcher=fetcher,
+                           update=True, blob_store=blob_store,
+                           image_pool=image_pool)
+        return True
+    else:
+        return False
+
+
+def transcode_entry(e: AVEntryRecord,
+                    delete_input: bool = True,
+                    simulate: bool = False,
+                    log_padding: str = ''):
+    """
+    Transcode the movie files of an AV entry into a single mp4 file.
+
+    Args:
+        e: The AV entry.
+        delete_input: Whether or not to delete the input files?
+        simulate: Simulate, do not execute.
+        log_padding: Padding of the log messages.
+    """
+    input_files, output_file = get_entry_transcode_files(e)
+    if not simulate:
+        transcode_movies(input_files, output_file)
+        if delete_input:
+            delete_transcoded_inputs(input_files, output_file, log_padding)
+
+
+def get_entry_transcode_files(e: AVEntryRecord) -> Tuple[List[str], str]:
+    """Get the input files and the output file of transcoding an AV entry."""
+    base_name = os.path.splitext(e.movie_files[0])[0]
+    input_files = [os.path.join(e.parent_dir, n) for n in e.movie_files]
+    output_file = os.path.join(e.parent_dir, f'{base_name}.mp4')
+    return input_files, output_file
+
+
+def delete_transcoded_inputs(input_files: Sequence[str],
+                             output_file: str,
+                             log_padding: str = ''):
+    for input_file in input_files:
+        if not os.path.samefile(input_file, output_file):
+            print(log_padding + f'  Remove: {input_file}')
+            os.remove(input_file)
+
+
 @click.group()
 def entry():
     """AV movies command line tool."""
@@ -71,105 +416,98 @@ def entry():
               help='Simulate, do not execute.')
 @click.option('-C', '--cleanup', required=False, default=True, is_flag=True,
               help='Cleanup empty directories.')
+@rescan_option
 @click.argument('output-dir', required=True)
-def collect(input_dir, output_dir, simulate, cleanup):
+def collect(input_dir, output_dir, simulate, cleanup, rescan):
     # gather the entries
-    entries: List[AVEntry] = []
-    scanner = AVScanner()
-    for e in scanner.find_iter(input_dir):
-        entries.append(e)
-
-    def get_file_list_without_trivial_files(parent_dir, trivial_files=('.DS_Store', 'Thumbs.db')):
-        return [f for f in os.listdir(parent_dir) if f not in trivial_files]
-
-    def move_entry(e: AVEntry, target_dir: str):
-        # prepare for the move jobs
-        actions = {}
-
-        for i, movie_file in enumerate(e.movie_files):
-            base_name, ext = os.path.splitext(movie_file)
-            if i >= 1:
-                target_file = f'{e.movie_id}-{i}{ext}'
-            else:
-                target_file = f'{e.movie_id}{ext}'
-            target_path = os.path.join(target_dir, target_file)
-            if os.path.exists(target_path):
-                raise IOError(f'Target file already exists: {target_path}')
-            actions[movie_file] = target_path
-
-        if e.asset_files:
-            for asset_file in e.asset_files:
-                base_name, ext = os.path.splitext(asset_file)
-                target_path = os.path.join(target_dir, f'{base_name}{ext}')
-                if os.path.exists(target_path):
-                    raise IOError(f'Target file already exists: {target_path}')
-                actions[asset_file] = target_path
-
-        # do execute the moving actions
-        if not os.path.exists(target_dir):
-            os.makedirs(target_dir, exist_ok=True)
-        for source_file, target_path in actions.items():
-            shutil.move(os.path.join(e.parent_dir, source_file), target_path)
-
-        # cleanup source directories
-        if cleanup:
-            the_input_dir = os.path.realpath(os.path.abspath(input_dir))
-            this_dir = os.path.realpath(os.path.abspath(e.parent_dir))
-            while this_dir.startswith(the_input_dir) and this_dir != the_input_dir and \
-                    not get_file_list_without_trivial_files(this_dir):
-                print(index_fmt.left_padding() + f'  Remove dir: {this_dir}')
-                if not simulate:
-                    shutil.rmtree(this_dir)
-                this_dir = os.path.split(this_dir)[0]
+    entries: List[AVEntryRecord] = []
+    with open_scanner() as scanner:
+        for e in scanner.find_iter(input_dir, rescan=rescan):
+            entries.append(e)
 
     index_fmt = IndexFormatter(len(entries))
     for i, e in enumerate(entries, 1):
         target_dir = os.path.join(output_dir, e.movie_id)
         print(f'{index_fmt(i)}: {e} -> {target_dir}')
         if not simulate:
-            try_execute(lambda: move_entry(e, target_dir))
+            try_execute(lambda: move_entry(
+                e, target_dir, input_dir, cleanup=cleanup, simulate=simulate,
+                log_padding=index_fmt.left_padding()
+            ))
 
 
 @entry.command('assets')
 @click.option('-t', '--thread-num', default=10, required=True, type=click.INT,
               help='The number of fetcher threads.')
+@click.option('--max-connections', default=100, required=False, type=click.INT,
+              help='The maximum number of open HTTP connections.')
+@click.option('--max-per-host', default=8, required=False, type=click.INT,
+              help='The maximum number of concurrent requests to a host.')
+@click.option('--rate', default=None, required=False, type=click.FLOAT,
+              help='The maximum number of requests per second to a host.')
+@click.option('--retries', default=3, required=False, type=click.INT,
+              help='The maximum number of retries of a failed request.')
 @click.option('-F', '--force', default=False, required=True, is_flag=True,
-              help='Force fetching the assets even if present.')
+              help='Force fetching the assets even if present.  The cached '
+                   'pages are revalidated, the previously failed movie IDs '
+                   'are retried, and only the new images are downloaded.')
 @click.option('-S', '--simulate', required=False, default=False, is_flag=True,
               help='Simulate, do not execute.')
+@click.option('--blob-store', required=False, default=None,
+              help='Store the images in this content-addressed directory, '
+                   'shared by all the movies, instead of in the archives.  '
+                   'Identical images are stored once, and hard-linked by '
+                   'the nfo command.')
+@click.option('--image-processes', default=2, required=False, type=click.INT,
+              help='The number of processes for cropping the covers.  '
+                   'Zero to crop on the fetcher threads.')
+@click.option('--bulk', required=False, default=False, is_flag=True,
+              help='Fill the information from the series, studio and actor '
+                   'listing pages where possible, and fetch the detail pages '
+                   'only for the movies still lacking any required field.  '
+                   'The information filled from the listings is marked as '
+                   'partial, and is completed from the detail pages by the '
+                   'later runs.')
+@click.option('--field', 'fields', required=False, multiple=True,
+              type=click.Choice(sorted(set(AVInfo.__annotations__) - {'partial_fields'})),
+              help='The fields required in bulk mode, may be specified '
+                   'multiple times.  Defaults to the fields that the listing '
+                   'pages provide.')
+@apply_options(http_cache_options)
+@mirror_option
+@rescan_option
 @click.argument('work-dir', default='.', required=False)
-def fetch_assets(work_dir, thread_num, force, simulate):
+def fetch_assets(work_dir, thread_num, max_connections, max_per_host, rate,
+                 retries, force, simulate, blob_store, image_processes, bulk,
+                 fields, no_http_cache, offline, mirrors, rescan):
+    if bulk and mirrors:
+        raise click.UsageError('--bulk cannot be used with --mirror.')
+
     # gather movie files
-    scanner = AVScanner()
-    entries = list(scanner.find_iter(work_dir))
+    with open_scanner() as scanner:
+        entries = list(scanner.find_iter(work_dir, rescan=rescan))
     atomic_counter = AtomicCounter(len(entries))
     index_fmt = IndexFormatter(len(entries))
     print(f'Submitted {len(entries)} jobs to queue.')
 
     # fetch the assets
-    def fetch_asset_for(e: AVEntry, retry: int = 3):
+    def fetch_asset_for(e: AVEntryRecord):
         try:
-            while True:
-                try:
-                    base_name = os.path.splitext(e.movie_files[0])[0]
-                    asset_files = [os.path.join(e.parent_dir, f'{base_name}.{ext}')
-                                   for ext in ('zip', 'json')]
-                    if force or not all(os.path.isfile(asset_file)
-                                        for asset_file in asset_files):
-                        if not simulate:
-                            make_av_assets(
-                                JavBusCrawler().fetch(e.movie_id),
-                                e.parent_dir,
-                                base_name,
-                            )
-                        msg = f'finished: {e}'
-                    else:
-                        msg = f'skipped: {e}'
-                    break
-                except Exception:
-                    retry -= 1
-                    if retry < 0:
-                        raise
+            failure = None
+            if failure_cache is not None and not force:
+                failure = failure_cache.should_skip(e.movie_id)
+            if failure is not None:
+                retry_time = datetime.fromtimestamp(failure.retry_at)
+                msg = (f'skipped: {e}\n  Failed {failure.failures} time(s) '
+                       f'with {failure.reason}, retry after {retry_time:%Y-%m-%d %H:%M}')
+            elif fetch_entry_assets(e, force=force, simulate=simulate,
+                                    crawler=crawler, fetcher=fetcher,
+                                    failure_cache=failure_cache,
+                                    blob_store=store, image_pool=image_pool,
+                                    info=prefetched.get(e.movie_id)):
+                msg = f'finished: {e}'
+            else:
+                msg = f'skipped: {e}'
         except Exception:
             msg = (
                 f'failed: {e}\n' +
@@ -177,9 +515,81 @@ def fetch_assets(work_dir, thread_num, force, simulate):
             )
         print(f'{index_fmt(atomic_counter.add_get(-1) + 1)}: {msg}')
 
-    thread_pool = ThreadPool(thread_num)
-    thread_pool.map(fetch_asset_for, entries)
-    thread_pool.close()
+    # the connections are shared among all the threads.  the failures in
+    # offline mode are not recorded, since they are just cache misses
+    with open_fetch_engine(http_cache=not no_http_cache, revalidate=force,
+                           offline=offline, max_connections=max_connections,
+                           max_per_host=max_per_host, rate=rate,
+                           retry=RetryPolicy(max_retries=retries)) as engine, \
+            open_failure_cache(enabled=not offline) as failure_cache, \
+            open_blob_store(blob_store) as store, \
+            open_image_pool(0 if simulate else image_processes) as image_pool:
+        crawler = create_crawler(engine, mirrors=mirrors)
+        fetcher = AssetsFetcher(engine)
+
+        # in bulk mode, the information of the movies to be fetched is
+        # crawled at once, before the assets are downloaded.  the movies
+        # with partial information fetch their detail pages instead.
+        prefetched = {}
+        if bulk and not simulate:
+            movie_ids = [
+                e.movie_id for e in entries
+                if (force or not has_entry_assets(e, allow_partial=True)) and
+                (force or failure_cache is None or
+                 failure_cache.should_skip(e.movie_id) is None)
+            ]
+            if movie_ids:
+                print(f'Crawling {len(movie_ids)} movies in bulk.')
+                prefetched = dict(zip(
+                    movie_ids,
+                    JavBusCrawler(engine).fetch_bulk(movie_ids, fields=fields or None)
+                ))
+
+        thread_pool = ThreadPool(thread_num)
+        thread_pool.map(fetch_asset_for, entries)
+        thread_pool.close()
+
+
+@entry.command('crawl')
+@click.option('--parser', required=False, default='lxml',
+              type=click.Choice(sorted(JavBusCrawler.PARSERS)),
+              help='The HTML parser backend.')
+@click.option('--bulk', required=False, default=False, is_flag=True,
+              help='Fill the information from the series, studio and actor '
+                   'listing pages where possible, which saves most of the '
+                   'detail page requests.')
+@click.option('--field', 'fields', required=False, multiple=True,
+              type=click.Choice(sorted(set(AVInfo.__annotations__) - {'partial_fields'})),
+              help='The fields required in bulk mode, may be specified '
+                   'multiple times.  Defaults to the fields that the listing '
+                   'pages provide.')
+@click.option('--from-dir', required=False, default=None,
+              help='Crawl the movies found in this directory.')
+@apply_options(http_cache_options)
+@mirror_option
+@click.argument('movie-ids', nargs=-1, required=False)
+def crawl(movie_ids, parser, bulk, fields, from_dir, no_http_cache, offline,
+          mirrors):
+    """Crawl and print the information of movies."""
+    movie_ids = list(movie_ids)
+    if from_dir is not None:
+        with open_scanner() as scanner:
+            movie_ids.extend(e.movie_id for e in scanner.find_iter(from_dir))
+    if bulk and mirrors:
+        raise click.UsageError('--bulk cannot be used with --mirror.')
+
+    with open_fetch_engine(http_cache=not no_http_cache, offline=offline) as engine:
+        if bulk:
+            crawler = JavBusCrawler(engine, parser=parser)
+            infos = crawler.fetch_bulk(movie_ids, fields=fields or None)
+        else:
+            crawler = create_crawler(engine, parser=parser, mirrors=mirrors)
+            infos = crawler.fetch_many(movie_ids)
+        for movie_id, info in zip(movie_ids, infos):
+            if isinstance(info, Exception):
+                print(f'{movie_id}: failed: {info}')
+            else:
+                print(json.dumps(info_to_dict(info), ensure_ascii=False, indent=2))
 
 
 @entry.command('nfo')
@@ -187,11 +597,12 @@ def fetch_assets(work_dir, thread_num, force, simulate):
               help='Force fetching the assets even if present.')
 @click.option('-S', '--simulate', required=False, default=False, is_flag=True,
               help='Simulate, do not execute.')
+@rescan_option
 @click.argument('work-dir', default='.', required=False)
-def make_nfo(work_dir, force, simulate):
+def make_nfo(work_dir, force, simulate, rescan):
     # gather movie files
-    scanner = AVScanner()
-    entries = list(scanner.find_iter(work_dir))
+    with open_scanner() as scanner:
+        entries = list(scanner.find_iter(work_dir, rescan=rescan))
     index_fmt = IndexFormatter(len(entries))
 
     # make nfo files
@@ -210,29 +621,75 @@ def make_nfo(work_dir, force, simulate):
               help='Do not delete input files.')
 @click.option('-S', '--simulate', required=False, default=False, is_flag=True,
               help='Simulate, do not execute.')
+@click.option('-j', '--slots', default=None, required=False, type=click.INT,
+              help='The number of CPU slots shared by the parallel jobs.  '
+                   'Defaults to the CPU count.')
+@click.option('--threads', default=4, required=False, type=click.INT,
+              help='The number of threads (and slots) of each re-encoding '
+                   'ffmpeg process.')
+@click.option('--copy-weight', default=1, required=False, type=click.INT,
+              help='The number of slots of each job copying the video.')
+@click.option('--segments', default=1, required=False, type=click.INT,
+              help='Split a long re-encode at the keyframes into up to this '
+                   'number of segments, encoded in parallel.')
+@click.option('--min-segment-duration', default=600., required=False,
+              type=click.FLOAT,
+              help='The minimum duration of a segment, in seconds.')
+@rescan_option
 @click.argument('work-dir', default='.', required=False)
-def transcode(work_dir, no_delete_input, simulate):
+def transcode(work_dir, no_delete_input, simulate, slots, threads, copy_weight,
+              segments, min_segment_duration, rescan):
     # gather movie files
-    scanner = AVScanner()
-    entries = list(scanner.find_iter(work_dir))
+    with open_scanner() as scanner:
+        entries = list(scanner.find_iter(work_dir, rescan=rescan))
     index_fmt = IndexFormatter(len(entries))
 
-    # do transcode
-    def do_transcode(input_files: Sequence[str], output_file: str):
-        if not simulate:
-            transcode_movies(input_files, output_file)
+    # probe the movie files and plan the jobs.  the unchanged files are not
+    # probed again, thus the transcoded entries are skipped without ffprobe.
+    scheduler = TranscodeScheduler(slots=slots, threads=threads,
+                                   copy_weight=copy_weight, max_segments=segments,
+                                   min_segment_duration=min_segment_duration)
+    planned: List[Tuple[int, AVEntryRecord, TranscodePlan]] = []
+    with open_probe_cache() as probe_cache:
+        for i, e in enumerate(entries, 1):
+            try:
+                plan = plan_transcode(*get_entry_transcode_files(e),
+                                      probe_cache=probe_cache)
+            except Exception:
+                print(f'{index_fmt(i)}: failed: {e}\n' +
+                      ''.join(traceback.format_exception(*sys.exc_info())).rstrip())
+                continue
+            if plan.is_noop:
+                print(f'{index_fmt(i)}: skipped: {e}')
+                continue
+            planned.append((i, e, plan))
+            if simulate:
+                kind = 'encode video' if plan.video_need_transcode else 'copy video'
+                kind += ', encode audio' if plan.audio_need_transcode else ''
+                if scheduler.get_segments(plan) > 1:
+                    kind += f' in {scheduler.get_segments(plan)} segments'
+                print(f'{index_fmt(i)}: {kind}, {plan.duration:.0f}s, '
+                      f'{scheduler.get_weight(plan)} slot(s): {e}')
+    if simulate:
+        return
+
+    # do transcode, the cheap jobs first
+    def on_start(k):
+        i, e, plan = planned[k]
+        print(f'{index_fmt(i)}: start: {e}')
+
+    def on_done(k, ex):
+        i, e, plan = planned[k]
+        if ex is not None:
+            print(f'{index_fmt(i)}: failed: {e}\n' +
+                  ''.join(traceback.format_exception(type(ex), ex, ex.__traceback__)).rstrip())
+        else:
+            print(f'{index_fmt(i)}: finished: {e}')
             if not no_delete_input:
-                for input_file in input_files:
-                    if not os.path.samefile(input_file, output_file):
-                        print(index_fmt.left_padding() + f'  Remove: {input_file}')
-                        os.remove(input_file)
+                try_execute(lambda: delete_transcoded_inputs(
+                    plan.input_files, plan.output_file, index_fmt.left_padding()))
 
-    for i, e in enumerate(entries, 1):
-        base_name = os.path.splitext(e.movie_files[0])[0]
-        print(f'{index_fmt(i)}: {e}')
-        input_files = [os.path.join(e.parent_dir, n) for n in e.movie_files]
-        output_file = os.path.join(e.parent_dir, f'{base_name}.mp4')
-        try_execute(lambda: do_transcode(input_files, output_file))
+    scheduler.run([plan for _, _, plan in planned], on_start=on_start, on_done=on_done)
 
 
 @entry.command('rename')
@@ -241,15 +698,16 @@ def transcode(work_dir, no_delete_input, simulate):
 @click.option('-i', '--source-dir', default='.', required=False)
 @click.option('-S', '--simulate', required=False, default=False, is_flag=True,
               help='Simulate, do not execute.')
+@rescan_option
 @click.argument('output-dir', required=True)
-def rename(source_dir, output_dir, overwrite, simulate):
+def rename(source_dir, output_dir, overwrite, simulate, rescan):
     # gather movie files
-    scanner = AVScanner()
-    entries = list(scanner.find_iter(source_dir))
+    with open_scanner() as scanner:
+        entries = list(scanner.find_iter(source_dir, rescan=rescan))
     index_fmt = IndexFormatter(len(entries))
 
     # do rename
-    def do_rename(e: AVEntry):
+    def do_rename(e: AVEntryRecord):
         info = load_info_by_entry(e)
         renamer.rename(e, info, overwrite=overwrite)
 
@@ -263,29 +721,72 @@ def rename(source_dir, output_dir, overwrite, simulate):
 @entry.command('index')
 @click.option('-i', '--input-dir', required=True, default='.',
               help='Specify the input files directory.')
+@rescan_option
 @click.argument('output-file', required=True, default='index.json')
-def index(input_dir, output_file):
+def index(input_dir, output_file, rescan):
     # gather movie files
-    scanner = AVScanner()
-    entries = list(scanner.find_iter(input_dir))
+    with open_scanner() as scanner:
+        entries = list(scanner.find_iter(input_dir, rescan=rescan))
     index_fmt = IndexFormatter(len(entries))
 
-    # do index
-    def index_entry(e: AVEntry):
-        info = load_info_by_entry(e)
-        json_indexer.add(e, info)
-
-    with JSONIndexer(output_file) as json_indexer:
+    # do index.  the durations known to the probe cache are included,
+    # without probing the movie files.
+    def index_entry(e: AVEntryRecord):
+        base_name = os.path.splitext(e.movie_files[0])[0]
+        info = load_info_record(os.path.join(e.parent_dir, f'{base_name}.json'))
+        duration = None
+        if probe_cache is not None:
+            durations = [probe_cache.get_duration(os.path.join(e.parent_dir, n))
+                         for n in e.movie_files]
+            if None not in durations:
+                duration = sum(durations)
+        json_indexer.add(e, info, duration=duration)
+
+    with JSONIndexer(output_file) as json_indexer, \
+            open_probe_cache() as probe_cache:
         for i, e in enumerate(entries):
             print(f'{index_fmt(i)}: {e}')
             try_execute(lambda: index_entry(e))
 
 
+@entry.command('failures')
+@click.option('--reason', required=False, default=None,
+              type=click.Choice([NOT_FOUND, PARSE_ERROR, NETWORK_ERROR]),
+              help='List only the failures of this reason.')
+@click.option('--forget', required=False, multiple=True,
+              help='Forget the failures of a movie ID, may be specified '
+                   'multiple times.')
+@click.option('--clear', required=False, default=False, is_flag=True,
+              help='Forget all the failures.')
+def failures(reason, forget, clear):
+    """List the movie IDs which have failed to be crawled."""
+    with open_failure_cache() as failure_cache:
+        if failure_cache is None:
+            return
+        if clear:
+            failure_cache.clear()
+        for movie_id in forget:
+            failure_cache.remove(movie_id)
+
+        records = failure_cache.list(reason=reason)
+        now = time.time()
+        for r in records:
+            last_failed = datetime.fromtimestamp(r.last_failed)
+            retry_at = datetime.fromtimestamp(r.retry_at)
+            status = 'due' if r.is_expired(now) else f'retry after {retry_at:%Y-%m-%d %H:%M}'
+            print(f'{r.movie_id}: {r.reason} x{r.failures}, last failed '
+                  f'{last_failed:%Y-%m-%d %H:%M}, {status}')
+            if r.message:
+                print(f'  {r.message}')
+        print(f'{len(records)} failure(s).')
+
+
 @entry.command('auto')
 @click.option('-i', '--input-dir', required=True, default='.',
               help='Specify the input files directory.')
+@rescan_option
 @click.argument('output-dir', required=True)
-def auto_jobs(input_dir, output_dir):
+def auto_jobs(input_dir, output_dir, rescan):
     input_dir = os.path.abspath(input_dir)
     output_dir = os.path.abspath(output_dir)
 
@@ -297,14 +798,91 @@ def auto_jobs(input_dir, output_dir):
         print('')
         print(f'Exit code: {exit_code}')
 
+    scan_args = ['--rescan'] if rescan else []
+
     # collect
-    check_call(['avtool', 'collect', '-i', input_dir, output_dir])
+    check_call(['avtool', 'collect', '-i', input_dir] + scan_args + [output_dir])
     # fetch-assets
-    check_call(['avtool', 'assets'], cwd=output_dir)
+    check_call(['avtool', 'assets'] + scan_args, cwd=output_dir)
     # make-nfo
-    check_call(['avtool', 'nfo'], cwd=output_dir)
+    check_call(['avtool', 'nfo'] + scan_args, cwd=output_dir)
     # transcode
-    check_call(['avtool', 'transcode'], cwd=output_dir)
+    check_call(['avtool', 'transcode'] + scan_args, cwd=output_dir)
+
+
+@entry.command('watch')
+@click.option('-i', '--input-dir', required=True, default='.',
+              help='Specify the input files directory.')
+@click.option('--settle', required=False, default=10., type=click.FLOAT,
+              help='Seconds without file system events in a directory '
+                   'before processing it.')
+@click.option('--polling', required=False, default=False, is_flag=True,
+              help='Poll the directory tree instead of using inotify.')
+@click.option('--poll-interval', required=False, default=30., type=click.FLOAT,
+              help='Seconds between two polls, if polling.')
+@click.option('--no-initial-scan', required=False, default=False, is_flag=True,
+              help='Do not process the movies already in the input directory.')
+@click.option('--no-delete-input', default=False, required=False, is_flag=True,
+              help='Do not delete input files when transcoding.')
+@click.option('--retry-interval', required=False, default=60., type=click.FLOAT,
+              help='Seconds before retrying a collected movie whose assets '
+                   'or transcoding failed, doubled on each failure.')
+@click.argument('output-dir', required=True)
+def watch(input_dir, output_dir, settle, polling, poll_interval,
+          no_initial_scan, no_delete_input, retry_interval):
+    """Watch the input directory, and process new movies as they land."""
+    # the collected entries which failed, retried by the periodic ticks
+    # with exponential backoff: movie_id -> (entry, failures, retry time)
+    failed_entries: Dict[str, Tuple[AVEntryRecord, int, float]] = {}
+
+    def process_entry(e: AVEntryRecord):
+        # collect
+        target_dir = os.path.join(output_dir, e.movie_id)
+        print(f'collect: {e} -> {target_dir}')
+        move_entry(e, target_dir, input_dir, cleanup=True)
+
+        # the collected entry, matched by the directory matchers
+        for c in scanner.scan_dir(target_dir)[0]:
+            process_collected_entry(c)
+
+    def process_collected_entry(c: AVEntryRecord, failures: int = 0):
+        try:
+            print(f'assets: {c}')
+            fetch_entry_assets(c, failure_cache=failure_cache)
+            base_name = os.path.splitext(c.movie_files[0])[0]
+            if not os.path.exists(os.path.join(c.parent_dir, f'{base_name}.nfo')):
+                print(f'nfo: {c}')
+                make_nfo_file(c.parent_dir, base_name)
+            print(f'transcode: {c}')
+            transcode_entry(c, delete_input=not no_delete_input)
+        except Exception:
+            retry_at = time.monotonic() + retry_interval * 2 ** min(failures, 8)
+            failed_entries[c.movie_id] = (c, failures + 1, retry_at)
+            raise
+
+    def retry_failed_entries():
+        now = time.monotonic()
+        for movie_id, (c, failures, retry_at) in list(failed_entries.items()):
+            if not os.path.isdir(c.parent_dir):
+                del failed_entries[movie_id]  # removed by the user
+            elif now >= retry_at and (failure_cache is None or
+                                      failure_cache.should_skip(movie_id) is None):
+                # rescan, since the files may have changed by the failed job
+                del failed_entries[movie_id]
+                for e in scanner.scan_dir(c.parent_dir)[0]:
+                    print(f'retry: {e}')
+                    try_execute(lambda: process_collected_entry(e, failures))
+
+    with open_scanner() as scanner, open_failure_cache() as failure_cache:
+        watcher = AVWatcher(
+            input_dir, scanner, settle_seconds=settle, polling=polling,
+            poll_interval=poll_interval,
+        )
+        print(f'Watching {watcher.root_dir} ...')
+        for e in watcher.iter_entries(initial_scan=not no_initial_scan,
+                                      on_tick=retry_failed_entries,
+                                      tick_interval=min(retry_interval, 60.)):
+            try_execute(lambda: process_entry(e))
 
 
 if __name__ == '__main__':
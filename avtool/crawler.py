@@ -1,14 +1,19 @@
+import asyncio
+import re
 import time
-
-import requests
+from collections import deque
 from typing import *
+from urllib.parse import urljoin, urlsplit
 
 import mltk
 from bs4 import BeautifulSoup
+from lxml import etree, html as lxml_html
+
+from .fetching import *
 
 __all__ = [
     'AVInfoImage', 'AVInfo',
-    'AVInfoCrawler', 'JavBusCrawler',
+    'AVInfoCrawler', 'JavBusCrawler', 'SourceStats', 'MultiSourceCrawler',
 ]
 
 
@@ -71,6 +76,14 @@ class AVInfo(mltk.Config):
     info_born_time: Optional[float]
     """Timestamp when this information object is generated."""
 
+    partial_fields: Optional[List[str]]
+    """
+    The fields provided, if this information is partial, e.g., filled
+    from the listing pages by :meth:`JavBusCrawler.fetch_bulk`.  The
+    detail page should be fetched for the other fields.  :obj:`None` if
+    complete.
+    """
+
 
 class AVInfoCrawler(object):
     """Base class for all AVInfo crawlers."""
@@ -79,9 +92,233 @@ class AVInfoCrawler(object):
         """Fetch the information of a specified movie."""
         raise NotImplementedError()
 
+    async def fetch_async(self, movie_id: str) -> AVInfo:
+        """
+        Fetch the information of a specified movie in a coroutine.
+
+        The default implementation runs :meth:`fetch` in the default
+        executor of the running loop.
+        """
+        return await asyncio.get_event_loop().run_in_executor(
+            None, self.fetch, movie_id)
+
+    async def fetch_timed_async(self, movie_id: str) -> Tuple[AVInfo, Optional[float]]:
+        """
+        Fetch AV info in a coroutine, along with the network latency.
+
+        The default implementation times the whole :meth:`fetch_async`.
+
+        Returns:
+            ``(info, latency)``, where `latency` is in seconds, or
+            :obj:`None` if no request has been sent, e.g., served from
+            the response cache.
+        """
+        start_time = time.monotonic()
+        info = await self.fetch_async(movie_id)
+        return info, time.monotonic() - start_time
+
+    def fetch_many(self,
+                   movie_ids: Iterable[str],
+                   engine: Optional[FetchEngine] = None
+                   ) -> List[Union[AVInfo, Exception]]:
+        """
+        Fetch the information of many movies concurrently.
+
+        Args:
+            movie_ids: The movie IDs.
+            engine: The fetch engine whose loop drives the coroutines.
+                Defaults to the engine of this crawler if it has one,
+                otherwise :func:`get_default_engine()`.
+
+        Returns:
+            The information objects, or the errors, in the order of
+            `movie_ids`.
+        """
+        async def f():
+            return await asyncio.gather(
+                *(self.fetch_async(movie_id) for movie_id in movie_ids),
+                return_exceptions=True,
+            )
+        engine = engine or getattr(self, 'engine', None) or get_default_engine()
+        return engine.run(f())
+
+
+class _JavBusSoupPage(object):
+    """Detail page of javbus.com, parsed by BeautifulSoup."""
+
+    def __init__(self, content: bytes):
+        self.tree = BeautifulSoup(content, features='html.parser')
+
+    def title(self) -> str:
+        return self.tree.select_one('div.container > h3').text
+
+    def info_rows(self) -> list:
+        info_table = self.tree.select_one('div.container > div.row.movie > div.info')
+        return info_table.select('p')
+
+    def row_text(self, row) -> str:
+        return row.text
+
+    def row_genres(self, row) -> List[str]:
+        return [e.text for e in row.select('span.genre')]
+
+    def fanart_image(self) -> Tuple[str, str]:
+        a = self.tree.select_one('div.container > div.row.movie a.bigImage')
+        return a['href'], a.select_one('img')['src']
+
+    def screenshot_images(self) -> List[Tuple[str, str]]:
+        return [
+            (a['href'], a.select_one('img')['src'])
+            for a in self.tree.select('div.container > div#sample-waterfall > a.sample-box')
+        ]
+
+    def info_links(self) -> List[Tuple[str, str]]:
+        return [
+            (a['href'], a.text)
+            for a in self.tree.select('div.container > div.row.movie > div.info a[href]')
+        ]
+
+    def movie_boxes(self) -> List[Tuple[str, str, List[str]]]:
+        ret = []
+        for a in self.tree.select('div#waterfall a.movie-box'):
+            img = a.select_one('div.photo-frame img')
+            ret.append((
+                img.get('title', '') if img is not None else '',
+                img.get('src', '') if img is not None else '',
+                [d.text for d in a.select('div.photo-info date')],
+            ))
+        return ret
+
+    def next_page(self) -> Optional[str]:
+        a = self.tree.select_one('ul.pagination a#next')
+        if a is not None:
+            return a.get('href')
+
+
+def _has_class(name: str) -> str:
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+class _JavBusLxmlPage(object):
+    """
+    Detail page of javbus.com, parsed by lxml with precompiled XPaths.
+
+    The XPaths are equivalent to the CSS selectors of
+    :class:`_JavBusSoupPage`, and must be kept in sync with them.
+    """
+
+    _MOVIE_ROW = (f"//div[{_has_class('container')}]"
+                  f"/div[{_has_class('row')} and {_has_class('movie')}]")
+    TITLE = etree.XPath(f"(//div[{_has_class('container')}]/h3)[1]")
+    INFO_ROWS = etree.XPath(f"({_MOVIE_ROW}/div[{_has_class('info')}])[1]//p")
+    GENRES = etree.XPath(f".//span[{_has_class('genre')}]")
+    FANART_IMAGE = etree.XPath(f"({_MOVIE_ROW}//a[{_has_class('bigImage')}])[1]")
+    SCREENSHOT_IMAGES = etree.XPath(
+        f"//div[{_has_class('container')}]/div[@id='sample-waterfall']"
+        f"/a[{_has_class('sample-box')}]"
+    )
+    IMG_SRC = etree.XPath('(.//img)[1]/@src')
+    TEXT = etree.XPath('string()')
+    INFO_LINKS = etree.XPath(f"({_MOVIE_ROW}/div[{_has_class('info')}])[1]//a[@href]")
+    MOVIE_BOXES = etree.XPath(f"//div[@id='waterfall']//a[{_has_class('movie-box')}]")
+    BOX_IMG = etree.XPath(f"(.//div[{_has_class('photo-frame')}]//img)[1]")
+    BOX_DATES = etree.XPath(f".//div[{_has_class('photo-info')}]//date")
+    NEXT_PAGE = etree.XPath(f"(//ul[{_has_class('pagination')}]//a[@id='next'])[1]/@href")
+
+    def __init__(self, content: bytes):
+        # the pages are utf-8 encoded, and lxml does not sniff the encoding
+        # as BeautifulSoup does
+        try:
+            content = content.decode('utf-8')
+        except UnicodeDecodeError:
+            pass
+        self.tree = lxml_html.document_fromstring(content)
+
+    def _first(self, xpath, node=None):
+        ret = xpath(self.tree if node is None else node)
+        if not ret:
+            raise ValueError(f'Element not found: {xpath.path}')
+        return ret[0]
+
+    def title(self) -> str:
+        return self.TEXT(self._first(self.TITLE))
+
+    def info_rows(self) -> list:
+        return self.INFO_ROWS(self.tree)
+
+    def row_text(self, row) -> str:
+        return self.TEXT(row)
+
+    def row_genres(self, row) -> List[str]:
+        return [self.TEXT(e) for e in self.GENRES(row)]
+
+    def fanart_image(self) -> Tuple[str, str]:
+        a = self._first(self.FANART_IMAGE)
+        return a.attrib['href'], str(self._first(self.IMG_SRC, a))
+
+    def screenshot_images(self) -> List[Tuple[str, str]]:
+        return [
+            (a.attrib['href'], str(self._first(self.IMG_SRC, a)))
+            for a in self.SCREENSHOT_IMAGES(self.tree)
+        ]
+
+    def info_links(self) -> List[Tuple[str, str]]:
+        return [(a.attrib['href'], self.TEXT(a)) for a in self.INFO_LINKS(self.tree)]
+
+    def movie_boxes(self) -> List[Tuple[str, str, List[str]]]:
+        ret = []
+        for a in self.MOVIE_BOXES(self.tree):
+            img = self.BOX_IMG(a)
+            ret.append((
+                img[0].get('title', '') if img else '',
+                img[0].get('src', '') if img else '',
+                [self.TEXT(d) for d in self.BOX_DATES(a)],
+            ))
+        return ret
+
+    def next_page(self) -> Optional[str]:
+        ret = self.NEXT_PAGE(self.tree)
+        if ret:
+            return str(ret[0])
+
 
 class JavBusCrawler(AVInfoCrawler):
-    """AVInfo crawler that fetches AV information from javbus.com."""
+    """
+    AVInfo crawler that fetches AV information from javbus.com.
+
+    The detail pages are requested with ``cached=True``, thus are served
+    from the response cache of the engine, if it has one.
+    """
+
+    BASE_URL = 'https://javbus.com'
+
+    def __init__(self,
+                 engine: Optional[FetchEngine] = None,
+                 parser: str = 'lxml',
+                 base_url: Optional[str] = None):
+        """
+        Construct a new :class:`JavBusCrawler`.
+
+        Args:
+            engine: The fetch engine.  Defaults to :func:`get_default_engine()`.
+            parser: The HTML parser backend, either "lxml" (the default,
+                with precompiled XPaths) or "bs4" (BeautifulSoup with the
+                pure-Python "html.parser").  Both produce the same info.
+            base_url: The base URL of the site, for crawling from a mirror
+                domain.  Defaults to :attr:`BASE_URL`.
+        """
+        if parser not in self.PARSERS:
+            raise ValueError(f'Unsupported parser: {parser!r}')
+        self.engine = engine or get_default_engine()
+        self.parser = parser
+        self.base_url = (base_url or self.BASE_URL).rstrip('/')
+
+    def __repr__(self):
+        return f'{self.__class__.__qualname__}({self.base_url!r})'
+
+    def get_url(self, movie_id: str) -> str:
+        """Get the URL of the detail page of a movie."""
+        return f'{self.base_url}/{movie_id.upper()}'
 
     def fetch(self, movie_id: str) -> AVInfo:
         """
@@ -90,15 +327,46 @@ class JavBusCrawler(AVInfoCrawler):
         Args:
             movie_id: The AV id, i.e., the AV number.
         """
+        r = self.engine.get(self.get_url(movie_id), cached=True)
+        r.raise_for_status()
+        return self.parse(movie_id, r.content)
+
+    async def fetch_async(self, movie_id: str) -> AVInfo:
+        """
+        Fetch AV info in a coroutine running on the engine loop.
+
+        The page is parsed in the default executor, so as not to block
+        the other requests.
+        """
+        return (await self.fetch_timed_async(movie_id))[0]
+
+    async def fetch_timed_async(self, movie_id: str) -> Tuple[AVInfo, Optional[float]]:
+        """
+        Fetch AV info in a coroutine, along with the latency of the response
+        headers, excluding the parsing, the retry backoff and the cache hits.
+        """
+        r = await self.engine.get_async(self.get_url(movie_id), cached=True)
+        r.raise_for_status()
+        info = await asyncio.get_event_loop().run_in_executor(
+            None, self.parse, movie_id, r.content)
+        return info, r.elapsed
+
+    def parse(self, movie_id: str, content: bytes) -> AVInfo:
+        """
+        Parse the detail page of a movie.
+
+        Args:
+            movie_id: The AV id, i.e., the AV number.
+            content: The content of the detail page.
+        """
+        return self._parse_page(movie_id, self.PARSERS[self.parser](content))
+
+    def _parse_page(self, movie_id: str, page) -> AVInfo:
         movie_id = movie_id.upper()
-        content = requests.get(f'https://javbus.com/{movie_id}')
-        content.raise_for_status()
-        tree = BeautifulSoup(content.content, features='html.parser')
         info = AVInfo(movie_id=movie_id)
 
         # fill information
-        info.title = tree.select_one('div.container > h3').text
-        info_table = tree.select_one('div.container > div.row.movie > div.info')
+        info.title = page.title()
         info_keys_mapping = {
             '識別碼': 'movie_id',
             '發行日期': 'premiered',
@@ -109,22 +377,23 @@ class JavBusCrawler(AVInfoCrawler):
             '長度': 'movie_length',
         }
         last_row = ''
-        for info_row in info_table.select('p'):
+        for info_row in page.info_rows():
             if last_row:
                 # last row is a header, parse the content accordingly
                 if last_row == 'categories':
-                    tags = [e.text.strip() for e in info_row.select('span.genre')]
+                    tags = [s.strip() for s in page.row_genres(info_row)]
                     info.tags = [s for s in tags if s]
                 elif last_row == 'actors':
-                    actors = [e.text.strip() for e in info_row.select('span.genre')]
+                    actors = [s.strip() for s in page.row_genres(info_row)]
                     info.actors = [s for s in actors if s]
                 last_row = ''
             else:
                 # last row is not a header, parse it
-                row_items = info_row.text.strip().split(':')
+                row_text = page.row_text(info_row)
+                row_items = row_text.strip().split(':')
                 if len(row_items) == 2:
                     # "key: value"
-                    raw_key, raw_value = info_row.text.split(':')
+                    raw_key, raw_value = row_text.split(':')
                     raw_key = raw_key.strip()
                     raw_value = raw_value.strip()
                     if raw_key in info_keys_mapping and raw_value:
@@ -135,25 +404,463 @@ class JavBusCrawler(AVInfoCrawler):
                         last_row = 'actors'
 
         # fill fanart images
-        fanart_image = tree.select_one('div.container > div.row.movie a.bigImage')
-        fanart_image = AVInfoImage(
-            file=fanart_image['href'],
-            thumbnail=fanart_image.select_one('img')['src'],
-        )
+        uri, thumbnail_uri = page.fanart_image()
+        fanart_image = AVInfoImage(file=uri, thumbnail=thumbnail_uri)
         if fanart_image.thumbnail == fanart_image.file:
             fanart_image.thumbnail = None
         info.fanart_images = [fanart_image]
 
         # fill screenshot images
-        screenshot_images = tree.select('div.container > div#sample-waterfall > a.sample-box')
+        screenshot_images = page.screenshot_images()
         if screenshot_images:
             info.screenshot_images = []
-            for screenshot_image in screenshot_images:
-                uri = screenshot_image['href']
-                thumbnail_uri = screenshot_image.select_one('img')['src']
+            for uri, thumbnail_uri in screenshot_images:
                 if thumbnail_uri == uri:
                     thumbnail_uri = None
                 info.screenshot_images.append(AVInfoImage(file=uri, thumbnail=thumbnail_uri))
 
         info.info_born_time = time.time()
         return info
+
+    PARSERS = {
+        'lxml': _JavBusLxmlPage,
+        'bs4': _JavBusSoupPage,
+    }
+
+    LISTING_KINDS = ('series', 'studio', 'star')
+    """
+    The kinds of the listing pages used by :meth:`fetch_bulk`, in the
+    order of preference.  Smaller listings come first.
+    """
+
+    LISTING_FIELDS = frozenset(['movie_id', 'title', 'premiered', 'fanart_images'])
+    """The fields of :class:`AVInfo` that the listing pages may provide."""
+
+    _THUMB_TO_COVER = re.compile(r'/thumbs?/([^/]+)\.jpg$')
+
+    def parse_listing_links(self,
+                            url: str,
+                            content: bytes) -> List[Tuple[str, str, str]]:
+        """
+        Parse the links to the listing pages on the detail page of a movie.
+
+        Args:
+            url: The URL of the detail page.
+            content: The content of the detail page.
+
+        Returns:
+            List of ``(kind, url, name)``, where `kind` is one of
+            :attr:`LISTING_KINDS`, in the order of preference.
+        """
+        ret = []
+        for href, name in self.PARSERS[self.parser](content).info_links():
+            href = urljoin(url, href)
+            kind = urlsplit(href).path.strip('/').split('/', 1)[0]
+            if kind in self.LISTING_KINDS:
+                ret.append((kind, href, name.strip()))
+        ret.sort(key=lambda t: self.LISTING_KINDS.index(t[0]))
+        return ret
+
+    def parse_listing(self,
+                      url: str,
+                      content: bytes,
+                      kind: Optional[str] = None,
+                      name: Optional[str] = None
+                      ) -> Tuple[List[Tuple[AVInfo, FrozenSet[str]]], Optional[str]]:
+        """
+        Parse a listing page into partial :class:`AVInfo`.
+
+        Args:
+            url: The URL of the listing page.
+            content: The content of the listing page.
+            kind: The kind of the listing, one of :attr:`LISTING_KINDS`.
+            name: The name of the series, studio or actor of the listing.
+                If specified, the corresponding field is filled.
+
+        Returns:
+            ``(infos, next_url)``, where `infos` is a list of ``(info, fields)``,
+            `fields` being the names of the fields provided in `info`;
+            and `next_url` is the URL of the next page, if any.
+        """
+        page = self.PARSERS[self.parser](content)
+        now = time.time()
+        infos = []
+        for title, thumbnail, dates in page.movie_boxes():
+            if not dates or not dates[0].strip():
+                continue
+            info = AVInfo(movie_id=dates[0].strip().upper())
+            fields = {'movie_id'}
+            if title.strip():
+                info.title = title.strip()
+                fields.add('title')
+            if len(dates) > 1 and dates[1].strip():
+                info.premiered = dates[1].strip()
+                fields.add('premiered')
+            if thumbnail:
+                thumbnail = urljoin(url, thumbnail)
+                cover, n = self._THUMB_TO_COVER.subn(r'/cover/\1_b.jpg', thumbnail)
+                if n:
+                    info.fanart_images = [AVInfoImage(file=cover, thumbnail=thumbnail)]
+                    fields.add('fanart_images')
+            if name and kind in ('series', 'studio'):
+                setattr(info, kind, name)
+                fields.add(kind)
+            info.info_born_time = now
+            infos.append((info, frozenset(fields)))
+
+        next_url = page.next_page()
+        if next_url:
+            next_url = urljoin(url, next_url)
+        return infos, next_url
+
+    async def _fetch_details_async(self,
+                                   movie_id: str
+                                   ) -> Tuple[AVInfo, List[Tuple[str, str, str]]]:
+        url = self.get_url(movie_id)
+        r = await self.engine.get_async(url, cached=True)
+        r.raise_for_status()
+
+        def parse():
+            return (self.parse(movie_id, r.content),
+                    self.parse_listing_links(r.url, r.content))
+        return await asyncio.get_event_loop().run_in_executor(None, parse)
+
+    async def _fetch_listing_async(self,
+                                   kind: str,
+                                   url: str,
+                                   name: str,
+                                   wanted: Container[str],
+                                   max_pages: int
+                                   ) -> List[Tuple[AVInfo, FrozenSet[str]]]:
+        loop = asyncio.get_event_loop()
+        ret = []
+        for _ in range(max_pages):
+            r = await self.engine.get_async(url, cached=True)
+            if r.status != 200:
+                break
+            infos, url = await loop.run_in_executor(
+                None, self.parse_listing, r.url, r.content, kind, name)
+            ret.extend(t for t in infos if t[0].movie_id in wanted)
+            if not url:
+                break
+        return ret
+
+    async def fetch_bulk_async(self,
+                               movie_ids: Iterable[str],
+                               fields: Optional[Iterable[str]] = None,
+                               max_pages: int = 10
+                               ) -> List[Union[AVInfo, Exception]]:
+        """
+        Fetch the information of many movies, filling the requested fields
+        from the listing pages where possible.  Must be awaited on the
+        engine loop.
+
+        The movies are grouped by the prefix of their IDs.  In each round,
+        the detail page of one unresolved movie of each group is fetched,
+        and the series, studio and actor listings linked by it are walked,
+        filling partial :class:`AVInfo` of the other movies.  A group stops
+        seeding once a round resolves nothing more in it.  Finally, the
+        detail pages of the movies still lacking any requested field are
+        fetched, as :meth:`fetch_async` does.
+
+        Args:
+            movie_ids: The movie IDs.
+            fields: The requested fields of :class:`AVInfo`.  Defaults to
+                :attr:`LISTING_FIELDS`.  Requesting other fields (e.g.,
+                "tags", "actors" or "screenshot_images", which only the
+                detail pages provide) makes the listings useless.
+            max_pages: The maximum number of pages to walk per listing.
+
+        Returns:
+            The (partial) information objects, or the errors, in the order
+            of `movie_ids`.  The information filled from the listings has
+            its :attr:`AVInfo.partial_fields` set.
+        """
+        movie_ids = [m.upper() for m in movie_ids]
+        fields = frozenset(fields if fields is not None else self.LISTING_FIELDS)
+        results: Dict[str, Union[AVInfo, Exception]] = {}
+        partials: Dict[str, Tuple[AVInfo, FrozenSet[str]]] = {}
+        visited = set()
+
+        def is_resolved(m):
+            return m in results or (m in partials and fields <= partials[m][1])
+
+        def merge(info, info_fields):
+            old = partials.get(info.movie_id)
+            if old is not None:
+                for key in info_fields - old[1]:
+                    setattr(old[0], key, getattr(info, key))
+                info_fields = info_fields | old[1]
+                info = old[0]
+            partials[info.movie_id] = (info, info_fields)
+
+        groups: Dict[str, List[str]] = {}
+        for m in movie_ids:
+            groups.setdefault(m.rsplit('-', 1)[0], []).append(m)
+        wanted = set(movie_ids)
+
+        if not fields <= self.LISTING_FIELDS | {'series', 'studio'}:
+            groups.clear()  # the listings cannot resolve any movie
+
+        while groups:
+            seeds = {}
+            for prefix, members in list(groups.items()):
+                pending = [m for m in members if not is_resolved(m)]
+                if pending:
+                    seeds[prefix] = pending[0]
+                else:
+                    del groups[prefix]
+            if not seeds:
+                break
+
+            # fetch the detail pages of the seeds
+            seed_ids = list(seeds.values())
+            rets = await asyncio.gather(
+                *(self._fetch_details_async(m) for m in seed_ids),
+                return_exceptions=True,
+            )
+            listings = []
+            for m, ret in zip(seed_ids, rets):
+                if isinstance(ret, Exception):
+                    results[m] = ret
+                    continue
+                results[m], links = ret
+                for kind, url, name in links:
+                    if url not in visited:
+                        visited.add(url)
+                        listings.append((kind, url, name))
+
+            # walk the listings
+            resolved_before = {m for m in wanted if is_resolved(m)}
+            rets = await asyncio.gather(
+                *(self._fetch_listing_async(kind, url, name, wanted, max_pages)
+                  for kind, url, name in listings),
+                return_exceptions=True,
+            )
+            for ret in rets:
+                if not isinstance(ret, Exception):
+                    for info, info_fields in ret:
+                        if info.movie_id not in results:
+                            merge(info, info_fields)
+            newly_resolved = {m for m in wanted if is_resolved(m)} - resolved_before
+            for prefix in seeds:
+                if not any(m in newly_resolved for m in groups[prefix]):
+                    del groups[prefix]
+
+        # fetch the details of the remaining movies
+        remaining = [m for m in dict.fromkeys(movie_ids) if not is_resolved(m)]
+        rets = await asyncio.gather(
+            *(self.fetch_async(m) for m in remaining),
+            return_exceptions=True,
+        )
+        results.update(zip(remaining, rets))
+        for info, info_fields in partials.values():
+            info.partial_fields = sorted(info_fields)
+        return [results[m] if m in results else partials[m][0] for m in movie_ids]
+
+    def fetch_bulk(self,
+                   movie_ids: Iterable[str],
+                   fields: Optional[Iterable[str]] = None,
+                   max_pages: int = 10
+                   ) -> List[Union[AVInfo, Exception]]:
+        """
+        Fetch the information of many movies, filling the requested fields
+        from the listing pages where possible.  See :meth:`fetch_bulk_async`.
+        """
+        return self.engine.run(self.fetch_bulk_async(movie_ids, fields, max_pages))
+
+
+class SourceStats(object):
+    """Latency and health statistics of a source of :class:`MultiSourceCrawler`."""
+
+    def __init__(self, window_size: int = 128):
+        """
+        Construct a new :class:`SourceStats`.
+
+        Args:
+            window_size: The number of recent latencies to keep.
+        """
+        self.latencies: Deque[float] = deque(maxlen=window_size)
+        self.failure_rate: float = 0.
+        """EWMA of the failure indicator of the requests."""
+        self.success_count: int = 0
+        self.failure_count: int = 0
+        self.cancel_count: int = 0
+
+    def add_success(self, latency: Optional[float]):
+        """
+        Record a successful request, and its network latency if it is not
+        served from the cache.
+        """
+        if latency is not None:
+            self.latencies.append(latency)
+        self.success_count += 1
+        self.failure_rate *= .9
+
+    def add_cancelled(self, elapsed: float):
+        """
+        Record a request cancelled after `elapsed` seconds, e.g., which has
+        lost to a hedged request.  The elapsed time is a lower bound of its
+        latency, thus a slow source is not judged by its fast requests only.
+        A request cancelled early tells little, thus counts as the median.
+        """
+        median = self.percentile(.5)
+        self.latencies.append(elapsed if median is None else max(elapsed, median))
+        self.cancel_count += 1
+
+    def add_failure(self):
+        self.failure_count += 1
+        self.failure_rate = .9 * self.failure_rate + .1
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Get the `q`-th percentile (0 <= q <= 1) of the recent latencies."""
+        if not self.latencies:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+    def score(self, default_latency: float) -> float:
+        """The routing score of the source, the smaller the better."""
+        latency = self.percentile(.5)
+        if latency is None:
+            latency = default_latency
+        return latency * (1. + 10. * self.failure_rate)
+
+
+class MultiSourceCrawler(AVInfoCrawler):
+    """
+    AVInfo crawler that fetches from several sources with hedged requests.
+
+    The sources (e.g., :class:`JavBusCrawler` on different mirror domains,
+    or crawlers for other providers) are ranked by their recent median
+    latency and failure rate.  A request is sent to the best source first.
+    If it has not answered within the `hedge_percentile` latency of that
+    source, a hedged request is sent to the next source, and whichever
+    returns first wins, while the others are cancelled.  A failed request
+    moves on to the next source immediately.
+
+    The latencies are those of the network requests, thus the responses
+    served from the cache are not counted, while a request cancelled by
+    a winning hedge counts its elapsed time as a lower bound.  404
+    responses are not counted against the health of a source, and are
+    final if `stop_on_not_found` (the sources being mirrors of the same
+    site), otherwise the next source is tried.
+    """
+
+    def __init__(self,
+                 sources: Sequence[AVInfoCrawler],
+                 engine: Optional[FetchEngine] = None,
+                 hedge_percentile: float = .95,
+                 default_hedge_delay: float = 2.,
+                 min_hedge_delay: float = .05,
+                 max_hedges: int = 1,
+                 stop_on_not_found: bool = True):
+        """
+        Construct a new :class:`MultiSourceCrawler`.
+
+        Args:
+            sources: The source crawlers, in the order of preference
+                before any statistics are gathered.
+            engine: The fetch engine whose loop drives the sources.
+                Defaults to the engine of the first source if it has one,
+                otherwise :func:`get_default_engine()`.
+            hedge_percentile: The latency percentile of a source, after
+                which a hedged request is sent.
+            default_hedge_delay: The hedge delay for sources without
+                latency statistics, in seconds.
+            min_hedge_delay: The minimum hedge delay, in seconds.
+            max_hedges: The maximum number of hedged requests of a movie,
+                in addition to the first one.  The requests sent after
+                failures are not counted.
+            stop_on_not_found: Whether or not a 404 response of a source
+                is final?  Should be :obj:`True` for mirrors of the same
+                site, whose 404 responses agree.
+        """
+        if not sources:
+            raise ValueError('At least one source is required.')
+        self.sources = list(sources)
+        self.engine = (engine or getattr(self.sources[0], 'engine', None) or
+                       get_default_engine())
+        self.hedge_percentile = hedge_percentile
+        self.default_hedge_delay = default_hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.max_hedges = max_hedges
+        self.stop_on_not_found = stop_on_not_found
+        self.stats = [SourceStats() for _ in self.sources]
+
+    def _ranked_sources(self) -> List[int]:
+        # the stable sort keeps the order of preference among ties
+        return sorted(
+            range(len(self.sources)),
+            key=lambda i: self.stats[i].score(self.default_hedge_delay)
+        )
+
+    def _get_hedge_delay(self, i: int) -> float:
+        delay = self.stats[i].percentile(self.hedge_percentile)
+        if delay is None:
+            delay = self.default_hedge_delay
+        return max(self.min_hedge_delay, delay)
+
+    async def _fetch_from(self, i: int, movie_id: str) -> AVInfo:
+        start_time = time.monotonic()
+        try:
+            info, latency = await self.sources[i].fetch_timed_async(movie_id)
+        except FetchError as ex:
+            if ex.status != 404:
+                self.stats[i].add_failure()
+            raise
+        except asyncio.CancelledError:
+            self.stats[i].add_cancelled(time.monotonic() - start_time)
+            raise
+        except Exception:
+            self.stats[i].add_failure()
+            raise
+        self.stats[i].add_success(latency)
+        return info
+
+    def fetch(self, movie_id: str) -> AVInfo:
+        return self.engine.run(self.fetch_async(movie_id))
+
+    async def fetch_async(self, movie_id: str) -> AVInfo:
+        """Fetch AV info in a coroutine running on the engine loop."""
+        ranked = deque(self._ranked_sources())
+        running: Dict[asyncio.Future, int] = {}
+        errors: List[Tuple[int, Exception]] = []
+        hedges = 0
+
+        def launch():
+            i = ranked.popleft()
+            running[asyncio.ensure_future(self._fetch_from(i, movie_id))] = i
+            return i
+
+        last = launch()
+        try:
+            while running:
+                timeout = None
+                if ranked and hedges < self.max_hedges:
+                    timeout = self._get_hedge_delay(last)
+                done, _ = await asyncio.wait(
+                    running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # the request is slower than usual, hedge it
+                    hedges += 1
+                    last = launch()
+                    continue
+                for fut in done:
+                    i = running.pop(fut)
+                    ex = fut.exception()
+                    if ex is None:
+                        return fut.result()
+                    if self.stop_on_not_found and \
+                            isinstance(ex, FetchError) and ex.status == 404:
+                        raise ex
+                    errors.append((i, ex))
+                    if ranked:
+                        last = launch()
+        finally:
+            for fut in running:
+                fut.cancel()
+
+        # all the sources have failed, report the error of the most
+        # preferred source
+        raise min(errors, key=lambda t: t[0])[1]
@@ -0,0 +1,214 @@
+"""Persistent cache of the movie IDs which have failed to be crawled."""
+import asyncio
+import os
+import time
+from threading import RLock
+from typing import *
+
+import aiohttp
+
+from .fetching import *
+from .utils import *
+
+__all__ = [
+    'NOT_FOUND', 'PARSE_ERROR', 'NETWORK_ERROR', 'classify_crawl_error',
+    'FailureRecord', 'FailureCache',
+]
+
+NOT_FOUND = 'not_found'
+"""The site does not know the movie ID (HTTP 404 / 410)."""
+
+PARSE_ERROR = 'parse_error'
+"""The page has been fetched, but cannot be parsed."""
+
+NETWORK_ERROR = 'network_error'
+"""The page cannot be fetched due to network errors or other statuses."""
+
+
+def classify_crawl_error(ex: BaseException) -> str:
+    """Classify an error raised by :meth:`AVInfoCrawler.fetch` into a reason."""
+    if isinstance(ex, FetchError):
+        return NOT_FOUND if ex.status in (404, 410) else NETWORK_ERROR
+    if isinstance(ex, (aiohttp.ClientError, asyncio.TimeoutError, OSError)):
+        return NETWORK_ERROR
+    return PARSE_ERROR
+
+
+class FailureRecord(object):
+    """The failure history of a movie ID."""
+
+    __slots__ = ('movie_id', 'reason', 'message', 'failures', 'first_failed',
+                 'last_failed', 'retry_at')
+
+    def __init__(self,
+                 movie_id: str,
+                 reason: str,
+                 message: str,
+                 failures: int,
+                 first_failed: float,
+                 last_failed: float,
+                 retry_at: float):
+        self.movie_id = movie_id
+        self.reason = reason
+        """The reason of the last failure."""
+        self.message = message
+        """The error message of the last failure."""
+        self.failures = failures
+        """The number of consecutive failures."""
+        self.first_failed = first_failed
+        self.last_failed = last_failed
+        self.retry_at = retry_at
+        """Timestamp before which the movie ID should not be crawled again."""
+
+    def is_expired(self, now: Optional[float] = None) -> bool:
+        return (time.time() if now is None else now) >= self.retry_at
+
+
+class FailureCache(object):
+    """
+    Persistent negative cache of the crawling results, stored in SQLite.
+
+    A failed movie ID is skipped until its re-check time, which is the
+    TTL of the failure reason multiplied by ``2 ** (failures - 1)``
+    (capped by `max_interval`).  Thus the IDs that the site never knows
+    are re-checked less and less often, while transient network errors
+    expire quickly.  A successful crawl removes the record.
+    """
+
+    DEFAULT_TTLS: Dict[str, float] = {
+        NOT_FOUND: 7 * 24 * 3600.,
+        PARSE_ERROR: 24 * 3600.,
+        NETWORK_ERROR: 10 * 60.,
+    }
+    """The default TTLs of the failure reasons, in seconds."""
+
+    def __init__(self,
+                 path: Optional[str] = None,
+                 ttls: Optional[Mapping[str, float]] = None,
+                 max_interval: float = 90 * 24 * 3600.):
+        """
+        Construct a new :class:`FailureCache`.
+
+        Args:
+            path: The path of the SQLite database.  Defaults to
+                ``failures.db`` under :func:`get_cache_dir()`.
+            ttls: The TTLs of the failure reasons, overriding
+                :attr:`DEFAULT_TTLS`.
+            max_interval: The maximum re-check interval, in seconds.
+        """
+        if path is None:
+            path = os.path.join(get_cache_dir(), 'failures.db')
+        self.path = path
+        self.ttls = dict(self.DEFAULT_TTLS)
+        self.ttls.update(ttls or {})
+        self.max_interval = max_interval
+        self._lock = RLock()
+        self._conn = open_sqlite(path)
+        with self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS failures ('
+                'movie_id TEXT PRIMARY KEY, reason TEXT NOT NULL, '
+                'message TEXT NOT NULL, failures INTEGER NOT NULL, '
+                'first_failed REAL NOT NULL, last_failed REAL NOT NULL, '
+                'retry_at REAL NOT NULL)'
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def get(self, movie_id: str) -> Optional[FailureRecord]:
+        """Get the failure record of `movie_id`, or :obj:`None` if not failed."""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT movie_id, reason, message, failures, first_failed, '
+                'last_failed, retry_at FROM failures WHERE movie_id = ?',
+                (movie_id.upper(),)
+            ).fetchone()
+        if row is not None:
+            return FailureRecord(*row)
+
+    def should_skip(self, movie_id: str) -> Optional[FailureRecord]:
+        """
+        Check whether or not `movie_id` should be skipped.
+
+        Returns:
+            The failure record if the movie ID is not due to be re-checked,
+            otherwise :obj:`None`.
+        """
+        record = self.get(movie_id)
+        if record is not None and not record.is_expired():
+            return record
+
+    def add_failure(self,
+                    movie_id: str,
+                    reason: str,
+                    message: str = '') -> FailureRecord:
+        """
+        Record a failure of `movie_id`.
+
+        Args:
+            movie_id: The movie ID.
+            reason: The failure reason, one of the keys of `ttls`.
+            message: The error message.
+
+        Returns:
+            The updated failure record.
+        """
+        movie_id = movie_id.upper()
+        now = time.time()
+        with self._lock, self._conn:
+            old = self.get(movie_id)
+            if old is not None and old.reason == reason:
+                failures, first_failed = old.failures + 1, old.first_failed
+            else:
+                failures, first_failed = 1, now
+            interval = min(self.max_interval,
+                           self.ttls[reason] * 2 ** (failures - 1))
+            record = FailureRecord(movie_id, reason, message, failures,
+                                   first_failed, now, now + interval)
+            self._conn.execute(
+                'INSERT OR REPLACE INTO failures (movie_id, reason, message, '
+                'failures, first_failed, last_failed, retry_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (record.movie_id, record.reason, record.message,
+                 record.failures, record.first_failed, record.last_failed,
+                 record.retry_at)
+            )
+        return record
+
+    def remove(self, movie_id: str):
+        """Remove the failure record of `movie_id`, e.g., after a success."""
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM failures WHERE movie_id = ?',
+                               (movie_id.upper(),))
+
+    def list(self, reason: Optional[str] = None) -> List[FailureRecord]:
+        """
+        List the failure records, ordered by movie ID.
+
+        Args:
+            reason: If specified, list only the records of this reason.
+        """
+        sql = ('SELECT movie_id, reason, message, failures, first_failed, '
+               'last_failed, retry_at FROM failures')
+        params = ()
+        if reason is not None:
+            sql += ' WHERE reason = ?'
+            params = (reason,)
+        with self._lock:
+            return [FailureRecord(*row) for row in
+                    self._conn.execute(sql + ' ORDER BY movie_id', params)]
+
+    def clear(self):
+        """Remove all the failure records."""
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM failures')
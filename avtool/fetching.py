@@ -0,0 +1,413 @@
+"""Asyncio based HTTP fetch engine, shared by the crawlers and the fetchers."""
+import asyncio
+import atexit
+import time
+from concurrent.futures import Future
+from threading import RLock, Thread
+from typing import *
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from .httpcache import *
+from .ratelimit import *
+
+__all__ = [
+    'FetchError', 'FetchResponse', 'FetchEngine', 'get_default_engine',
+]
+
+T = TypeVar('T')
+
+
+class FetchError(IOError):
+    """Error raised when a HTTP request fails with an error status."""
+
+    def __init__(self, url: str, status: int, reason: Optional[str] = None):
+        message = f'HTTP {status} {reason}' if reason else f'HTTP {status}'
+        super().__init__(f'{message}: {url}')
+        self.url = url
+        self.status = status
+
+
+class FetchResponse(object):
+    """A fetched HTTP response, with its body fully read."""
+
+    __slots__ = ('url', 'status', 'reason', 'headers', 'content', 'elapsed')
+
+    def __init__(self,
+                 url: str,
+                 status: int,
+                 reason: Optional[str],
+                 headers: Dict[str, str],
+                 content: bytes,
+                 elapsed: Optional[float] = None):
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        """The response headers, with lower-cased names."""
+        self.content = content
+        self.elapsed = elapsed
+        """
+        Seconds from sending the request to receiving the response headers,
+        of the last attempt, or :obj:`None` if no request has been sent.
+        """
+
+    def raise_for_status(self):
+        """Raise :class:`FetchError` if the status indicates an error."""
+        if self.status >= 400:
+            raise FetchError(self.url, self.status, self.reason)
+
+
+class FetchEngine(object):
+    """
+    HTTP fetch engine with persistent keep-alive connection pools.
+
+    The requests are driven by an asyncio event loop running in a
+    background thread, thus thousands of requests may be in flight
+    without a thread for each.  The engine can be used from ordinary
+    threads via :meth:`get` and :meth:`get_many`, or from coroutines
+    submitted to the engine loop via :meth:`run` and :meth:`submit`.
+
+    The requests to each host are governed by an :class:`AdaptiveLimiter`,
+    and the requests failed by network errors or by throttling statuses
+    are retried individually according to a :class:`RetryPolicy`.
+    """
+
+    CHUNK_SIZE: int = 65536
+    """The size of the chunks written to the sinks of the downloads."""
+
+    def __init__(self,
+                 max_connections: int = 100,
+                 max_per_host: int = 8,
+                 host_limits: Optional[Mapping[str, int]] = None,
+                 rate: Optional[float] = None,
+                 retry: Optional[RetryPolicy] = None,
+                 timeout: float = 60.,
+                 headers: Optional[Mapping[str, str]] = None,
+                 cache: Optional[ResponseCache] = None,
+                 offline: bool = False):
+        """
+        Construct a new :class:`FetchEngine`.
+
+        Args:
+            max_connections: The maximum number of open connections.
+            max_per_host: The default maximum number of concurrent
+                requests to a single host.
+            host_limits: The maximum number of concurrent requests to
+                particular hosts, overriding `max_per_host`.
+            rate: The maximum number of requests per second to a single
+                host, or :obj:`None` if not limited.
+            retry: The retry policy.  Defaults to ``RetryPolicy()``.
+            timeout: The total timeout of each request, in seconds.
+            headers: The default request headers.
+            cache: The response cache, used by requests with ``cached=True``.
+            offline: If :obj:`True`, never touch the network.  Requests
+                which cannot be served from `cache` get a 504 response.
+        """
+        self.max_connections = max_connections
+        self.max_per_host = max_per_host
+        self.host_limits = dict(host_limits or {})
+        self.rate = rate
+        self.retry = retry if retry is not None else RetryPolicy()
+        self.timeout = timeout
+        self.headers = dict(headers or {})
+        self.cache = cache
+        self.offline = offline
+
+        self._lock = RLock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[Thread] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._host_limiters: Dict[str, AdaptiveLimiter] = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """The event loop of this engine, started on first access."""
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                thread = Thread(target=loop.run_forever, name='FetchEngine', daemon=True)
+                thread.start()
+                self._loop = loop
+                self._thread = thread
+            return self._loop
+
+    def close(self):
+        """Close the connection pools and stop the event loop."""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            if loop is None:
+                return
+            if self._session is not None:
+                asyncio.run_coroutine_threadsafe(
+                    self._session.close(), loop).result()
+                self._session = None
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+            self._loop = self._thread = None
+            self._host_limiters.clear()
+
+    def submit(self, coro: Awaitable[T]) -> 'Future[T]':
+        """Schedule a coroutine on the engine loop."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Awaitable[T]) -> T:
+        """Run a coroutine on the engine loop, and wait for its result."""
+        return self.submit(coro).result()
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # only called from the engine loop, thus no lock is required
+        if self._session is None:
+            connector = aiohttp.TCPConnector(
+                limit=self.max_connections,
+                limit_per_host=0,  # limited by the host limiters
+                keepalive_timeout=60,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers=self.headers,
+            )
+        return self._session
+
+    def _get_host_limiter(self, url: str) -> AdaptiveLimiter:
+        host = urlsplit(url).hostname or ''
+        limiter = self._host_limiters.get(host)
+        if limiter is None:
+            limiter = AdaptiveLimiter(
+                max_concurrency=self.host_limits.get(host, self.max_per_host),
+                rate=self.rate,
+            )
+            self._host_limiters[host] = limiter
+        return limiter
+
+    async def _request_once(self,
+                            url: str,
+                            headers: Optional[Mapping[str, str]],
+                            sink: Optional[BinaryIO] = None
+                            ) -> FetchResponse:
+        session = self._get_session()
+        start_time = time.monotonic()
+        async with session.get(url, headers=headers) as resp:
+            # the latency of the headers, which does not include reading
+            # the body, thus does not grow with the size of the body
+            elapsed = time.monotonic() - start_time
+            if sink is not None and resp.status < 300:
+                # the sink is usually a spooled temporary file, thus the
+                # blocking writes are cheap enough to run on the loop
+                sink.seek(0)
+                sink.truncate()
+                async for chunk in resp.content.iter_chunked(self.CHUNK_SIZE):
+                    sink.write(chunk)
+                content = b''
+            else:
+                content = await resp.read()
+            return FetchResponse(
+                url=str(resp.url),
+                status=resp.status,
+                reason=resp.reason,
+                headers={k.lower(): v for k, v in resp.headers.items()},
+                content=content,
+                elapsed=elapsed,
+            )
+
+    async def _request(self,
+                       url: str,
+                       headers: Optional[Mapping[str, str]],
+                       sink: Optional[BinaryIO] = None) -> FetchResponse:
+        limiter = self._get_host_limiter(url)
+        attempt = 0
+        while True:
+            attempt += 1
+            retry_after = None
+            await limiter.acquire()
+            try:
+                try:
+                    r = await self._request_once(url, headers, sink)
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    limiter.on_error()
+                    if attempt > self.retry.max_retries:
+                        raise
+                else:
+                    retry_after = parse_retry_after(r.headers.get('retry-after'))
+                    limiter.on_response(r.status, r.elapsed, retry_after)
+                    if attempt > self.retry.max_retries or \
+                            not self.retry.should_retry(r.status):
+                        return r
+            finally:
+                await limiter.release()
+
+            # back off without holding a slot of the host
+            await asyncio.sleep(self.retry.get_delay(attempt, retry_after))
+
+    async def get_async(self,
+                        url: str,
+                        headers: Optional[Mapping[str, str]] = None,
+                        cached: bool = False) -> FetchResponse:
+        """
+        Fetch `url`.  Must be awaited on the engine loop.
+
+        Args:
+            url: The URL to fetch.
+            headers: Additional request headers.
+            cached: Whether or not to serve the request from the response
+                cache, and store the response into it?  Stale responses
+                are revalidated by conditional requests.
+
+        Returns:
+            The response.  Error statuses are not raised.
+        """
+        # the cache is backed by SQLite, whose calls are run in the default
+        # executor, so as not to block the other requests on the loop
+        loop = asyncio.get_event_loop()
+        cache = self.cache if cached else None
+        stored = None
+        if cache is not None:
+            stored = await loop.run_in_executor(None, cache.get, url)
+        if stored is not None and (self.offline or cache.is_fresh(stored)):
+            return self._from_cache(stored)
+        if self.offline:
+            return FetchResponse(url, 504, 'Not Cached (offline)', {}, b'')
+
+        if stored is not None:
+            headers = dict(headers or {})
+            headers.update(stored.get_conditional_headers())
+        r = await self._request(url, headers)
+        if cache is not None:
+            if r.status == 304 and stored is not None:
+                await loop.run_in_executor(None, cache.touch, url)
+                return self._from_cache(stored)
+            if r.status == 200:
+                await loop.run_in_executor(
+                    None, cache.put, url, r.status, r.headers, r.content)
+        return r
+
+    async def download_async(self,
+                             url: str,
+                             sink: BinaryIO,
+                             headers: Optional[Mapping[str, str]] = None
+                             ) -> FetchResponse:
+        """
+        Download `url` into `sink` in chunks, without holding the whole
+        body in memory.  Must be awaited on the engine loop.
+
+        Args:
+            url: The URL to download.
+            sink: The binary file object, which receives the body of a
+                successful response.  Since a request may be retried, it
+                is rewound by ``seek(0)`` and ``truncate()`` before each
+                attempt writes to it.
+            headers: Additional request headers.
+
+        Returns:
+            The response, whose `content` is empty if the body has been
+            written to `sink`.  Error statuses are not raised, and their
+            bodies are kept in `content` instead.
+        """
+        if self.offline:
+            return FetchResponse(url, 504, 'Not Cached (offline)', {}, b'')
+        return await self._request(url, headers, sink)
+
+    def download_many(self,
+                      items: Iterable[Tuple[str, BinaryIO]],
+                      return_exceptions: bool = False
+                      ) -> List[Union[FetchResponse, BaseException]]:
+        """
+        Download many URLs concurrently, blocking the calling thread.
+
+        Args:
+            items: The ``(url, sink)`` of the downloads.
+                See :meth:`download_async`.
+            return_exceptions: If :obj:`True`, the errors are returned in
+                place of the responses; otherwise the first error is raised.
+
+        Returns:
+            The responses, in the order of `items`.
+        """
+        async def f():
+            tasks = [asyncio.ensure_future(self.download_async(url, sink))
+                     for url, sink in items]
+            try:
+                return await asyncio.gather(
+                    *tasks, return_exceptions=return_exceptions)
+            finally:
+                # on the first error, stop the other downloads before the
+                # caller closes their sinks
+                pending = [task for task in tasks if not task.done()]
+                for task in pending:
+                    task.cancel()
+                if pending:
+                    await asyncio.gather(*pending, return_exceptions=True)
+        return self.run(f())
+
+    @staticmethod
+    def _from_cache(stored: CachedResponse) -> FetchResponse:
+        return FetchResponse(
+            url=stored.url,
+            status=stored.status,
+            reason=None,
+            headers=stored.headers,
+            content=stored.content,
+        )
+
+    def get(self,
+            url: str,
+            headers: Optional[Mapping[str, str]] = None,
+            cached: bool = False) -> FetchResponse:
+        """
+        Fetch `url`, blocking the calling thread.
+
+        Args:
+            url: The URL to fetch.
+            headers: Additional request headers.
+            cached: Whether or not to use the response cache?
+                See :meth:`get_async`.
+
+        Returns:
+            The response.  Error statuses are not raised.
+        """
+        return self.run(self.get_async(url, headers, cached=cached))
+
+    def get_many(self,
+                 urls: Iterable[str],
+                 return_exceptions: bool = False
+                 ) -> List[Union[FetchResponse, BaseException]]:
+        """
+        Fetch all of `urls` concurrently, blocking the calling thread.
+
+        Args:
+            urls: The URLs to fetch.
+            return_exceptions: If :obj:`True`, the errors are returned in
+                place of the responses; otherwise the first error is raised.
+
+        Returns:
+            The responses, in the order of `urls`.
+        """
+        async def f():
+            return await asyncio.gather(
+                *(self.get_async(url) for url in urls),
+                return_exceptions=return_exceptions
+            )
+        return self.run(f())
+
+
+_default_engine: Optional[FetchEngine] = None
+_default_engine_lock = RLock()
+
+
+def get_default_engine() -> FetchEngine:
+    """Get the default :class:`FetchEngine`, shared in this process."""
+    global _default_engine
+    with _default_engine_lock:
+        if _default_engine is None:
+            _default_engine = FetchEngine()
+            atexit.register(_default_engine.close)
+        return _default_engine
@@ -0,0 +1,212 @@
+"""Persistent cache of HTTP responses, with conditional revalidation."""
+import json
+import os
+import time
+from threading import RLock
+from typing import *
+
+from .utils import *
+
+__all__ = ['CachedResponse', 'ResponseCache']
+
+
+class CachedResponse(object):
+    """A response stored in :class:`ResponseCache`."""
+
+    __slots__ = ('url', 'status', 'headers', 'content', 'etag', 'last_modified',
+                 'stored_at')
+
+    def __init__(self,
+                 url: str,
+                 status: int,
+                 headers: Dict[str, str],
+                 content: bytes,
+                 etag: Optional[str],
+                 last_modified: Optional[str],
+                 stored_at: float):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.content = content
+        self.etag = etag
+        self.last_modified = last_modified
+        self.stored_at = stored_at
+        """Timestamp when the response is stored or last revalidated."""
+
+    def get_conditional_headers(self) -> Dict[str, str]:
+        """Get the headers for revalidating this response."""
+        ret = {}
+        if self.etag:
+            ret['If-None-Match'] = self.etag
+        if self.last_modified:
+            ret['If-Modified-Since'] = self.last_modified
+        return ret
+
+
+class ResponseCache(object):
+    """
+    Size-bounded persistent cache of HTTP responses, stored in SQLite.
+
+    Responses younger than `ttl` are served without touching the network.
+    Older ones are revalidated with conditional requests, using their
+    ``ETag`` and ``Last-Modified`` headers.  When the total size of the
+    stored bodies exceeds `max_size`, the least recently used responses
+    are evicted.  The total size is tracked in memory, and is recounted
+    from the database only when it seems to exceed `max_size`, since other
+    processes may share the database.
+    """
+
+    def __init__(self,
+                 path: Optional[str] = None,
+                 max_size: int = 512 * 1024 * 1024,
+                 ttl: float = 7 * 24 * 3600):
+        """
+        Construct a new :class:`ResponseCache`.
+
+        Args:
+            path: The path of the SQLite database.  Defaults to
+                ``http.db`` under :func:`get_cache_dir()`.
+            max_size: The maximum total size of the stored bodies, in bytes.
+            ttl: Seconds before a stored response needs revalidation.
+        """
+        if path is None:
+            path = os.path.join(get_cache_dir(), 'http.db')
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = RLock()
+        self._conn = open_sqlite(path)
+        with self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                'url TEXT PRIMARY KEY, status INTEGER NOT NULL, '
+                'headers TEXT NOT NULL, content BLOB NOT NULL, '
+                'size INTEGER NOT NULL, etag TEXT, last_modified TEXT, '
+                'stored_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+            )
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS responses_accessed_at '
+                'ON responses (accessed_at)'
+            )
+        self._total_size = self._count_size()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def is_fresh(self, r: CachedResponse) -> bool:
+        """Whether or not `r` can be served without revalidation?"""
+        return time.time() - r.stored_at < self.ttl
+
+    def get(self, url: str) -> Optional[CachedResponse]:
+        """
+        Get the stored response of `url`.
+
+        Args:
+            url: The requested URL.
+
+        Returns:
+            The stored response, or :obj:`None` if not stored.
+        """
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                'SELECT status, headers, content, etag, last_modified, stored_at '
+                'FROM responses WHERE url = ?',
+                (url,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                'UPDATE responses SET accessed_at = ? WHERE url = ?',
+                (time.time(), url)
+            )
+        status, headers, content, etag, last_modified, stored_at = row
+        return CachedResponse(
+            url=url, status=status, headers=json.loads(headers),
+            content=content, etag=etag, last_modified=last_modified,
+            stored_at=stored_at,
+        )
+
+    def get_urls(self, prefix: str = '') -> List[str]:
+        """Get the URLs of the stored responses starting with `prefix`."""
+        with self._lock:
+            return [
+                url for url, in self._conn.execute(
+                    'SELECT url FROM responses WHERE substr(url, 1, ?) = ? '
+                    'ORDER BY url',
+                    (len(prefix), prefix)
+                )
+            ]
+
+    def put(self,
+            url: str,
+            status: int,
+            headers: Mapping[str, str],
+            content: bytes):
+        """
+        Store a response, evicting the least recently used ones if the
+        cache becomes too large.
+
+        Args:
+            url: The requested URL.
+            status: The response status.
+            headers: The response headers, with lower-cased names.
+            content: The response body.
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                'SELECT size FROM responses WHERE url = ?', (url,)).fetchone()
+            self._total_size += len(content) - (row[0] if row is not None else 0)
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses '
+                '(url, status, headers, content, size, etag, last_modified, '
+                'stored_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (url, status, json.dumps(dict(headers)), content, len(content),
+                 headers.get('etag'), headers.get('last-modified'), now, now)
+            )
+            self._evict()
+
+    def touch(self, url: str):
+        """Mark the stored response of `url` as just revalidated."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                'UPDATE responses SET stored_at = ? WHERE url = ?',
+                (time.time(), url)
+            )
+
+    def _count_size(self) -> int:
+        total_size, = self._conn.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()
+        return total_size
+
+    def _evict(self):
+        if self._total_size <= self.max_size:
+            return
+        total_size = self._total_size = self._count_size()
+        if total_size > self.max_size:
+            evicted = 0
+            rows = self._conn.execute(
+                'SELECT url, size FROM responses ORDER BY accessed_at').fetchall()
+            urls = []
+            for url, size in rows:
+                if total_size - evicted <= self.max_size:
+                    break
+                urls.append((url,))
+                evicted += size
+            self._conn.executemany('DELETE FROM responses WHERE url = ?', urls)
+            self._total_size -= evicted
+
+    def clear(self):
+        """Remove all the stored responses."""
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM responses')
+            self._total_size = 0
@@ -0,0 +1,131 @@
+"""Image processing of the assets, e.g., cropping the cover from a fanart."""
+import shutil
+import subprocess
+from io import BytesIO
+from typing import *
+
+from PIL import Image, JpegImagePlugin
+
+__all__ = [
+    'COVER_ASPECT_RATIO', 'get_cover_box', 'jpegtran_crop', 'crop_cover_image',
+]
+
+COVER_ASPECT_RATIO = .704
+"""The width / height ratio of the cover, i.e., the right part of a fanart."""
+
+_jpegtran_path: Optional[str] = None
+
+
+def _get_jpegtran() -> Optional[str]:
+    global _jpegtran_path
+    if _jpegtran_path is None:
+        _jpegtran_path = shutil.which('jpegtran') or ''
+    return _jpegtran_path or None
+
+
+def get_cover_box(width: int, height: int) -> Tuple[int, int, int, int]:
+    """Get the ``(left, upper, right, lower)`` box of the cover in a fanart."""
+    return round(width - height * COVER_ASPECT_RATIO), 0, width, height
+
+
+def _get_mcu_size(img: Image.Image) -> Tuple[int, int]:
+    # the MCU size of a JPEG image is 8 pixels times the maximum sampling
+    # factors of its components, e.g., 16x16 for 4:2:0 and 8x8 for 4:4:4
+    layers = getattr(img, 'layer', None) or [('', 1, 1, 0)]
+    return (8 * max(h for _, h, _, _ in layers),
+            8 * max(v for _, _, v, _ in layers))
+
+
+def jpegtran_crop(content: bytes,
+                  box: Tuple[int, int, int, int]) -> Optional[bytes]:
+    """
+    Crop a JPEG image losslessly in the DCT domain, with ``jpegtran``.
+
+    The upper left corner of `box` is moved to the nearest MCU boundary,
+    since a lossless crop can only start at an MCU.
+
+    Args:
+        content: The JPEG image content.
+        box: The ``(left, upper, right, lower)`` crop box.
+
+    Returns:
+        The cropped JPEG image content, or :obj:`None` if ``jpegtran``
+        is not available, or the image is not a JPEG.
+    """
+    jpegtran = _get_jpegtran()
+    if jpegtran is None:
+        return None
+    with BytesIO(content) as input_stream:
+        with Image.open(input_stream) as img:  # reads the header only
+            if img.format != 'JPEG':
+                return None
+            mcu_w, mcu_h = _get_mcu_size(img)
+    left, upper, right, lower = box
+    left = round(left / mcu_w) * mcu_w
+    upper = round(upper / mcu_h) * mcu_h
+    try:
+        return subprocess.run(
+            [jpegtran, '-crop', f'{right - left}x{lower - upper}+{left}+{upper}',
+             '-optimize'],
+            input=content, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            check=True,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def crop_cover_image(input_content: bytes,
+                     lossless: bool = True,
+                     max_height: Optional[int] = None) -> bytes:
+    """
+    Crop the cover image from a fanart image.
+
+    A JPEG fanart is cropped losslessly by :func:`jpegtran_crop` if
+    possible.  Otherwise it is decoded by Pillow, at a reduced scale by
+    the JPEG draft mode if `max_height` permits, and the cropped image
+    is encoded with the quantization tables and the subsampling of the
+    fanart, which keeps the quality of the fanart.
+
+    This function is CPU bound, and is picklable for running in a
+    process pool.
+
+    Args:
+        input_content: The fanart image content.
+        lossless: Whether or not to try the lossless crop?
+        max_height: The maximum height of the cover, or :obj:`None` to
+            keep the height of the fanart.  Disables the lossless crop
+            if the fanart is higher.
+
+    Returns:
+        The JPEG cover image content.
+    """
+    with BytesIO(input_content) as input_stream:
+        img: Image.Image = Image.open(input_stream, mode='r')
+        try:
+            box = get_cover_box(img.width, img.height)
+            scaled = max_height is not None and img.height > max_height
+            if lossless and not scaled and box[0] >= 0:
+                output_content = jpegtran_crop(input_content, box)
+                if output_content is not None:
+                    return output_content
+
+            save_kwargs = {}
+            if img.format == 'JPEG':
+                save_kwargs['qtables'] = img.quantization
+                save_kwargs['subsampling'] = JpegImagePlugin.get_sampling(img)
+            if scaled:
+                # decode at 1/2, 1/4 or 1/8 scale in the DCT domain
+                img.draft('RGB', (img.width * max_height // img.height, max_height))
+                if img.height > max_height:
+                    img.thumbnail((img.width * max_height // img.height, max_height))
+                box = get_cover_box(img.width, img.height)
+
+            cropped_img = img.crop(box)
+            try:
+                with BytesIO() as output_stream:
+                    cropped_img.save(output_stream, format='JPEG', **save_kwargs)
+                    return output_stream.getvalue()
+            finally:
+                cropped_img.close()
+        finally:
+            img.close()
@@ -1,10 +1,10 @@
 import codecs
 import json
 import os
-
-import mltk
+from typing import *
 
 from .crawler import *
+from .records import *
 from .scanner import *
 
 __all__ = [
@@ -20,19 +20,18 @@ class JSONIndexer(object):
         self.file_object = codecs.open(path, 'wb', 'utf-8')
         self._is_first_entry = True
 
-    def add(self, e: AVEntry, info: AVInfo):
+    def add(self,
+            e: Union[AVEntry, AVEntryRecord],
+            info: Union[AVInfo, AVInfoRecord],
+            duration: Optional[float] = None):
         # compose the info dict
-        info_dict = mltk.config_to_dict(info)
+        info_dict = info_to_dict(info)
         info_dict['assets_zip'] = os.path.join(
             os.path.relpath(os.path.abspath(e.parent_dir), self.root_dir),
             os.path.splitext(e.movie_files[0])[0] + '.zip'
         )
-        if info.cover_image:
-            info_dict['cover_image'] = mltk.config_to_dict(info.cover_image)
-        for key in ('fanart_images', 'screenshot_images'):
-            images = getattr(info, key)
-            if images:
-                info_dict[key] = [mltk.config_to_dict(i) for i in images]
+        if duration is not None:
+            info_dict['duration'] = duration
 
         # serialize info dict to json
         info_json = json.dumps(info_dict, ensure_ascii=False)
@@ -0,0 +1,141 @@
+"""Persistent cache of the ffprobe results of the movie files."""
+import json
+import os
+import time
+from threading import RLock
+from typing import *
+
+import ffmpeg
+
+from .utils import *
+
+__all__ = ['ProbeCache']
+
+
+class ProbeCache(object):
+    """
+    Persistent cache of the ffprobe results, stored in SQLite.
+
+    The results (the format and the streams, including the codecs, the
+    duration, the resolution and the bitrate) are keyed by the absolute
+    path of the movie files, and validated against their size, mtime and
+    inode, thus an unchanged file needs only a `stat` instead of an
+    ffprobe process reading its container header.
+    """
+
+    RACY_SECONDS: float = 2.
+    """
+    Files modified within this number of seconds before probing are not
+    cached, since they might be still being written.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        Construct a new :class:`ProbeCache`.
+
+        Args:
+            path: The path of the SQLite database.  Defaults to
+                ``probe.db`` under :func:`get_cache_dir()`.
+        """
+        if path is None:
+            path = os.path.join(get_cache_dir(), 'probe.db')
+        self.path = path
+        self._lock = RLock()
+        self._conn = open_sqlite(path)
+        with self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS probes ('
+                'path TEXT PRIMARY KEY, size INTEGER NOT NULL, '
+                'mtime_ns INTEGER NOT NULL, inode INTEGER NOT NULL, '
+                'info TEXT NOT NULL, stored_at REAL NOT NULL)'
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def get(self,
+            file_path: str,
+            st: Optional[os.stat_result] = None) -> Optional[Dict[str, Any]]:
+        """
+        Get the cached ffprobe result of `file_path`.
+
+        Args:
+            file_path: The path of the movie file.
+            st: The stat result of the file, if already known.
+
+        Returns:
+            The ffprobe result, or :obj:`None` if not cached, or if the
+            file has been changed since probed.
+        """
+        file_path = os.path.abspath(file_path)
+        if st is None:
+            try:
+                st = os.stat(file_path)
+            except FileNotFoundError:
+                return None
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT info FROM probes WHERE path = ? AND size = ? AND '
+                'mtime_ns = ? AND inode = ?',
+                (file_path, st.st_size, st.st_mtime_ns, st.st_ino)
+            ).fetchone()
+        if row is not None:
+            return json.loads(row[0])
+
+    def put(self,
+            file_path: str,
+            info: Mapping[str, Any],
+            st: Optional[os.stat_result] = None):
+        """
+        Store the ffprobe result of `file_path`, unless it is just modified.
+
+        Args:
+            file_path: The path of the movie file.
+            info: The ffprobe result.
+            st: The stat result of the file when probed.
+        """
+        file_path = os.path.abspath(file_path)
+        if st is None:
+            st = os.stat(file_path)
+        if st.st_mtime >= time.time() - self.RACY_SECONDS:
+            return
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO probes (path, size, mtime_ns, inode, '
+                'info, stored_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (file_path, st.st_size, st.st_mtime_ns, st.st_ino,
+                 json.dumps(dict(info), ensure_ascii=False), time.time())
+            )
+
+    def probe(self, file_path: str) -> Dict[str, Any]:
+        """
+        Get the ffprobe result of `file_path`, running ffprobe if not cached.
+        """
+        st = os.stat(file_path)
+        info = self.get(file_path, st)
+        if info is None:
+            info = ffmpeg.probe(file_path)
+            self.put(file_path, info, st)
+        return info
+
+    def get_duration(self, file_path: str) -> Optional[float]:
+        """Get the cached duration of `file_path` in seconds, without probing."""
+        info = self.get(file_path)
+        if info is not None:
+            duration = info.get('format', {}).get('duration')
+            if duration is not None:
+                return float(duration)
+
+    def clear(self):
+        """Remove all the cached results."""
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM probes')
@@ -0,0 +1,246 @@
+"""Adaptive rate limiting and retrying of the HTTP requests."""
+import asyncio
+import email.utils
+import random
+import time
+from collections import deque
+from typing import *
+
+__all__ = [
+    'RetryPolicy', 'parse_retry_after', 'TokenBucket', 'AdaptiveLimiter',
+]
+
+
+class RetryPolicy(object):
+    """Retries with jittered exponential backoff."""
+
+    RETRY_STATUSES = frozenset([408, 429, 500, 502, 503, 504])
+    """The response statuses which should be retried."""
+
+    def __init__(self,
+                 max_retries: int = 3,
+                 base_delay: float = 1.,
+                 max_delay: float = 60.):
+        """
+        Construct a new :class:`RetryPolicy`.
+
+        Args:
+            max_retries: The maximum number of retries of a request.
+            base_delay: The delay before the first retry, in seconds.
+            max_delay: The maximum delay before a retry, in seconds.
+        """
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def should_retry(self, status: int) -> bool:
+        return status in self.RETRY_STATUSES
+
+    def get_delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """
+        Get the delay before a retry.
+
+        Args:
+            attempt: The number of failed attempts so far, starting from 1.
+            retry_after: The delay requested by the server, if any.
+
+        Returns:
+            A "full jitter" delay, uniformly drawn from ``[0, base * 2^(attempt-1)]``
+            (capped by `max_delay`), but not shorter than `retry_after`.
+        """
+        delay = random.uniform(
+            0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse the ``Retry-After`` header into seconds."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        dt = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0., dt.timestamp() - time.time())
+
+
+class TokenBucket(object):
+    """
+    Token bucket rate limiter, for use on a single event loop.
+
+    The rate may be changed at any time, which takes effect on the next
+    acquisition.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        """
+        Construct a new :class:`TokenBucket`.
+
+        Args:
+            rate: The number of tokens added per second.
+            burst: The capacity of the bucket.  Defaults to ``max(1, rate)``.
+        """
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1., rate)
+        self._tokens = self.burst
+        self._last_time = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last_time) * self.rate)
+        self._last_time = now
+
+    async def acquire(self):
+        """Wait until a token is available, and take it."""
+        while True:
+            self._refill()
+            if self._tokens >= 1.:
+                self._tokens -= 1.
+                return
+            await asyncio.sleep((1. - self._tokens) / self.rate)
+
+
+class AdaptiveLimiter(object):
+    """
+    Per-host limiter with AIMD-style adaptive concurrency.
+
+    The concurrency window grows by about one slot per round trip while
+    the host responds normally (additive increase), and is halved when the
+    host throttles (429 / 5xx), errors out, or its latency rises well above
+    the observed baseline (multiplicative decrease).  If a maximum request
+    rate is given, the requests are also paced by a :class:`TokenBucket`
+    whose rate follows the same policy.  A ``Retry-After`` on throttling
+    pauses the whole host.
+
+    All methods must be called on the same event loop.
+    """
+
+    def __init__(self,
+                 max_concurrency: int,
+                 rate: Optional[float] = None,
+                 min_concurrency: int = 1,
+                 latency_tolerance: float = 3.,
+                 base_latency_window: float = 300.):
+        """
+        Construct a new :class:`AdaptiveLimiter`.
+
+        Args:
+            max_concurrency: The maximum number of concurrent requests.
+            rate: The maximum number of requests per second, or
+                :obj:`None` if not limited.
+            min_concurrency: The minimum number of concurrent requests.
+            latency_tolerance: A response slower than the baseline latency
+                by this factor is regarded as a sign of congestion.
+            base_latency_window: The baseline latency is the minimum of the
+                smoothed latency within this number of recent seconds.
+        """
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min(min_concurrency, max_concurrency)
+        self.max_rate = rate
+        self.latency_tolerance = latency_tolerance
+        self.base_latency_window = base_latency_window
+        self.concurrency = float(max(self.min_concurrency, max_concurrency // 2))
+        self.bucket = TokenBucket(rate) if rate else None
+
+        self._in_flight = 0
+        self._cond: Optional[asyncio.Condition] = None
+        self._paused_until = 0.
+        self._latency: Optional[float] = None
+        self._base_latency: Optional[float] = None
+        # (time, latency) in the window, with increasing latencies
+        self._min_window: Deque[Tuple[float, float]] = deque()
+        self._last_decrease = 0.
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    async def acquire(self):
+        """Wait for a slot in the concurrency window, and the pacing."""
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        async with self._cond:
+            while self._in_flight >= int(self.concurrency):
+                await self._cond.wait()
+            self._in_flight += 1
+        try:
+            delay = self._paused_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if self.bucket is not None:
+                await self.bucket.acquire()
+        except BaseException:
+            await self.release()
+            raise
+
+    async def release(self):
+        async with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def _decrease(self):
+        # at most one decrease per round trip, otherwise all the requests
+        # in flight would collapse the window at once
+        now = time.monotonic()
+        if now - self._last_decrease < (self._latency or 0.):
+            return
+        self._last_decrease = now
+        self.concurrency = max(float(self.min_concurrency), self.concurrency / 2.)
+        if self.bucket is not None:
+            self.bucket.rate = max(self.max_rate / 16., self.bucket.rate / 2.)
+
+    def _increase(self):
+        self.concurrency = min(float(self.max_concurrency),
+                               self.concurrency + 1. / self.concurrency)
+        if self.bucket is not None:
+            self.bucket.rate = min(self.max_rate,
+                                   self.bucket.rate + self.max_rate / 16. / self.concurrency)
+
+    def on_response(self,
+                    status: int,
+                    latency: float,
+                    retry_after: Optional[float] = None):
+        """
+        Feed back the result of a request.
+
+        Args:
+            status: The response status.
+            latency: The response latency, in seconds.  Should be the time
+                to the response headers, which does not depend on the size
+                of the body.
+            retry_after: The ``Retry-After`` requested by the server.
+        """
+        if status == 429 or status >= 500:
+            if retry_after:
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+            self._decrease()
+            return
+
+        # track the latency by EWMA, and its baseline by the minimum within
+        # a time window, which does not follow a sustained slowdown shorter
+        # than the window
+        if self._latency is None:
+            self._latency = latency
+        else:
+            self._latency = .8 * self._latency + .2 * latency
+        now = time.monotonic()
+        window = self._min_window
+        while window and window[-1][1] >= self._latency:
+            window.pop()
+        window.append((now, self._latency))
+        while window[0][0] < now - self.base_latency_window:
+            window.popleft()
+        self._base_latency = window[0][1]
+        if self._latency > self._base_latency * self.latency_tolerance:
+            self._decrease()
+        else:
+            self._increase()
+
+    def on_error(self):
+        """Feed back a request which failed without a response."""
+        self._decrease()
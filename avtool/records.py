@@ -0,0 +1,289 @@
+"""
+Lightweight record types for :class:`AVEntry` and :class:`AVInfo`.
+
+The :class:`mltk.Config` based classes are convenient for validation, but
+carry considerable per-object overhead.  The records in this module are
+plain ``__slots__`` classes with hand-written dict codecs, which are more
+suitable for holding and serializing a large library in memory.
+"""
+import codecs
+import json
+from typing import *
+
+from .crawler import *
+from .scanner import *
+from .scanner import _Record
+
+# `AVEntryRecord` is defined in `avtool.scanner`, which produces it, and
+# re-exported here along with the other records
+__all__ = [
+    'AVEntryRecord', 'AVInfoImageRecord', 'AVInfoRecord',
+    'entry_to_dict', 'info_to_dict', 'image_to_dict', 'load_info_record',
+]
+
+
+def entry_to_dict(e: Union[AVEntry, 'AVEntryRecord']) -> Dict[str, Any]:
+    """Convert an :class:`AVEntry` or :class:`AVEntryRecord` into dict."""
+    return {
+        'movie_id': e.movie_id,
+        'parent_dir': e.parent_dir,
+        'own_dir': e.own_dir,
+        'movie_files': e.movie_files,
+        'asset_files': e.asset_files,
+    }
+
+
+def image_to_dict(img: Union[AVInfoImage, 'AVInfoImageRecord']
+                  ) -> Dict[str, Any]:
+    """Convert an :class:`AVInfoImage` or :class:`AVInfoImageRecord` into dict."""
+    return {'file': img.file, 'thumbnail': img.thumbnail}
+
+
+def info_to_dict(info: Union[AVInfo, 'AVInfoRecord']) -> Dict[str, Any]:
+    """
+    Convert an :class:`AVInfo` or :class:`AVInfoRecord` into dict.
+
+    The nested images are converted as well, and the keys are ordered
+    in the same way as the fields of :class:`AVInfo`.
+    """
+    def images(value):
+        if value is not None:
+            return [image_to_dict(i) for i in value]
+
+    return {
+        'movie_id': info.movie_id,
+        'series': info.series,
+        'title': info.title,
+        'tags': info.tags,
+        'outline': info.outline,
+        'plot': info.plot,
+        'director': info.director,
+        'studio': info.studio,
+        'publisher': info.publisher,
+        'actors': info.actors,
+        'movie_length': info.movie_length,
+        'premiered': info.premiered,
+        'cover_image': (image_to_dict(info.cover_image)
+                        if info.cover_image is not None else None),
+        'fanart_images': images(info.fanart_images),
+        'screenshot_images': images(info.screenshot_images),
+        'info_born_time': info.info_born_time,
+        'partial_fields': info.partial_fields,
+    }
+
+
+class AVInfoImageRecord(_Record):
+    """Lightweight counterpart of :class:`AVInfoImage`."""
+
+    __slots__ = ('file', 'thumbnail')
+
+    def __init__(self,
+                 file: Optional[str] = None,
+                 thumbnail: Optional[str] = None):
+        self.file = file
+        self.thumbnail = thumbnail
+
+    def to_dict(self) -> Dict[str, Any]:
+        return image_to_dict(self)
+
+    @classmethod
+    def from_dict(cls, d: Mapping[str, Any]) -> 'AVInfoImageRecord':
+        return cls(d.get('file'), d.get('thumbnail'))
+
+    @classmethod
+    def from_config(cls, img: AVInfoImage) -> 'AVInfoImageRecord':
+        return cls(img.file, img.thumbnail)
+
+    def to_config(self) -> AVInfoImage:
+        return AVInfoImage(file=self.file, thumbnail=self.thumbnail)
+
+
+class AVInfoRecord(_Record):
+    """Lightweight counterpart of :class:`AVInfo`."""
+
+    __slots__ = (
+        'movie_id', 'series', 'title', 'tags', 'outline', 'plot', 'director',
+        'studio', 'publisher', 'actors', 'movie_length', 'premiered',
+        'cover_image', 'fanart_images', 'screenshot_images', 'info_born_time',
+        'partial_fields',
+    )
+
+    def __init__(self,
+                 movie_id: str,
+                 series: Optional[str] = None,
+                 title: Optional[str] = None,
+                 tags: Optional[List[str]] = None,
+                 outline: Optional[str] = None,
+                 plot: Optional[str] = None,
+                 director: Optional[str] = None,
+                 studio: Optional[str] = None,
+                 publisher: Optional[str] = None,
+                 actors: Optional[List[str]] = None,
+                 movie_length: Optional[str] = None,
+                 premiered: Optional[str] = None,
+                 cover_image: Optional[AVInfoImageRecord] = None,
+                 fanart_images: Optional[List[AVInfoImageRecord]] = None,
+                 screenshot_images: Optional[List[AVInfoImageRecord]] = None,
+                 info_born_time: Optional[float] = None,
+                 partial_fields: Optional[List[str]] = None):
+        self.movie_id = movie_id
+        self.series = series
+        self.title = title
+        self.tags = tags
+        self.outline = outline
+        self.plot = plot
+        self.director = director
+        self.studio = studio
+        self.publisher = publisher
+        self.actors = actors
+        self.movie_length = movie_length
+        self.premiered = premiered
+        self.cover_image = cover_image
+        self.fanart_images = fanart_images
+        self.screenshot_images = screenshot_images
+        self.info_born_time = info_born_time
+        self.partial_fields = partial_fields
+
+    def to_dict(self) -> Dict[str, Any]:
+        return info_to_dict(self)
+
+    @classmethod
+    def from_dict(cls, d: Mapping[str, Any]) -> 'AVInfoRecord':
+        def image(value):
+            if value is not None:
+                return AVInfoImageRecord(value.get('file'), value.get('thumbnail'))
+
+        def images(value):
+            if value is not None:
+                return [image(v) for v in value]
+
+        get = d.get
+        return cls(
+            movie_id=d['movie_id'],
+            series=get('series'),
+            title=get('title'),
+            tags=get('tags'),
+            outline=get('outline'),
+            plot=get('plot'),
+            director=get('director'),
+            studio=get('studio'),
+            publisher=get('publisher'),
+            actors=get('actors'),
+            movie_length=get('movie_length'),
+            premiered=get('premiered'),
+            cover_image=image(get('cover_image')),
+            fanart_images=images(get('fanart_images')),
+            screenshot_images=images(get('screenshot_images')),
+            info_born_time=get('info_born_time'),
+            partial_fields=get('partial_fields'),
+        )
+
+    @classmethod
+    def from_config(cls, info: AVInfo) -> 'AVInfoRecord':
+        def image(value):
+            if value is not None:
+                return AVInfoImageRecord(value.file, value.thumbnail)
+
+        def images(value):
+            if value is not None:
+                return [image(v) for v in value]
+
+        return cls(
+            movie_id=info.movie_id,
+            series=info.series,
+            title=info.title,
+            tags=info.tags,
+            outline=info.outline,
+            plot=info.plot,
+            director=info.director,
+            studio=info.studio,
+            publisher=info.publisher,
+            actors=info.actors,
+            movie_length=info.movie_length,
+            premiered=info.premiered,
+            cover_image=image(info.cover_image),
+            fanart_images=images(info.fanart_images),
+            screenshot_images=images(info.screenshot_images),
+            info_born_time=info.info_born_time,
+            partial_fields=info.partial_fields,
+        )
+
+    def to_config(self) -> AVInfo:
+        def image(value):
+            if value is not None:
+                return value.to_config()
+
+        def images(value):
+            if value is not None:
+                return [image(v) for v in value]
+
+        d = info_to_dict(self)
+        d['cover_image'] = image(self.cover_image)
+        d['fanart_images'] = images(self.fanart_images)
+        d['screenshot_images'] = images(self.screenshot_images)
+        return AVInfo(**{k: v for k, v in d.items() if v is not None})
+
+
+_INFO_STR_FIELDS = (
+    'series', 'title', 'outline', 'plot', 'director', 'studio', 'publisher',
+    'movie_length', 'premiered',
+)
+_INFO_STR_LIST_FIELDS = ('tags', 'actors', 'partial_fields')
+_INFO_IMAGE_LIST_FIELDS = ('fanart_images', 'screenshot_images')
+
+
+def _validate_info_dict(d: Any):
+    # the same type checks as loading the dict into `AVInfo` by
+    # `mltk.ConfigLoader`, without constructing the config objects
+    def check(ok, key, expected):
+        if not ok:
+            raise ValueError(f'`{key}` must be {expected}: got {d.get(key)!r}')
+
+    def is_image(value):
+        return isinstance(value, dict) and all(
+            isinstance(value.get(k), (str, type(None))) for k in ('file', 'thumbnail'))
+
+    if not isinstance(d, dict):
+        raise ValueError(f'The info must be an object: got {d!r}')
+    check(isinstance(d.get('movie_id'), str), 'movie_id', 'a str')
+    for key in _INFO_STR_FIELDS:
+        check(isinstance(d.get(key), (str, type(None))), key, 'a str')
+    for key in _INFO_STR_LIST_FIELDS:
+        value = d.get(key)
+        check(value is None or (isinstance(value, list) and
+                                all(isinstance(v, str) for v in value)),
+              key, 'a list of str')
+    value = d.get('cover_image')
+    check(value is None or is_image(value), 'cover_image', 'an image')
+    for key in _INFO_IMAGE_LIST_FIELDS:
+        value = d.get(key)
+        check(value is None or (isinstance(value, list) and
+                                all(is_image(v) for v in value)),
+              key, 'a list of images')
+    value = d.get('info_born_time')
+    check(value is None or (isinstance(value, (int, float)) and
+                            not isinstance(value, bool)),
+          'info_born_time', 'a number')
+
+
+def load_info_record(path: str, validate: bool = True) -> AVInfoRecord:
+    """
+    Load an :class:`AVInfoRecord` from a JSON file, as is generated by
+    :func:`avtool.assets.make_av_assets`.
+
+    Args:
+        path: The path of the JSON file.
+        validate: Whether or not to check the types of the fields, as
+            loading the file into :class:`AVInfo` does?
+
+    Raises:
+        ValueError: If `validate` is :obj:`True` and the file is invalid.
+    """
+    with codecs.open(path, 'rb', 'utf-8') as f:
+        d = json.load(f)
+    if validate:
+        try:
+            _validate_info_dict(d)
+        except ValueError as ex:
+            raise ValueError(f'Invalid info file {path}: {ex}') from None
+    return AVInfoRecord.from_dict(d)
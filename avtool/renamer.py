@@ -1,5 +1,6 @@
 import os
 import shutil
+from typing import *
 
 from .crawler import *
 from .scanner import *
@@ -44,7 +45,7 @@ class AVRenamer(object):
 
         return ret
 
-    def rename(self, entry: AVEntry, info: AVInfo, overwrite: bool = False) -> str:
+    def rename(self, entry: Union[AVEntry, AVEntryRecord], info: AVInfo, overwrite: bool = False) -> str:
         """
         Renames the AV entry according to its information.
 
@@ -0,0 +1,169 @@
+"""Persistent cache of the directory scanning results."""
+import json
+import os
+import time
+from threading import RLock
+from typing import *
+
+from .utils import *
+
+__all__ = ['ScanRecord', 'ScanCache']
+
+
+class ScanRecord(object):
+    """The cached scanning result of a single directory."""
+
+    __slots__ = ('mtime_ns', 'inode', 'entries', 'sub_dirs')
+
+    def __init__(self,
+                 mtime_ns: int,
+                 inode: int,
+                 entries: List[Dict[str, Any]],
+                 sub_dirs: List[str]):
+        self.mtime_ns = mtime_ns
+        self.inode = inode
+        self.entries = entries
+        """The matched AV entries, as dicts without `parent_dir`."""
+        self.sub_dirs = sub_dirs
+        """Names of the sub-directories remaining to be scanned."""
+
+    def is_fresh(self, st: os.stat_result) -> bool:
+        """Whether or not this record is still valid for the stat result?"""
+        return self.mtime_ns == st.st_mtime_ns and self.inode == st.st_ino
+
+
+class ScanCache(object):
+    """
+    Persistent cache of the directory scanning results, stored in SQLite.
+
+    The records are keyed by the absolute path of the directories, and
+    validated against the mtime and the inode of the directories.  Since
+    the mtime of a directory changes whenever an entry is added, removed
+    or renamed directly inside it, an unchanged directory needs only a
+    `stat` instead of a listing.
+    """
+
+    RACY_SECONDS: float = 2.
+    """
+    Directories modified within this number of seconds before scanning
+    are not cached, since a following modification might not change the
+    mtime on file systems with coarse timestamps.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        Construct a new :class:`ScanCache`.
+
+        Args:
+            path: The path of the SQLite database.  Defaults to
+                ``scan.db`` under :func:`get_cache_dir()`.
+        """
+        if path is None:
+            path = os.path.join(get_cache_dir(), 'scan.db')
+        self.path = path
+        self._lock = RLock()
+        self._conn = open_sqlite(path)
+        with self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS scan_dirs ('
+                'path TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, '
+                'mtime_ns INTEGER NOT NULL, inode INTEGER NOT NULL, '
+                'entries TEXT NOT NULL, sub_dirs TEXT NOT NULL)'
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    @staticmethod
+    def _subtree_args(root_dir: str) -> Tuple[str, str, str]:
+        # all paths under `root_dir` sort between `root/` and `root0`,
+        # which allows the query to use the primary key index.
+        root_dir = os.path.abspath(root_dir).rstrip(os.sep) or os.sep
+        prefix = root_dir if root_dir.endswith(os.sep) else root_dir + os.sep
+        return root_dir, prefix, prefix[:-1] + chr(ord(os.sep) + 1)
+
+    def is_cacheable(self, st: os.stat_result) -> bool:
+        """Whether or not a directory with stat result `st` can be cached?"""
+        return st.st_mtime < time.time() - self.RACY_SECONDS
+
+    def load(self, root_dir: str, fingerprint: str) -> Dict[str, ScanRecord]:
+        """
+        Load all the records under `root_dir` (inclusive).
+
+        Args:
+            root_dir: The root directory.
+            fingerprint: Records stored with a different fingerprint,
+                i.e., by scanners with different matching rules, are ignored.
+
+        Returns:
+            The records, keyed by the absolute paths of directories.
+        """
+        root_dir, lo, hi = self._subtree_args(root_dir)
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT path, mtime_ns, inode, entries, sub_dirs FROM scan_dirs '
+                'WHERE fingerprint = ? AND (path = ? OR (path >= ? AND path < ?))',
+                (fingerprint, root_dir, lo, hi)
+            ).fetchall()
+        return {
+            path: ScanRecord(mtime_ns, inode, json.loads(entries), json.loads(sub_dirs))
+            for path, mtime_ns, inode, entries, sub_dirs in rows
+        }
+
+    def update(self, records: Mapping[str, ScanRecord], fingerprint: str):
+        """
+        Store the records.
+
+        Args:
+            records: The records, keyed by the absolute paths of directories.
+            fingerprint: The fingerprint of the scanner.
+        """
+        rows = [
+            (path, fingerprint, r.mtime_ns, r.inode,
+             json.dumps(r.entries, ensure_ascii=False),
+             json.dumps(r.sub_dirs, ensure_ascii=False))
+            for path, r in records.items()
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO scan_dirs '
+                '(path, fingerprint, mtime_ns, inode, entries, sub_dirs) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                rows
+            )
+
+    def prune(self, root_dir: str, keep: Iterable[str]):
+        """
+        Remove the records under `root_dir` (inclusive), except `keep`.
+
+        Args:
+            root_dir: The root directory.
+            keep: The absolute paths of directories to keep.
+        """
+        root_dir, lo, hi = self._subtree_args(root_dir)
+        keep = set(keep)
+        with self._lock, self._conn:
+            paths = [
+                path for path, in self._conn.execute(
+                    'SELECT path FROM scan_dirs '
+                    'WHERE path = ? OR (path >= ? AND path < ?)',
+                    (root_dir, lo, hi)
+                )
+                if path not in keep
+            ]
+            self._conn.executemany(
+                'DELETE FROM scan_dirs WHERE path = ?', [(p,) for p in paths])
+
+    def clear(self):
+        """Remove all the records."""
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM scan_dirs')
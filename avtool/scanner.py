@@ -1,13 +1,17 @@
 """Scan directory and find AV movies."""
+import hashlib
 import os
 import re
 from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import *
 
 import mltk
 
+from .scancache import *
+
 __all__ = [
-    'AVEntry',
+    'AVEntry', 'AVEntryRecord', 'DirListing', 'CompiledPatterns',
     'AVFilesMatcher', 'AVDirectoryMatcher',
     'AVScanner',
 ]
@@ -15,6 +19,7 @@ __all__ = [
 MOVIE_EXTENSIONS = ['mp4', 'wmv', 'mkv', 'avi', 'rm', 'rmvb']
 ASSET_EXTENSIONS = ['json', 'yml', 'nfo', 'jpg', 'jpeg', 'png', 'zip']
 DOWNLOADING_EXTENSIONS = ['ut!', 'part']
+SCAN_CACHE_VERSION = 3
 
 
 class AVEntry(mltk.Config):
@@ -36,6 +41,208 @@ class AVEntry(mltk.Config):
     """The asset file names of the AV movie."""
 
 
+class _Record(object):
+    """Base class for the records, providing `__eq__` and `__repr__`."""
+
+    __slots__ = ()
+
+    def __eq__(self, other):
+        return type(other) is type(self) and all(
+            getattr(self, key) == getattr(other, key)
+            for key in self.__slots__
+        )
+
+    def __repr__(self):
+        attrs = ', '.join(
+            f'{key}={getattr(self, key)!r}'
+            for key in self.__slots__
+            if getattr(self, key) is not None
+        )
+        return f'{self.__class__.__qualname__}({attrs})'
+
+
+class AVEntryRecord(_Record):
+    """
+    Lightweight counterpart of :class:`AVEntry`, produced by the scanner.
+
+    A large library holds many entries in memory, for which the per-object
+    overhead of :class:`mltk.Config` is considerable.  Use :meth:`to_config`
+    where an :class:`AVEntry` is required.
+    """
+
+    __slots__ = ('movie_id', 'parent_dir', 'own_dir', 'movie_files', 'asset_files')
+
+    def __init__(self,
+                 movie_id: str,
+                 parent_dir: str,
+                 own_dir: bool = False,
+                 movie_files: Optional[List[str]] = None,
+                 asset_files: Optional[List[str]] = None):
+        self.movie_id = movie_id
+        self.parent_dir = parent_dir
+        self.own_dir = own_dir
+        self.movie_files = movie_files if movie_files is not None else []
+        self.asset_files = asset_files
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {key: getattr(self, key) for key in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, d: Mapping[str, Any]) -> 'AVEntryRecord':
+        return cls(
+            movie_id=d['movie_id'],
+            parent_dir=d['parent_dir'],
+            own_dir=d.get('own_dir', False),
+            movie_files=d.get('movie_files'),
+            asset_files=d.get('asset_files'),
+        )
+
+    @classmethod
+    def from_config(cls, e: AVEntry) -> 'AVEntryRecord':
+        return cls(e.movie_id, e.parent_dir, e.own_dir, e.movie_files, e.asset_files)
+
+    def to_config(self) -> AVEntry:
+        return AVEntry(**self.to_dict())
+
+
+class DirListing(object):
+    """
+    The listing of a directory, gathered by a single :func:`os.scandir` pass.
+
+    The file types are taken from the cached :class:`os.DirEntry` information,
+    such that no extra `stat` is required on most platforms.
+    """
+
+    __slots__ = ('path', 'files', 'dirs', '_file_set', '_file_index')
+
+    def __init__(self, path: str, files: List[str], dirs: List[str]):
+        self.path = path
+        self.files = files
+        """Names of the regular files, in the order of the directory listing."""
+        self.dirs = dirs
+        """Names of the sub-directories, in the order of the directory listing."""
+        self._file_set: Optional[Set[str]] = None
+        self._file_index: Optional[Dict[str, str]] = None
+
+    def find_file(self, name: str) -> Optional[str]:
+        """
+        Find a regular file in this directory, ignoring the case.
+
+        Args:
+            name: The file name.
+
+        Returns:
+            The file name in its on-disk case, or :obj:`None` if not found.
+            If several files only differ in case, the exact match is
+            preferred, otherwise the first one in the listing is returned.
+        """
+        if self._file_index is None:
+            file_index = {}
+            for file_name in self.files:
+                file_index.setdefault(file_name.lower(), file_name)
+            self._file_set = set(self.files)
+            self._file_index = file_index
+        if name in self._file_set:
+            return name
+        return self._file_index.get(name.lower())
+
+    @classmethod
+    def scan(cls, path: str) -> 'DirListing':
+        """
+        List the directory `path`.
+
+        Args:
+            path: The path of the directory.
+
+        Returns:
+            The directory listing.
+        """
+        files = []
+        dirs = []
+        with os.scandir(path) as it:
+            for de in it:
+                try:
+                    if de.is_dir():
+                        dirs.append(de.name)
+                    elif de.is_file():
+                        files.append(de.name)
+                except OSError:  # pragma: no cover
+                    # broken entries are neither files nor directories
+                    pass
+        return cls(path, files, dirs)
+
+
+class CompiledPatterns(object):
+    """
+    A sequence of regular expressions compiled into a single alternation,
+    such that a name can be matched against all of them in one pass.
+
+    The named groups of each pattern are renamed, thus the patterns may
+    share group names.  If more than one pattern matches a name, the
+    first one wins.
+    """
+
+    _GROUP_NAME = re.compile(r'\(\?P(<|=)(\w+)')
+
+    def __init__(self,
+                 patterns: Sequence[Pattern],
+                 suffixes: Optional[Sequence[str]] = None):
+        """
+        Construct a new :class:`CompiledPatterns`.
+
+        Args:
+            patterns: The compiled regular expressions, all of them must
+                be compiled with the same flags.
+            suffixes: If specified, names not ending with any of these
+                lower-cased suffixes are rejected before running the regex.
+        """
+        patterns = list(patterns)
+        flags = {p.flags for p in patterns}
+        if len(flags) > 1:
+            raise ValueError('`patterns` must be compiled with the same flags.')
+
+        self.patterns = patterns
+        self.suffixes = tuple(s.lower() for s in suffixes) if suffixes else None
+        if len(patterns) == 1:
+            # a single pattern needs no alternation nor group renaming
+            self._regex = patterns[0]
+            self._group_names = None
+        else:
+            sources = []
+            self._group_names: List[List[Tuple[str, str]]] = []
+            for i, p in enumerate(patterns):
+                sources.append(
+                    f'(?P<_p{i}>' +
+                    self._GROUP_NAME.sub(
+                        lambda m: f'(?P{m.group(1)}_p{i}_{m.group(2)}', p.pattern) +
+                    ')'
+                )
+                self._group_names.append(
+                    [(f'_p{i}_{name}', name) for name in p.groupindex])
+            self._regex = re.compile('|'.join(sources), flags.pop() if flags else 0)
+
+    def match(self, name: str) -> Optional[Tuple[int, Dict[str, Optional[str]]]]:
+        """
+        Match `name` against the patterns.
+
+        Args:
+            name: The name to be matched.
+
+        Returns:
+            The index of the matched pattern and its named groups,
+            or :obj:`None` if no pattern matches.
+        """
+        if self.suffixes is not None and \
+                not name.lower().endswith(self.suffixes):
+            return None
+        m = self._regex.match(name)
+        if m is not None:
+            if self._group_names is None:
+                return 0, m.groupdict()
+            i = int(m.lastgroup[2:])
+            return i, {name: m.group(group) for group, name in self._group_names[i]}
+
+
 class Forbidden(object):
     pass
 
@@ -65,6 +272,12 @@ class AVFilesMatcher(object):
         #     re.I
         # ))
     ]
+    FILE_SUFFIXES = (
+        [f'.{ext}' for ext in MOVIE_EXTENSIONS] +
+        [f'.{ext}.{download_ext}'
+         for ext in MOVIE_EXTENSIONS
+         for download_ext in DOWNLOADING_EXTENSIONS]
+    )
 
     def __init__(self, parent_dir: str, movie_id: Optional[str] = None):
         if movie_id is not None:
@@ -73,13 +286,13 @@ class AVFilesMatcher(object):
         self.movie_id = movie_id
         self.files_to_process: MutableMapping[str, Union[List[(int, str)], Forbidden]] = defaultdict(list)
 
-    def get(self) -> List[AVEntry]:
+    def get(self) -> List[AVEntryRecord]:
         ret = []
         for m_id, m_list in self.files_to_process.items():
             if m_list is FORBIDDEN:
                 continue
             m_list.sort()
-            ret.append(AVEntry(
+            ret.append(AVEntryRecord(
                 movie_id=m_id.upper(),
                 parent_dir=self.parent_dir,
                 own_dir=False,
@@ -88,31 +301,70 @@ class AVFilesMatcher(object):
             ))
         return ret
 
-    def match(self, name: str):
-        path = os.path.join(self.parent_dir, name)
-        if os.path.isfile(path):
-            for n_orders, pattern in self.FILE_PATTERNS:
-                m = pattern.match(name)
-                if m:
-                    m_dict = m.groupdict()
-                    m_id = m_dict['id'].upper()
-                    m_download_ext = m_dict.get('download_ext')
-                    if m_download_ext:
-                        self.files_to_process[m_id] = FORBIDDEN
-                        continue
-                    m_order = 0
-                    for order_idx in range(1, n_orders + 1):
-                        this_order = m_dict.get(f'order{order_idx}')
-                        if this_order is not None:
-                            m_order = ord(this_order) - ord('0')
-                    if self.movie_id is None or m_id == self.movie_id:
-                        if self.files_to_process[m_id] is not FORBIDDEN:
-                            self.files_to_process[m_id].append((m_order, name))
-                        break
-
-    def match_all(self):
-        for name in os.listdir(self.parent_dir):
-            self.match(name)
+    @classmethod
+    def get_compiled_patterns(cls) -> CompiledPatterns:
+        """Get the :class:`CompiledPatterns` of :attr:`FILE_PATTERNS`."""
+        # cached for each class, in case a subclass overrides the patterns
+        ret = cls.__dict__.get('_compiled_patterns')
+        if ret is None:
+            ret = CompiledPatterns(
+                [pattern for _, pattern in cls.FILE_PATTERNS],
+                suffixes=cls.FILE_SUFFIXES,
+            )
+            cls._compiled_patterns = ret
+        return ret
+
+    @classmethod
+    def parse(cls, name: str) -> Optional[Tuple[str, int, bool]]:
+        """
+        Parse the name of a movie file.
+
+        Args:
+            name: The file name.
+
+        Returns:
+            The movie ID, the order of the file among the multi-part
+            movie files, and whether or not the file is still being
+            downloaded.  :obj:`None` if `name` is not a movie file.
+        """
+        m = cls.get_compiled_patterns().match(name)
+        if m is None:
+            return None
+        pattern_idx, m_dict = m
+        m_id = m_dict['id'].upper()
+        if m_dict.get('download_ext'):
+            return m_id, 0, True
+        m_order = 0
+        for order_idx in range(1, cls.FILE_PATTERNS[pattern_idx][0] + 1):
+            this_order = m_dict.get(f'order{order_idx}')
+            if this_order is not None:
+                if this_order.isdigit():
+                    m_order = int(this_order)
+                else:
+                    m_order = ord(this_order.lower()) - ord('0')
+        return m_id, m_order, False
+
+    def match(self, name: str, is_file: Optional[bool] = None):
+        # reject the names without a movie extension before doing any stat
+        if not name.lower().endswith(self.get_compiled_patterns().suffixes):
+            return
+        if is_file is None:
+            is_file = os.path.isfile(os.path.join(self.parent_dir, name))
+        if is_file:
+            m = self.parse(name)
+            if m is not None:
+                m_id, m_order, m_downloading = m
+                if m_downloading:
+                    self.files_to_process[m_id] = FORBIDDEN
+                elif self.movie_id is None or m_id == self.movie_id:
+                    if self.files_to_process[m_id] is not FORBIDDEN:
+                        self.files_to_process[m_id].append((m_order, name))
+
+    def match_all(self, listing: Optional[DirListing] = None):
+        if listing is None:
+            listing = DirListing.scan(self.parent_dir)
+        for name in listing.files:
+            self.match(name, is_file=True)
 
 
 class AVDirectoryMatcher(object):
@@ -120,35 +372,45 @@ class AVDirectoryMatcher(object):
 
     def collect_assets(self,
                        parent_dir: str,
-                       base_name: str) -> List[str]:
+                       base_name: str,
+                       listing: Optional[DirListing] = None) -> List[str]:
         """
         Gather assets files for a particular movie under a given directory.
 
+        The asset files are looked up in the directory listing ignoring
+        the case, thus no extra `stat` is required.
+
         Args:
             parent_dir: The parent directory.
             base_name: The base name of the assets files.
+            listing: The listing of `parent_dir`.  If not specified,
+                will list the directory on demand.
 
         Returns:
-            The collected assets file names.
+            The collected assets file names, in their on-disk case.
         """
+        if listing is None:
+            listing = DirListing.scan(parent_dir)
         ret = []
         for ext in ASSET_EXTENSIONS:
-            name = f'{base_name}.{ext}'
-            path = os.path.join(parent_dir, name)
-            if os.path.isfile(path):
-                path = os.path.realpath(path)
-                ret.append(os.path.split(path)[-1])  # use the system case
+            name = listing.find_file(f'{base_name}.{ext}')
+            if name is not None:
+                ret.append(name)
         return ret
 
-    def match(self, path: str) -> Optional[AVEntry]:
+    def match(self,
+              path: str,
+              listing: Optional[DirListing] = None) -> Optional[AVEntryRecord]:
         """
         Attempt to match a directory `path`.
 
         Args:
             path: The path of the directory.
+            listing: The listing of the directory.  If not specified,
+                will list the directory on demand.
 
         Returns:
-            AVEntry object if matches, otherwise None.
+            AVEntryRecord object if matches, otherwise None.
         """
         raise NotImplementedError()
 
@@ -158,20 +420,24 @@ class DefaultAVDirectoryMatcher(AVDirectoryMatcher):
 
     DIR_PATTERN = re.compile(r'^(?:HD-)?(?P<id>(?:[A-Z0-9]+)-(?:[0-9]+))(?:\s+.*)?$', re.I)
 
-    def match(self, path: str) -> Optional[AVEntry]:
+    def match(self,
+              path: str,
+              listing: Optional[DirListing] = None) -> Optional[AVEntryRecord]:
         base_name = os.path.split(path)[-1]
         m = self.DIR_PATTERN.match(base_name)
         if m:
+            if listing is None:
+                listing = DirListing.scan(path)
             movie_id = m.groupdict()['id'].upper()
             files_matcher = AVFilesMatcher(path, movie_id)
-            files_matcher.match_all()
+            files_matcher.match_all(listing)
             entries = files_matcher.get()
             if entries:
                 e = entries[0]
                 e.own_dir = True
-                e.asset_files = self.collect_assets(path, base_name)
+                e.asset_files = self.collect_assets(path, base_name, listing)
                 if base_name.upper() != movie_id:
-                    e.asset_files += self.collect_assets(path, movie_id)
+                    e.asset_files += self.collect_assets(path, movie_id, listing)
                 e.asset_files = e.asset_files or None
                 return e
 
@@ -181,58 +447,216 @@ class EverAverDirectoryMatcher(AVDirectoryMatcher):
 
     DIR_PATTERN = re.compile(r'^.*\[(?P<id>(?:[A-Z0-9]+)-(?:[0-9]+))\]$', re.I)
 
-    def match(self, path: str) -> Optional[AVEntry]:
+    def match(self,
+              path: str,
+              listing: Optional[DirListing] = None) -> Optional[AVEntryRecord]:
         base_name = os.path.split(path)[-1]
         base_name_upper = base_name.upper()
         m = self.DIR_PATTERN.match(base_name)
         if m:
-            for name in os.listdir(path):
+            if listing is None:
+                listing = DirListing.scan(path)
+            for name in listing.files:
                 left, right = os.path.splitext(name)
                 if left.upper().endswith(base_name_upper) and \
                         right.lower()[1:] in MOVIE_EXTENSIONS:
-                    return AVEntry(
+                    return AVEntryRecord(
                         movie_id=m.groupdict()['id'],
                         parent_dir=path,
                         own_dir=True,
                         movie_files=[name],
-                        asset_files=self.collect_assets(path, base_name)
+                        asset_files=self.collect_assets(path, base_name, listing)
                     )
 
 
 class AVScanner(object):
     """Scanner that collects AV entries from a root directory."""
 
-    def __init__(self):
+    def __init__(self,
+                 max_workers: int = 8,
+                 cache: Optional[ScanCache] = None):
+        """
+        Construct a new :class:`AVScanner`.
+
+        Args:
+            max_workers: The maximum number of threads for listing the
+                directories concurrently.  Sub-directories are listed
+                ahead of being consumed, which hides the round-trip
+                latency of network file systems.  If ``max_workers <= 1``,
+                the directories will be listed in the calling thread.
+            cache: The persistent scan cache.  If specified, directories
+                unchanged since the last scan will not be listed again.
+        """
         self.dir_matchers = [
             DefaultAVDirectoryMatcher(),
             EverAverDirectoryMatcher(),
         ]
+        self.max_workers = max_workers
+        self.cache = cache
+
+        # directories matching none of the directory patterns are not
+        # offered to the directory matchers
+        dir_patterns = [getattr(m, 'DIR_PATTERN', None) for m in self.dir_matchers]
+        if all(p is not None for p in dir_patterns):
+            self._dir_patterns = CompiledPatterns(dir_patterns)
+        else:
+            self._dir_patterns = None
+
+    def get_fingerprint(self) -> str:
+        """
+        Get the fingerprint of the matching rules of this scanner.
+
+        Scan cache records produced under a different fingerprint are
+        not reused.
+        """
+        parts = [
+            str(SCAN_CACHE_VERSION),
+            ','.join(MOVIE_EXTENSIONS),
+            ','.join(ASSET_EXTENSIONS),
+            ','.join(DOWNLOADING_EXTENSIONS),
+        ]
+        parts.extend(pattern.pattern for _, pattern in AVFilesMatcher.FILE_PATTERNS)
+        for dir_matcher in self.dir_matchers:
+            parts.append(f'{type(dir_matcher).__module__}.{type(dir_matcher).__qualname__}')
+            dir_pattern = getattr(dir_matcher, 'DIR_PATTERN', None)
+            if dir_pattern is not None:
+                parts.append(dir_pattern.pattern)
+        return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+
+    def scan_dir(self, path: str) -> Tuple[List[AVEntryRecord], List[str]]:
+        """
+        Scan a single directory, without descending into its sub-directories.
+
+        Args:
+            path: The path of the directory.
 
-    def find_iter(self, root_dir: str) -> Generator[AVEntry, None, None]:
+        Returns:
+            The AV entries matched in this directory, and the paths of the
+            sub-directories remaining to be scanned.  If the directory
+            itself is matched as an AV entry, no sub-directory will be
+            returned.
+        """
+        listing = DirListing.scan(path)
+        if self._dir_patterns is None or \
+                self._dir_patterns.match(os.path.basename(path)) is not None:
+            for dir_matcher in self.dir_matchers:
+                e = dir_matcher.match(path, listing)
+                if e is not None:
+                    return [e], []
+
+        files_matcher = AVFilesMatcher(path)
+        files_matcher.match_all(listing)
+        sub_dirs = [os.path.join(path, name) for name in listing.dirs]
+        return files_matcher.get(), sub_dirs
+
+    def _scan_dir_cached(self,
+                         path: str,
+                         records: Mapping[str, ScanRecord]
+                         ) -> Tuple[List[AVEntryRecord], List[str], Optional[ScanRecord]]:
+        # stat before listing, such that a modification during the listing
+        # would invalidate the record on the next scan
+        st = os.stat(path)
+        record = records.get(os.path.abspath(path))
+        if record is not None and record.is_fresh(st):
+            entries = [AVEntryRecord(parent_dir=path, **d) for d in record.entries]
+            sub_dirs = [os.path.join(path, name) for name in record.sub_dirs]
+            return entries, sub_dirs, None
+
+        entries, sub_dirs = self.scan_dir(path)
+        record = None
+        if self.cache.is_cacheable(st):
+            record = ScanRecord(
+                mtime_ns=st.st_mtime_ns,
+                inode=st.st_ino,
+                entries=[
+                    {key: getattr(e, key)
+                     for key in ('movie_id', 'own_dir', 'movie_files', 'asset_files')}
+                    for e in entries
+                ],
+                sub_dirs=[os.path.basename(sub_dir) for sub_dir in sub_dirs],
+            )
+        return entries, sub_dirs, record
+
+    def find_iter(self,
+                  root_dir: str,
+                  rescan: bool = False) -> Generator[AVEntryRecord, None, None]:
         """
         Iterate though all AV entries under a given root directory.
 
+        The entries are yielded in the same depth-first order regardless
+        of `max_workers`: the entries of the sub-directories come before
+        the entries of the movie files in their parent directory.
+
         Args:
             root_dir: The root directory.
+            rescan: If :obj:`True`, ignore the records in the scan cache
+                and list every directory again.  The scan cache (if any)
+                will still be updated with the new results.
 
         Yields:
             The discovered AV entries.
         """
-        def g(parent_dir: str) -> Generator[AVEntry, None, None]:
-            for dir_matcher in self.dir_matchers:
-                e = dir_matcher.match(parent_dir)
-                if e is not None:
-                    yield e
-                    break
+        if not os.path.isdir(root_dir):
+            return
+
+        # load the cached records
+        fingerprint = records = None
+        if self.cache is not None:
+            fingerprint = self.get_fingerprint()
+            records = {} if rescan else self.cache.load(root_dir, fingerprint)
+            scan_fn = lambda path: self._scan_dir_cached(path, records)
+        else:
+            scan_fn = lambda path: self.scan_dir(path) + (None,)
+        visited: Set[str] = set()
+        new_records: Dict[str, ScanRecord] = {}
+
+        # walk through the directories.  only the listings not yet consumed
+        # are kept in `pending`, for cancellation if the walk is abandoned
+        pending: Set[Future] = set()
+
+        def submit(path: str) -> Future:
+            if executor is not None:
+                f = executor.submit(scan_fn, path)
+                pending.add(f)
             else:
-                files_matcher = AVFilesMatcher(parent_dir)
-                for name in os.listdir(parent_dir):
-                    path = os.path.join(parent_dir, name)
-                    if os.path.isdir(path):
-                        yield from g(path)
-                    else:
-                        files_matcher.match(name)
-                yield from files_matcher.get()
-
-        if os.path.isdir(root_dir):
-            yield from g(root_dir)
+                f = Future()
+                f.set_result(scan_fn(path))
+            return f
+
+        def g(path: str, f: Future) -> Generator[AVEntryRecord, None, None]:
+            entries, sub_dirs, record = f.result()
+            pending.discard(f)
+            if records is not None:
+                abs_path = os.path.abspath(path)
+                visited.add(abs_path)
+                if record is not None:
+                    new_records[abs_path] = record
+
+            # schedule the listing of all sub-directories at once, such
+            # that they are walked concurrently while we consume the first
+            sub_futures = [(sub_dir, submit(sub_dir)) for sub_dir in sub_dirs]
+            for sub_dir, sub_future in sub_futures:
+                yield from g(sub_dir, sub_future)
+            yield from entries
+
+        executor = None
+        if self.max_workers > 1:
+            executor = ThreadPoolExecutor(self.max_workers)
+        completed = False
+        try:
+            yield from g(root_dir, submit(root_dir))
+            completed = True
+        finally:
+            if executor is not None:
+                # do not wait for the listings which would never be consumed
+                for f in pending:
+                    f.cancel()
+                executor.shutdown(wait=True)
+
+            # save the new records, and purge the records of the removed
+            # directories if the whole tree has been walked through
+            if self.cache is not None:
+                if new_records:
+                    self.cache.update(new_records, fingerprint)
+                if completed:
+                    self.cache.prune(root_dir, visited)
@@ -1,15 +1,21 @@
 import codecs
 import os
 import uuid
-from dataclasses import dataclass
-from itertools import chain
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from multiprocessing.pool import ThreadPool
 from tempfile import TemporaryDirectory
 from typing import *
 
 import ffmpeg
 
+from .probecache import *
+
 __all__ = [
-    'get_movie_codec', 'transcode_movies',
+    'get_movie_codec', 'get_keyframe_times', 'TranscodePlan', 'plan_transcode',
+    'execute_transcode', 'transcode_movies', 'TranscodeScheduler',
 ]
 
 
@@ -17,30 +23,136 @@ __all__ = [
 class MovieCodec(object):
     video: Dict[str, Any]
     audio: Dict[str, Any]
+    duration: float = 0.
+
+    VIDEO_KEYS: ClassVar[Tuple[str, ...]] = (
+        'codec_name', 'profile', 'pix_fmt', 'width', 'height')
+    """The video stream parameters which must agree for stream-copy concat."""
+
+    AUDIO_KEYS: ClassVar[Tuple[str, ...]] = (
+        'codec_name', 'profile', 'sample_rate', 'channels')
+    """The audio stream parameters which must agree for stream-copy concat."""
 
     def is_desired_video_codec(self) -> bool:
         return self.video.get('codec_name') in ('h264', 'hevc')
 
+    def is_desired_audio_codec(self) -> bool:
+        return self.audio.get('codec_name') in ('aac', 'mp3')
+
 
-def get_movie_codec(file_path: str) -> MovieCodec:
+def get_movie_codec(file_path: str,
+                    probe_cache: Optional[ProbeCache] = None) -> MovieCodec:
     def extract_keys(d: Mapping[str, Any],
                      keys: Sequence[str]) -> Dict[str, Any]:
         return {key: d[key] for key in keys if key in d}
 
-    codec_keys = ['codec_name', 'profile', 'pix_fmt']
     codec = MovieCodec(video={}, audio={})
-    info = ffmpeg.probe(file_path)
+    if probe_cache is not None:
+        info = probe_cache.probe(file_path)
+    else:
+        info = ffmpeg.probe(file_path)
     for stream in info.get('streams', ()):
         codec_type = stream.get('codec_type', None)
-        if codec_type == 'video':
-            codec.video.update(extract_keys(stream, codec_keys))
-        elif codec_type == 'audio':
-            codec.audio.update(extract_keys(stream, codec_keys))
+        if codec_type == 'video' and not codec.video:
+            codec.video.update(extract_keys(stream, MovieCodec.VIDEO_KEYS))
+        elif codec_type == 'audio' and not codec.audio:
+            codec.audio.update(extract_keys(stream, MovieCodec.AUDIO_KEYS))
+    codec.duration = float(info.get('format', {}).get('duration') or 0.)
     return codec
 
 
-def transcode_movies(input_files: Sequence[str],
-                     output_file: str):
+def get_keyframe_times(file_path: str) -> List[float]:
+    """
+    Get the timestamps of the keyframes of the first video stream, in
+    seconds.  Only the packets are read, the frames are not decoded.
+
+    The timestamps are relative to the ``start_time`` of the container,
+    the same as the input seeking by ``-ss``.
+    """
+    info = ffmpeg.probe(file_path, select_streams='v:0',
+                        show_entries='packet=pts_time,dts_time,flags:'
+                                     'format=start_time')
+    start_time = info.get('format', {}).get('start_time', 'N/A')
+    start_time = float(start_time) if start_time != 'N/A' else 0.
+    ret = []
+    for packet in info.get('packets', ()):
+        if 'K' in packet.get('flags', ''):
+            t = packet.get('pts_time', 'N/A')
+            if t == 'N/A':
+                t = packet.get('dts_time', 'N/A')
+            if t != 'N/A':
+                ret.append(float(t) - start_time)
+    ret.sort()
+    return ret
+
+
+@dataclass
+class TranscodePlan(object):
+    """
+    The decisions of transcoding some movie files into a single file.
+
+    The video is either copied, or re-encoded as a whole.  If the video is
+    copied, the audio of each part is either copied, or re-encoded into
+    `audio_target` (the parts with the odd audio of a multi-part movie are
+    normalized before the stream-copy concat).
+    """
+
+    input_files: List[str]
+    output_file: str
+    input_codecs: List[MovieCodec]
+    audio_need_transcode: bool
+    video_need_transcode: bool
+    audio_reencode_parts: List[bool] = field(default_factory=list)
+    """Whether or not to re-encode the audio of each input file?"""
+    audio_target: Dict[str, Any] = field(default_factory=dict)
+    """The parameters of the re-encoded audio, see :attr:`MovieCodec.AUDIO_KEYS`."""
+
+    @property
+    def is_copy(self) -> bool:
+        """Whether or not all the streams are copied, i.e., remuxed?"""
+        return not self.audio_need_transcode and not self.video_need_transcode
+
+    @property
+    def is_noop(self) -> bool:
+        """Whether or not the output file is just the input file?"""
+        return (self.is_copy and len(self.input_files) == 1 and
+                os.path.abspath(self.input_files[0]) == os.path.abspath(self.output_file))
+
+    @property
+    def duration(self) -> float:
+        """The total duration of the input files, in seconds."""
+        return sum(c.duration for c in self.input_codecs)
+
+    @property
+    def is_concat_compatible(self) -> bool:
+        """
+        Whether or not the input files agree on the stream parameters,
+        thus can be joined by the concat demuxer without the filter?
+        """
+        return _is_concat_compatible(self.input_codecs)
+
+    @property
+    def can_segment(self) -> bool:
+        """Whether or not the video can be encoded in parallel segments?"""
+        return (self.video_need_transcode and len(self.input_files) == 1 and
+                bool(self.input_codecs[0].video) and self.duration > 0)
+
+
+def plan_transcode(input_files: Sequence[str],
+                   output_file: str,
+                   probe_cache: Optional[ProbeCache] = None) -> TranscodePlan:
+    """
+    Probe the input files, and decide how to transcode them.
+
+    Args:
+        input_files: The input movie files, in the playing order.
+        output_file: The output movie file.
+        probe_cache: If specified, the unchanged input files are not
+            probed again.
+
+    Returns:
+        The transcode plan, to be executed by :func:`execute_transcode`.
+    """
     # check the parameters
     input_files = list(input_files)
     if not input_files:
@@ -48,47 +160,138 @@ def transcode_movies(input_files: Sequence[str],
 
     # inspect input codecs
     input_codecs: List[MovieCodec] = [
-        get_movie_codec(input_file)
+        get_movie_codec(input_file, probe_cache)
         for input_file in input_files]
 
-    # generate the temporary file names
-    name, ext = os.path.splitext(output_file)
-    temp_output_file = f'{name}_{uuid.uuid4().hex}{ext}'
-    temp_output_file2 = f'{name}_{uuid.uuid4().hex}{ext}'
+    # determine the output codecs.  the video can be copied only if all
+    # the parts agree on the desired codec and its parameters.
+    video_need_transcode = True
+    if (len(input_codecs) == 1 or
+            all(a.video == b.video
+                for a, b in zip(input_codecs[:-1], input_codecs[1:]))):
+        if input_codecs[0].is_desired_video_codec():
+            video_need_transcode = False
 
-    try:
-        # determine the output codecs
-        audio_need_transcode = True
-        video_need_transcode = True
+    # the audio is decided per part, against the most common desired audio
+    audio_target = {}
+    audio_reencode_parts = [False] * len(input_codecs)
+    if any(c.audio for c in input_codecs):
+        if video_need_transcode and not _is_concat_compatible(input_codecs):
+            # the concat filter re-encodes everything
+            audio_reencode_parts = [True] * len(input_codecs)
+        else:
+            audio_target = _choose_audio_target(input_codecs)
+            audio_reencode_parts = [c.audio != audio_target for c in input_codecs]
 
-        if (len(input_codecs) == 1 or
-                all(a.audio == b.audio
-                    for a, b in zip(input_codecs[:-1], input_codecs[1:]))):
-            audio_need_transcode = False
+    return TranscodePlan(
+        input_files=input_files,
+        output_file=output_file,
+        input_codecs=input_codecs,
+        audio_need_transcode=any(audio_reencode_parts),
+        video_need_transcode=video_need_transcode,
+        audio_reencode_parts=audio_reencode_parts,
+        audio_target=audio_target,
+    )
 
-        if (len(input_codecs) == 1 or
-                all(a.video == b.video
-                    for a, b in zip(input_codecs[:-1], input_codecs[1:]))):
-            if input_codecs[0].is_desired_video_codec():
-                video_need_transcode = False
 
+def _is_concat_compatible(input_codecs: Sequence[MovieCodec]) -> bool:
+    return all(a.video == b.video and a.audio == b.audio
+               for a, b in zip(input_codecs[:-1], input_codecs[1:]))
+
+
+def _choose_audio_target(input_codecs: Sequence[MovieCodec]) -> Dict[str, Any]:
+    # a single part of the desired audio (including HE-AAC) needs no concat,
+    # thus its audio can always be copied as-is
+    if len(input_codecs) == 1 and input_codecs[0].is_desired_audio_codec():
+        return dict(input_codecs[0].audio)
+
+    # the most common audio of the desired codec, which the parts of other
+    # audio can be re-encoded into, such that the concat needs no re-encode
+    # of the common parts.  our encoders produce only AAC-LC and MP3.
+    counter = Counter(
+        tuple(sorted(c.audio.items())) for c in input_codecs
+        if c.is_desired_audio_codec() and c.audio.get('profile', 'LC') in ('LC', None)
+    )
+    if counter:
+        return dict(counter.most_common(1)[0][0])
+
+    # otherwise re-encode all the parts into AAC-LC
+    def most_common(key):
+        values = [c.audio[key] for c in input_codecs if key in c.audio]
+        if values:
+            return Counter(values).most_common(1)[0][0]
+
+    ret = {'codec_name': 'aac', 'profile': 'LC'}
+    for key in ('sample_rate', 'channels'):
+        value = most_common(key)
+        if value is not None:
+            ret[key] = value
+    return ret
+
+
+def _get_audio_encode_kwargs(audio_target: Mapping[str, Any]) -> Dict[str, Any]:
+    ret = {'acodec': 'libmp3lame' if audio_target.get('codec_name') == 'mp3' else 'aac'}
+    if 'sample_rate' in audio_target:
+        ret['ar'] = audio_target['sample_rate']
+    if 'channels' in audio_target:
+        ret['ac'] = audio_target['channels']
+    return ret
+
+
+def execute_transcode(plan: TranscodePlan,
+                      threads: Optional[int] = None,
+                      segments: int = 1):
+    """
+    Execute a transcode plan.
+
+    Args:
+        plan: The transcode plan.
+        threads: The number of threads of each ffmpeg process, or
+            :obj:`None` to let ffmpeg decide.
+        segments: If greater than 1, and the plan can be segmented (see
+            :attr:`TranscodePlan.can_segment`), split the video at the
+            keyframes into this number of segments, and encode them by
+            parallel ffmpeg processes.
+    """
+    if segments > 1 and plan.can_segment:
+        return _execute_segmented(plan, threads, segments)
+
+    input_files = plan.input_files
+    output_file = plan.output_file
+    output_kwargs = {'threads': threads} if threads else {}
+
+    # generate the temporary file name
+    name, ext = os.path.splitext(output_file)
+    temp_output_file = f'{name}_{uuid.uuid4().hex}{ext}'
+
+    try:
         # now do the movie transcoding
         with TemporaryDirectory() as temp_dir:
-            if not audio_need_transcode and not video_need_transcode:
-                # video and audio codecs are all desired, use copy codec
+            if not plan.video_need_transcode:
+                # video codecs are all desired, use copy codec
+                audio_kwargs = {'acodec': 'copy'}
                 if len(input_files) > 1:
+                    # normalize the audio of the odd parts, copying the video
+                    part_files = []
+                    for i, input_file in enumerate(input_files):
+                        if plan.audio_reencode_parts[i]:
+                            part_file = os.path.join(temp_dir, f'part_{i}.mkv')
+                            ffmpeg.input(input_file). \
+                                output(part_file, vcodec='copy', sn=None,
+                                       **_get_audio_encode_kwargs(plan.audio_target)). \
+                                run()
+                            part_files.append(part_file)
+                        else:
+                            part_files.append(os.path.abspath(input_file))
+
                     # we need the concat demuxer
-                    list_file = os.path.join(temp_dir, 'list.txt')
-                    with codecs.open(list_file, 'wb', 'utf-8') as f:
-                        for input_file in input_files:
-                            f.write(f'file \'{os.path.abspath(input_file)}\'\n')
-                        input_stream = ffmpeg.input(
-                            list_file, format='concat', safe='0')
+                    input_stream = _concat_demuxer(part_files, temp_dir)
                 else:
                     # we just need the input movie as the input stream
-                    if os.path.abspath(input_files[0]) != \
-                            os.path.abspath(output_file):
+                    if not plan.is_noop:
                         input_stream = ffmpeg.input(input_files[0])
+                        if plan.audio_need_transcode:
+                            audio_kwargs = _get_audio_encode_kwargs(plan.audio_target)
                     else:
                         # no need to do copy because the output file is the
                         # input file.  return immediately
@@ -96,37 +299,321 @@ def transcode_movies(input_files: Sequence[str],
 
                 # execute ffmpeg command
                 input_stream. \
-                    output(temp_output_file, vcodec='copy', acodec='copy'). \
+                    output(temp_output_file, vcodec='copy', **audio_kwargs,
+                           **output_kwargs). \
                     run()
 
             else:
-                # otherwise do transcoding
-                if len(input_files) > 1:
-                    input_stream = ffmpeg.concat(
-                        *chain(*[
-                            (ffmpeg.input(input_file), ffmpeg.input(input_file))
-                            for input_file in input_files
-                        ]),
-                        a=1,
-                        v=1,
-                    )
+                # otherwise do transcoding.  the audio may be copied while
+                # the video is re-encoded.
+                audio_kwargs = {'acodec': 'copy'}
+                if plan.audio_need_transcode:
+                    audio_kwargs = _get_audio_encode_kwargs(plan.audio_target)
+                if len(input_files) > 1 and not plan.is_concat_compatible:
+                    # the parts differ, thus they must be decoded and joined
+                    # by the concat filter
+                    ffmpeg.output(*_concat_filter(plan), temp_output_file,
+                                  **output_kwargs).run()
                 else:
-                    input_stream = ffmpeg.input(input_files[0])
-                input_stream.output(temp_output_file).run()
+                    if len(input_files) > 1:
+                        # the concat demuxer feeds the encoder directly
+                        input_stream = _concat_demuxer(input_files, temp_dir)
+                    else:
+                        input_stream = ffmpeg.input(input_files[0])
+                    input_stream. \
+                        output(temp_output_file, **audio_kwargs, **output_kwargs). \
+                        run()
 
         # rename the file to the final output
-        if os.path.exists(output_file):
-            os.rename(output_file, temp_output_file2)
-            try:
-                os.rename(temp_output_file, output_file)
-            except:
-                os.rename(temp_output_file2, output_file)
-                raise
-            else:
-                os.remove(temp_output_file2)
-        else:
+        _replace_file(temp_output_file, output_file)
+
+    finally:
+        if os.path.exists(temp_output_file):
+            os.remove(temp_output_file)
+
+
+def _concat_demuxer(input_files: Sequence[str], temp_dir: str):
+    # the input stream of `input_files` joined by the concat demuxer, which
+    # requires the files to agree on the stream parameters
+    list_file = os.path.join(temp_dir, 'list.txt')
+    with codecs.open(list_file, 'wb', 'utf-8') as f:
+        for input_file in input_files:
+            f.write(f'file \'{os.path.abspath(input_file)}\'\n')
+    return ffmpeg.input(list_file, format='concat', safe='0')
+
+
+def _concat_filter(plan: TranscodePlan) -> list:
+    # the output streams of the input files joined by the concat filter.
+    # each file is opened once, with its first video and audio streams
+    # mapped explicitly.  the frames are scaled and padded to the size of
+    # the first part if they differ, and all of them are set to square
+    # pixels, since the filter requires the same size and SAR of all parts.
+    has_audio = all(c.audio for c in plan.input_codecs)
+    first_video = plan.input_codecs[0].video
+    size = (first_video.get('width'), first_video.get('height'))
+    streams = []
+    for input_file, codec in zip(plan.input_files, plan.input_codecs):
+        input_stream = ffmpeg.input(input_file)
+        video = input_stream['v:0']
+        if None not in size and (codec.video.get('width'), codec.video.get('height')) != size:
+            video = video. \
+                filter('scale', size[0], size[1], force_original_aspect_ratio='decrease'). \
+                filter('pad', size[0], size[1], '(ow-iw)/2', '(oh-ih)/2')
+        streams.append(video.filter('setsar', 1))
+        if has_audio:
+            streams.append(input_stream['a:0'])
+    joined = ffmpeg.concat(*streams, v=1, a=int(has_audio)).node
+    return [joined[0], joined[1]] if has_audio else [joined[0]]
+
+
+def _replace_file(temp_output_file: str, output_file: str):
+    name, ext = os.path.splitext(output_file)
+    temp_output_file2 = f'{name}_{uuid.uuid4().hex}{ext}'
+    if os.path.exists(output_file):
+        os.rename(output_file, temp_output_file2)
+        try:
             os.rename(temp_output_file, output_file)
+        except:
+            os.rename(temp_output_file2, output_file)
+            raise
+        else:
+            os.remove(temp_output_file2)
+    else:
+        os.rename(temp_output_file, output_file)
+
+
+def _choose_cut_points(keyframes: Sequence[float],
+                       duration: float,
+                       segments: int) -> List[float]:
+    # the keyframes nearest to the even splits of the duration
+    ret = []
+    for k in range(1, segments):
+        target = duration * k / segments
+        t = min(keyframes, key=lambda x: abs(x - target), default=None)
+        if t is not None and t > (ret[-1] if ret else 0.) and t < duration:
+            ret.append(t)
+    return ret
+
+
+def _execute_segmented(plan: TranscodePlan, threads: Optional[int], segments: int):
+    input_file = plan.input_files[0]
+    output_file = plan.output_file
+    output_kwargs = {'threads': threads} if threads else {}
+    cut_points = _choose_cut_points(
+        get_keyframe_times(input_file), plan.duration, segments)
+    if not cut_points:
+        return execute_transcode(plan, threads)
+
+    name, ext = os.path.splitext(output_file)
+    temp_output_file = f'{name}_{uuid.uuid4().hex}{ext}'
+
+    try:
+        with TemporaryDirectory() as temp_dir:
+            # the video segments start at keyframes, where the input seeking
+            # is exact.  the audio is encoded as a whole, such that there is
+            # no gap or overlap at the boundaries of the segments.
+            jobs = []
+            bounds = [0.] + cut_points + [None]
+            segment_files = []
+            for i, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+                segment_file = os.path.join(temp_dir, f'{i}.mkv')
+                segment_files.append(segment_file)
+                input_kwargs = {'ss': start} if start else {}
+                if end is not None:
+                    output_kwargs_i = dict(output_kwargs, t=round(end - start, 6))
+                else:
+                    output_kwargs_i = output_kwargs
+                jobs.append(
+                    ffmpeg.input(input_file, **input_kwargs).
+                    output(segment_file, map='0:v:0', an=None, sn=None,
+                           **output_kwargs_i)
+                )
+            audio_file = None
+            if plan.input_codecs[0].audio:
+                audio_file = os.path.join(temp_dir, 'audio.mka')
+                if plan.audio_need_transcode:
+                    audio_kwargs = _get_audio_encode_kwargs(plan.audio_target)
+                else:
+                    audio_kwargs = {'acodec': 'copy'}
+                jobs.append(
+                    ffmpeg.input(input_file).
+                    output(audio_file, map='0:a:0', vn=None, sn=None,
+                           **audio_kwargs, **output_kwargs)
+                )
+
+            # each job is an ffmpeg process, so the threads only wait for them
+            pool = ThreadPool(len(jobs))
+            try:
+                pool.map(lambda job: job.global_args('-nostdin').run(quiet=True), jobs)
+            finally:
+                pool.close()
+
+            # stitch the segments and the audio, by the concat demuxer
+            list_file = os.path.join(temp_dir, 'list.txt')
+            with codecs.open(list_file, 'wb', 'utf-8') as f:
+                for segment_file in segment_files:
+                    f.write(f'file \'{segment_file}\'\n')
+            streams = [ffmpeg.input(list_file, format='concat', safe='0')['v']]
+            if audio_file is not None:
+                streams.append(ffmpeg.input(audio_file)['a'])
+            ffmpeg.output(*streams, temp_output_file, vcodec='copy', acodec='copy').run()
+
+        # rename the file to the final output
+        _replace_file(temp_output_file, output_file)
 
     finally:
         if os.path.exists(temp_output_file):
             os.remove(temp_output_file)
+
+
+def transcode_movies(input_files: Sequence[str],
+                     output_file: str,
+                     threads: Optional[int] = None,
+                     segments: int = 1):
+    execute_transcode(plan_transcode(input_files, output_file), threads=threads,
+                      segments=segments)
+
+
+def _run_transcode_job(plan: TranscodePlan, threads: Optional[int], segments: int):
+    # the errors are sent back to the scheduler by pickling, but some of
+    # them cannot be unpickled (e.g., `ffmpeg.Error`), which would break the
+    # process pool.  thus they are converted into `RuntimeError`.
+    try:
+        execute_transcode(plan, threads, segments)
+    except Exception as ex:
+        message = f'{type(ex).__name__}: {ex}'
+        stderr = getattr(ex, 'stderr', None)
+        if stderr:
+            if isinstance(stderr, bytes):
+                stderr = stderr.decode('utf-8', errors='replace')
+            message += f'\n{stderr.rstrip()}'
+        raise RuntimeError(message) from None
+
+
+class TranscodeScheduler(object):
+    """
+    Executes transcode plans in parallel, in a process pool.
+
+    The CPU is divided into `slots`.  A video re-encode takes `threads`
+    slots (the thread budget of its ffmpeg process), while a job copying
+    the video, which is bound by I/O (or only re-encodes the audio),
+    takes `copy_weight` slots.  The plans are started shortest-job-first
+    by their estimated cost, i.e., the probed duration, divided by
+    `copy_speed` for the video-copy jobs, and the slots left by a long
+    job are backfilled with shorter ones.
+
+    A long re-encode, which would otherwise set the makespan, is split into
+    up to `max_segments` segments encoded in parallel (see
+    :func:`execute_transcode`), each taking `threads` slots.
+    """
+
+    def __init__(self,
+                 slots: Optional[int] = None,
+                 threads: int = 4,
+                 copy_weight: int = 1,
+                 copy_speed: float = 50.,
+                 max_segments: int = 1,
+                 min_segment_duration: float = 600.):
+        """
+        Construct a new :class:`TranscodeScheduler`.
+
+        Args:
+            slots: The total number of slots.  Defaults to the CPU count.
+            threads: The number of threads of each re-encoding ffmpeg.
+            copy_weight: The number of slots taken by a video-copy job.
+            copy_speed: The estimated speed of a video-copy job relative
+                to a re-encode, for ordering the jobs.
+            max_segments: The maximum number of segments of a re-encode.
+            min_segment_duration: The minimum duration of a segment, in
+                seconds.  Shorter movies are not segmented.
+        """
+        self.slots = max(1, slots or os.cpu_count() or 1)
+        self.threads = max(1, threads)
+        self.copy_weight = max(1, copy_weight)
+        self.copy_speed = copy_speed
+        self.max_segments = max(1, max_segments)
+        self.min_segment_duration = min_segment_duration
+
+    def get_segments(self, plan: TranscodePlan) -> int:
+        """Get the number of segments of `plan`."""
+        if not plan.can_segment:
+            return 1
+        return max(1, min(self.max_segments,
+                          self.slots // self.threads,
+                          int(plan.duration // self.min_segment_duration)))
+
+    def get_weight(self, plan: TranscodePlan) -> int:
+        """Get the number of slots taken by `plan`."""
+        if plan.is_noop:
+            return 0
+        if not plan.video_need_transcode:
+            return min(self.slots, self.copy_weight)
+        return min(self.slots, self.threads * self.get_segments(plan))
+
+    def get_cost(self, plan: TranscodePlan) -> float:
+        """Get the estimated cost of `plan`, for the shortest-job-first order."""
+        if not plan.video_need_transcode:
+            return plan.duration / self.copy_speed
+        return plan.duration
+
+    def run(self,
+            plans: Sequence[TranscodePlan],
+            on_start: Optional[Callable[[int], None]] = None,
+            on_done: Optional[Callable[[int, Optional[BaseException]], None]] = None
+            ) -> List[Optional[BaseException]]:
+        """
+        Execute the transcode plans.
+
+        Args:
+            plans: The transcode plans.
+            on_start: Callback with the index of a plan, when it is started.
+            on_done: Callback with the index of a plan, and the error if it
+                has failed, when it is finished.
+
+        Returns:
+            The error of each plan, or :obj:`None` if succeeded.
+        """
+        plans = list(plans)
+        weights = [self.get_weight(plan) for plan in plans]
+        pending = sorted(range(len(plans)), key=lambda i: self.get_cost(plans[i]))
+        results: List[Optional[BaseException]] = [None] * len(plans)
+        if not plans:
+            return results
+
+        max_workers = min(len(plans), self.slots // min(max(w, 1) for w in weights))
+        free_slots = self.slots
+        running = {}  # future -> index of the plan
+        pool = ProcessPoolExecutor(max_workers)
+        try:
+            while pending or running:
+                # start the plans in order, backfilling the free slots
+                for i in list(pending):
+                    if weights[i] <= free_slots:
+                        pending.remove(i)
+                        free_slots -= weights[i]
+                        if on_start is not None:
+                            on_start(i)
+                        args = (plans[i],
+                                self.threads if plans[i].video_need_transcode else None,
+                                self.get_segments(plans[i]))
+                        try:
+                            future = pool.submit(_run_transcode_job, *args)
+                        except BrokenProcessPool:
+                            # a worker has died, e.g., killed by the OOM killer.
+                            # the jobs running in the broken pool fail, while
+                            # the remaining jobs go to a new pool.
+                            pool.shutdown(wait=False)
+                            pool = ProcessPoolExecutor(max_workers)
+                            future = pool.submit(_run_transcode_job, *args)
+                        running[future] = i
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i = running.pop(future)
+                    free_slots += weights[i]
+                    results[i] = future.exception()
+                    if on_done is not None:
+                        on_done(i, results[i])
+        finally:
+            pool.shutdown()
+        return results
@@ -0,0 +1,36 @@
+import os
+import sqlite3
+
+__all__ = ['get_cache_dir', 'open_sqlite']
+
+
+def get_cache_dir() -> str:
+    """
+    Get the directory where avtool stores its persistent caches.
+
+    The directory is ``$AVTOOL_CACHE_DIR`` if specified, otherwise
+    ``$XDG_CACHE_HOME/avtool`` (which defaults to ``~/.cache/avtool``).
+    It will be created if not exist.
+    """
+    cache_dir = os.environ.get('AVTOOL_CACHE_DIR')
+    if not cache_dir:
+        cache_home = os.environ.get('XDG_CACHE_HOME') or \
+            os.path.join(os.path.expanduser('~'), '.cache')
+        cache_dir = os.path.join(cache_home, 'avtool')
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def open_sqlite(path: str) -> sqlite3.Connection:
+    """
+    Open a SQLite database for the caches.
+
+    The connection may be shared among threads, and the callers are
+    responsible for serializing the access to it.
+    """
+    parent_dir = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent_dir, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
@@ -0,0 +1,312 @@
+"""Watch a directory tree and discover AV entries as they land."""
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+from typing import *
+
+from .scanner import *
+
+__all__ = [
+    'DirectoryWatcher', 'InotifyWatcher', 'PollingWatcher',
+    'create_directory_watcher', 'AVWatcher',
+]
+
+
+class DirectoryWatcher(object):
+    """Base class for watchers which report the modified directories."""
+
+    def __init__(self, root_dir: str):
+        self.root_dir = root_dir
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        pass
+
+    def poll(self, timeout: Optional[float] = None) -> Set[str]:
+        """
+        Wait for the file system events.
+
+        Args:
+            timeout: The maximum number of seconds to wait.
+                :obj:`None` to wait until any event occurs.
+
+        Returns:
+            Paths of the directories whose content has been modified.
+            Empty if `timeout` expires.
+        """
+        raise NotImplementedError()
+
+
+# constants from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+_INOTIFY_EVENT = struct.Struct('iIII')
+
+
+class InotifyWatcher(DirectoryWatcher):
+    """Directory watcher driven by the Linux inotify API."""
+
+    WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+                  IN_CREATE | IN_DELETE | IN_ONLYDIR)
+
+    def __init__(self, root_dir: str):
+        super().__init__(root_dir)
+        if not sys.platform.startswith('linux'):
+            raise OSError(errno.ENOSYS, 'inotify is only available on Linux')
+        libc_name = ctypes.util.find_library('c')
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self._libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self._wd_to_path: Dict[int, str] = {}
+        self._add_watch_recursively(root_dir)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _add_watch(self, path: str):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), self.WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err in (errno.ENOENT, errno.ENOTDIR):
+                return  # the directory has just been removed
+            raise OSError(err, f'{os.strerror(err)}: {path}')
+        self._wd_to_path[wd] = path
+
+    def _add_watch_recursively(self, path: str) -> Set[str]:
+        # the watch is added before listing, thus nothing can be missed
+        self._add_watch(path)
+        ret = {path}
+        try:
+            listing = DirListing.scan(path)
+        except OSError:
+            return ret
+        for name in listing.dirs:
+            ret.update(self._add_watch_recursively(os.path.join(path, name)))
+        return ret
+
+    def poll(self, timeout: Optional[float] = None) -> Set[str]:
+        ret = set()
+        r, _, _ = select.select([self._fd], [], [], timeout)
+        if not r:
+            return ret
+
+        while True:
+            try:
+                buf = os.read(self._fd, 65536)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(buf):
+                wd, mask, _, name_len = _INOTIFY_EVENT.unpack_from(buf, offset)
+                offset += _INOTIFY_EVENT.size
+                name = buf[offset: offset + name_len].rstrip(b'\0')
+                offset += name_len
+
+                if mask & IN_Q_OVERFLOW:
+                    # events have been lost, report every watched directory
+                    ret.update(self._wd_to_path.values())
+                    continue
+                parent_dir = self._wd_to_path.get(wd)
+                if parent_dir is None:
+                    continue
+                if mask & IN_IGNORED:
+                    del self._wd_to_path[wd]
+                    continue
+                ret.add(parent_dir)
+
+                # watch the new directories, which may have been populated
+                # before the watch is added
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    path = os.path.join(parent_dir, os.fsdecode(name))
+                    ret.update(self._add_watch_recursively(path))
+        return ret
+
+
+class PollingWatcher(DirectoryWatcher):
+    """
+    Directory watcher that periodically walks through the directory tree.
+
+    This is the fallback where inotify is not available (e.g., non-Linux
+    platforms or network file systems).  A directory is reported when any
+    of its entries is added, removed, resized or touched.
+    """
+
+    def __init__(self, root_dir: str, interval: float = 30.):
+        super().__init__(root_dir)
+        self.interval = interval
+        self._snapshot = self._take_snapshot()
+        self._last_poll = time.monotonic()
+
+    def _take_snapshot(self) -> Dict[str, int]:
+        ret = {}
+
+        def walk(path):
+            signature = []
+            try:
+                with os.scandir(path) as it:
+                    for de in it:
+                        try:
+                            if de.is_dir():
+                                signature.append((de.name, -1, 0))
+                                walk(de.path)
+                            else:
+                                st = de.stat()
+                                signature.append((de.name, st.st_size, st.st_mtime_ns))
+                        except OSError:
+                            pass
+            except OSError:
+                return
+            signature.sort()
+            ret[path] = hash(tuple(signature))
+
+        walk(self.root_dir)
+        return ret
+
+    def poll(self, timeout: Optional[float] = None) -> Set[str]:
+        wait_time = self._last_poll + self.interval - time.monotonic()
+        if timeout is not None and timeout < wait_time:
+            time.sleep(max(timeout, 0))
+            return set()
+        time.sleep(max(wait_time, 0))
+        self._last_poll = time.monotonic()
+
+        snapshot = self._take_snapshot()
+        ret = {path for path, signature in snapshot.items()
+               if self._snapshot.get(path) != signature}
+        ret.update(path for path in self._snapshot if path not in snapshot)
+        self._snapshot = snapshot
+        return ret
+
+
+def create_directory_watcher(root_dir: str,
+                             polling: bool = False,
+                             poll_interval: float = 30.) -> DirectoryWatcher:
+    """
+    Create a directory watcher for `root_dir`.
+
+    Args:
+        root_dir: The root directory to watch.
+        polling: Force using :class:`PollingWatcher`.  Otherwise
+            :class:`InotifyWatcher` is used if available.
+        poll_interval: The interval of :class:`PollingWatcher`.
+    """
+    if not polling:
+        try:
+            return InotifyWatcher(root_dir)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(root_dir, interval=poll_interval)
+
+
+class AVWatcher(object):
+    """
+    Discovers AV entries under a root directory as they land.
+
+    The modified directories are grouped by their top-level directory
+    under the root directory, i.e., the unit where the directory matchers
+    of :class:`AVScanner` may apply.  A unit is scanned only after no file
+    system event has been observed in it for `settle_seconds`.  Movies
+    still being downloaded (e.g., with ``.part`` files) are not matched by
+    :class:`AVFilesMatcher`, and will be picked up once the download
+    finishes.
+    """
+
+    def __init__(self,
+                 root_dir: str,
+                 scanner: Optional[AVScanner] = None,
+                 settle_seconds: float = 10.,
+                 polling: bool = False,
+                 poll_interval: float = 30.):
+        self.root_dir = os.path.abspath(root_dir)
+        self.scanner = scanner or AVScanner()
+        self.settle_seconds = settle_seconds
+        self.polling = polling
+        self.poll_interval = poll_interval
+
+    def _get_unit(self, path: str) -> str:
+        rel_path = os.path.relpath(path, self.root_dir)
+        if rel_path in (os.curdir, os.pardir) or rel_path.startswith(os.pardir + os.sep):
+            return self.root_dir
+        return os.path.join(self.root_dir, rel_path.split(os.sep, 1)[0])
+
+    def _scan_unit(self, path: str) -> List[AVEntryRecord]:
+        if path == self.root_dir:
+            # only the loose movie files directly under the root directory
+            if not os.path.isdir(path):
+                return []
+            return self.scanner.scan_dir(path)[0]
+        return list(self.scanner.find_iter(path))
+
+    def iter_entries(self,
+                     initial_scan: bool = True,
+                     on_tick: Optional[Callable[[], None]] = None,
+                     tick_interval: float = 60.
+                     ) -> Generator[AVEntryRecord, None, None]:
+        """
+        Iterate through the AV entries as they land.  Never returns.
+
+        Args:
+            initial_scan: Whether or not to yield the AV entries already
+                present under the root directory?
+            on_tick: If specified, called about every `tick_interval`
+                seconds between the entries, even if the directory is
+                quiet, e.g., for retrying the failed jobs.
+            tick_interval: The interval of calling `on_tick`, in seconds.
+
+        Yields:
+            The discovered AV entries.
+        """
+        with create_directory_watcher(
+                self.root_dir, polling=self.polling,
+                poll_interval=self.poll_interval) as watcher:
+            if initial_scan:
+                yield from self.scanner.find_iter(self.root_dir)
+
+            pending: Dict[str, float] = {}  # unit -> time of the last event
+            next_tick = time.monotonic() + tick_interval
+            while True:
+                deadlines = [t + self.settle_seconds for t in pending.values()]
+                if on_tick is not None:
+                    deadlines.append(next_tick)
+                timeout = None
+                if deadlines:
+                    timeout = max(0., min(deadlines) - time.monotonic())
+                changed = watcher.poll(timeout)
+                now = time.monotonic()
+                if on_tick is not None and now >= next_tick:
+                    on_tick()
+                    next_tick = time.monotonic() + tick_interval
+                for path in changed:
+                    pending[self._get_unit(path)] = now
+
+                ready = [unit for unit, t in pending.items()
+                         if now - t >= self.settle_seconds]
+                for unit in ready:
+                    del pending[unit]
+                    yield from self._scan_unit(unit)
@@ -0,0 +1,94 @@
+"""
+Benchmark of the decoding work of joining a multi-part movie.
+
+A two-part test movie is generated by the ffmpeg ``testsrc`` and ``sine``
+sources, encoded as MPEG-4 part 2.  The parts are joined and decoded into
+the ``null`` muxer (thus no encoding cost is included) by:
+
+* the legacy concat filter graph, which opened each part twice;
+* the concat filter graph of :func:`avtool.transcode.execute_transcode`,
+  which opens each part once and maps ``[i:v:0][i:a:0]`` explicitly;
+* the concat demuxer, used when the parts agree on the stream parameters.
+
+The CPU time of ffmpeg, and the number of opened inputs are reported.
+
+Usage::
+
+    python benchmarks/bench_concat.py [--duration 60] [--repeat 3]
+"""
+import os
+import resource
+import time
+from itertools import chain
+from tempfile import TemporaryDirectory
+
+import click
+import ffmpeg
+
+from avtool.transcode import *
+from avtool.transcode import _concat_demuxer, _concat_filter
+
+
+def make_test_part(path, duration, size):
+    video = ffmpeg.input(f'testsrc=duration={duration}:size={size}:rate=30', format='lavfi')
+    audio = ffmpeg.input(f'sine=frequency=440:duration={duration}', format='lavfi')
+    ffmpeg.output(video, audio, path, vcodec='mpeg4', acodec='mp3',
+                  **{'q:v': 5}).overwrite_output().run(quiet=True)
+
+
+def legacy_graph(input_files):
+    return ffmpeg.concat(
+        *chain(*[
+            (ffmpeg.input(input_file), ffmpeg.input(input_file))
+            for input_file in input_files
+        ]),
+        a=1,
+        v=1,
+    ).output('-', format='null')
+
+
+def measure(stream, repeat):
+    best = None
+    for _ in range(repeat):
+        start_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        start_time = time.perf_counter()
+        stream.run(quiet=True)
+        elapsed = time.perf_counter() - start_time
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu = (usage.ru_utime - start_usage.ru_utime +
+               usage.ru_stime - start_usage.ru_stime)
+        best = (cpu, elapsed) if best is None else min(best, (cpu, elapsed))
+    return best
+
+
+@click.command()
+@click.option('--duration', default=60, type=click.INT,
+              help='Duration of each part, in seconds.')
+@click.option('--size', default='1280x720', help='Frame size of the parts.')
+@click.option('--repeat', default=3, type=click.INT,
+              help='Number of repeats, the best is reported.')
+def main(duration, size, repeat):
+    with TemporaryDirectory() as temp_dir:
+        input_files = [os.path.join(temp_dir, f'part{i}.avi') for i in range(2)]
+        for input_file in input_files:
+            make_test_part(input_file, duration, size)
+        plan = plan_transcode(input_files, os.path.join(temp_dir, 'out.mp4'))
+        print(f'Parts: 2 x {duration}s {size}, '
+              f'concat compatible: {plan.is_concat_compatible}')
+
+        graphs = [
+            ('legacy filter', legacy_graph(input_files)),
+            ('filter', ffmpeg.output(*_concat_filter(plan), '-', format='null')),
+            ('demuxer', _concat_demuxer(input_files, temp_dir).output('-', format='null')),
+        ]
+        base = None
+        for name, stream in graphs:
+            inputs = stream.compile().count('-i')
+            cpu, elapsed = measure(stream, repeat)
+            base = cpu if base is None else base
+            print(f'{name:>14s}: {inputs} inputs, CPU {cpu:6.2f}s '
+                  f'({cpu / base:.2f}x), wall {elapsed:6.2f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Benchmark of cropping the cover images from the fanarts.
+
+Compares the legacy crop (full decoding, and re-encoding at the default
+quality) against the methods of :func:`avtool.imaging.crop_cover_image`:
+re-encoding with the fanart quantization tables, the draft mode decoding
+at half height, and the lossless ``jpegtran`` crop (if installed).  The
+quality is the PSNR against the same region of the fully decoded fanart.
+The throughput of a process pool is also reported.
+
+Usage::
+
+    python benchmarks/bench_cover_crop.py FANARTS_DIR [--repeat 3] [--processes 4]
+"""
+import math
+import multiprocessing
+import os
+import time
+from functools import partial
+from io import BytesIO
+
+import click
+from PIL import Image, ImageChops, ImageStat
+
+from avtool.imaging import *
+from avtool.imaging import _get_jpegtran
+
+
+def load_corpus(images_dir):
+    ret = []
+    for name in sorted(os.listdir(images_dir)):
+        if os.path.splitext(name)[1].lower() in ('.jpg', '.jpeg'):
+            with open(os.path.join(images_dir, name), 'rb') as f:
+                ret.append(f.read())
+    return ret
+
+
+def legacy_crop(content):
+    with Image.open(BytesIO(content)) as img:
+        cropped_img = img.crop(get_cover_box(img.width, img.height))
+        with BytesIO() as output_stream:
+            cropped_img.save(output_stream, format='JPEG')
+            return output_stream.getvalue()
+
+
+def draft_crop(content):
+    with Image.open(BytesIO(content)) as img:
+        max_height = img.height // 2
+    return crop_cover_image(content, lossless=False, max_height=max_height)
+
+
+def psnr(fanart, cover):
+    # compare against the same region of the fanart, which is resized if
+    # the cover is scaled, and moved if the cover is aligned to the MCUs
+    with Image.open(BytesIO(fanart)) as src, Image.open(BytesIO(cover)) as dst:
+        left = src.width - round(dst.width * src.height / dst.height)
+        ref = src.convert('RGB').crop((left, 0, src.width, src.height))
+        if ref.size != dst.size:
+            ref = ref.resize(dst.size, Image.BILINEAR)
+        stat = ImageStat.Stat(ImageChops.difference(ref, dst.convert('RGB')))
+        mse = sum(stat.sum2) / (3. * dst.width * dst.height)
+    return 100. if mse == 0 else 10 * math.log10(255. ** 2 / mse)
+
+
+@click.command()
+@click.argument('images-dir', required=True)
+@click.option('--repeat', default=3, type=click.INT,
+              help='Number of repeats, the best is reported.')
+@click.option('--processes', default=os.cpu_count(), type=click.INT,
+              help='Number of processes of the pool.')
+def main(images_dir, repeat, processes):
+    corpus = load_corpus(images_dir)
+    if not corpus:
+        raise click.ClickException('No JPEG image is found in the directory.')
+    print(f'Corpus: {len(corpus)} fanarts, '
+          f'{sum(len(c) for c in corpus) / 2 ** 20:.1f} MiB')
+
+    methods = [
+        ('legacy', legacy_crop),
+        ('keep-tables', partial(crop_cover_image, lossless=False)),
+        ('draft-1/2', draft_crop),
+    ]
+    if _get_jpegtran() is not None:
+        methods.append(('jpegtran', crop_cover_image))
+    else:
+        print('jpegtran is not found, the lossless crop is skipped.')
+
+    base_psnr = None
+    for name, fn in methods:
+        best = None
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            covers = [fn(content) for content in corpus]
+            elapsed = time.perf_counter() - start_time
+            best = elapsed if best is None else min(best, elapsed)
+        mean_psnr = sum(psnr(a, b) for a, b in zip(corpus, covers)) / len(corpus)
+        base_psnr = mean_psnr if base_psnr is None else base_psnr
+        print(f'{name:>12s}: {len(corpus) / best:8,.1f} crops/s, '
+              f'PSNR {mean_psnr:5.2f} dB ({mean_psnr - base_psnr:+.2f}), '
+              f'{sum(len(c) for c in covers) / len(corpus) / 1024:6.1f} KiB/cover')
+
+    with multiprocessing.get_context('spawn').Pool(processes) as pool:
+        pool.map(crop_cover_image, corpus[:processes])  # warm up the workers
+        start_time = time.perf_counter()
+        pool.map(crop_cover_image, corpus)
+        elapsed = time.perf_counter() - start_time
+    print(f'{"pool x" + str(processes):>12s}: {len(corpus) / elapsed:8,.1f} crops/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Parse benchmark of the :class:`JavBusCrawler` parser backends.
+
+The corpus is either a directory of saved detail pages, named as
+``<MOVIE_ID>.html``, or the detail pages stored in the HTTP response
+cache (e.g., after running ``avtool assets`` or ``avtool crawl``).
+
+Usage::
+
+    python benchmarks/bench_crawler_parse.py [--pages-dir DIR] [--repeat 3]
+"""
+import os
+import time
+
+import click
+
+from avtool.crawler import *
+from avtool.httpcache import *
+from avtool.records import *
+
+
+def load_corpus(pages_dir):
+    ret = []
+    if pages_dir:
+        for name in sorted(os.listdir(pages_dir)):
+            movie_id, ext = os.path.splitext(name)
+            if ext.lower() in ('.html', '.htm'):
+                with open(os.path.join(pages_dir, name), 'rb') as f:
+                    ret.append((movie_id, f.read()))
+    else:
+        prefix = JavBusCrawler.BASE_URL + '/'
+        with ResponseCache() as cache:
+            for url in cache.get_urls(prefix):
+                ret.append((url[len(prefix):], cache.get(url).content))
+    return ret
+
+
+def comparable(info):
+    ret = info_to_dict(info)
+    ret.pop('info_born_time')
+    return ret
+
+
+@click.command()
+@click.option('--pages-dir', required=False, default=None,
+              help='Directory of saved pages.  Defaults to the pages in '
+                   'the HTTP response cache.')
+@click.option('--repeat', default=3, type=click.INT,
+              help='Number of repeats, the best is reported.')
+def main(pages_dir, repeat):
+    corpus = load_corpus(pages_dir)
+    if not corpus:
+        raise click.ClickException('No page is found in the corpus.')
+    print(f'Corpus: {len(corpus)} pages, '
+          f'{sum(len(c) for _, c in corpus) / 2 ** 20:.1f} MiB')
+
+    results = {}
+    for parser in ('bs4', 'lxml'):
+        crawler = JavBusCrawler(parser=parser)
+        best = None
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            ret = []
+            for movie_id, content in corpus:
+                try:
+                    ret.append(comparable(crawler.parse(movie_id, content)))
+                except Exception as ex:
+                    ret.append(repr(ex))
+            elapsed = time.perf_counter() - start_time
+            best = elapsed if best is None else min(best, elapsed)
+        results[parser] = ret
+        print(f'{parser:>5s}: {len(corpus) / best:10,.1f} pages/s ({best:.3f}s)')
+
+    mismatches = [movie_id for (movie_id, _), a, b in
+                  zip(corpus, results['bs4'], results['lxml']) if a != b]
+    print(f'Mismatches: {len(mismatches)}')
+    for movie_id in mismatches[:10]:
+        print(f'  {movie_id}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Micro-benchmark of the movie file name matching.
+
+Compares the per-pattern matching loop used by ``AVFilesMatcher`` before
+the patterns were compiled into :class:`avtool.scanner.CompiledPatterns`,
+against :meth:`AVFilesMatcher.parse`, on a synthetic corpus of names.
+
+Usage::
+
+    python benchmarks/bench_matcher.py [-n 1000000]
+"""
+import random
+import time
+
+import click
+
+from avtool.scanner import *
+from avtool.scanner import ASSET_EXTENSIONS, DOWNLOADING_EXTENSIONS, MOVIE_EXTENSIONS
+
+
+def make_corpus(n: int, seed: int = 1234):
+    rnd = random.Random(seed)
+    other_extensions = ['txt', 'srt', 'ass', 'url', 'torrent', 'html', 'db']
+
+    def movie_id():
+        prefix = ''.join(rnd.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+                         for _ in range(rnd.randint(2, 5)))
+        return f'{prefix}-{rnd.randint(1, 999):03d}'
+
+    ret = []
+    for _ in range(n):
+        r = rnd.random()
+        if r < .25:  # movie files
+            name = f'{rnd.choice(["", "HD-", "[abc.com]"])}{movie_id()}'
+            name += rnd.choice(['', '', '-1', ' (2)', '(b)', ' some title'])
+            name += f'.{rnd.choice(MOVIE_EXTENSIONS)}'
+            if rnd.random() < .1:
+                name += f'.{rnd.choice(DOWNLOADING_EXTENSIONS)}'
+        elif r < .6:  # asset files
+            name = f'{movie_id()}.{rnd.choice(ASSET_EXTENSIONS)}'
+        else:  # other files
+            name = f'{movie_id()} readme.{rnd.choice(other_extensions)}'
+        if rnd.random() < .5:
+            name = name.lower()
+        ret.append(name)
+    return ret
+
+
+def legacy_parse(name: str):
+    for n_orders, pattern in AVFilesMatcher.FILE_PATTERNS:
+        m = pattern.match(name)
+        if m:
+            m_dict = m.groupdict()
+            m_id = m_dict['id'].upper()
+            if m_dict.get('download_ext'):
+                return m_id, 0, True
+            m_order = 0
+            for order_idx in range(1, n_orders + 1):
+                this_order = m_dict.get(f'order{order_idx}')
+                if this_order is not None:
+                    m_order = int(this_order) if this_order.isdigit() \
+                        else ord(this_order.lower()) - ord('0')
+            return m_id, m_order, False
+
+
+def run(fn, corpus):
+    start_time = time.perf_counter()
+    ret = [fn(name) for name in corpus]
+    return ret, time.perf_counter() - start_time
+
+
+@click.command()
+@click.option('-n', '--names', default=1000000, type=click.INT,
+              help='Number of names in the synthetic corpus.')
+@click.option('--repeat', default=3, type=click.INT,
+              help='Number of repeats, the best is reported.')
+def main(names, repeat):
+    corpus = make_corpus(names)
+    print(f'Corpus: {len(corpus)} names')
+
+    for label, fn in [('per-pattern loop', legacy_parse),
+                      ('compiled + suffix filter', AVFilesMatcher.parse)]:
+        best = None
+        for _ in range(repeat):
+            ret, elapsed = run(fn, corpus)
+            best = elapsed if best is None else min(best, elapsed)
+        matched = sum(r is not None for r in ret)
+        print(f'{label:>26s}: {len(corpus) / best:12,.0f} names/s '
+              f'({best:.3f}s, {matched} matched)')
+
+    # both paths must agree
+    legacy = [legacy_parse(name) for name in corpus]
+    compiled = [AVFilesMatcher.parse(name) for name in corpus]
+    mismatches = sum(a != b for a, b in zip(legacy, compiled))
+    print(f'Mismatches: {mismatches}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""
+Memory and throughput benchmark of the AV entry and info representations.
+
+Compares the :class:`mltk.Config` based :class:`AVEntry` and :class:`AVInfo`
+against the ``__slots__`` based :class:`AVEntryRecord` (produced by the
+scanner) and :class:`AVInfoRecord`, on a synthetic library.
+
+Usage::
+
+    python benchmarks/bench_records.py [-n 100000]
+"""
+import gc
+import random
+import time
+import tracemalloc
+
+import click
+import mltk
+
+from avtool.crawler import *
+from avtool.records import *
+from avtool.scanner import *
+
+
+def make_entry_dicts(n: int, seed: int = 1234):
+    rnd = random.Random(seed)
+    ret = []
+    for i in range(n):
+        movie_id = f'ABC-{i:06d}'
+        own_dir = rnd.random() < .5
+        parent_dir = f'/library/{movie_id}' if own_dir else f'/library/misc/{i // 100}'
+        ret.append({
+            'movie_id': movie_id,
+            'parent_dir': parent_dir,
+            'own_dir': own_dir,
+            'movie_files': [f'{movie_id}-{j}.mp4' if j else f'{movie_id}.mp4'
+                            for j in range(rnd.randint(1, 3))],
+            'asset_files': [f'{movie_id}.{ext}' for ext in ('json', 'zip', 'nfo')]
+                           if own_dir else None,
+        })
+    return ret
+
+
+def make_info_dicts(n: int, seed: int = 1234):
+    rnd = random.Random(seed)
+
+    def image(name):
+        return {'file': f'{name}.jpg', 'thumbnail': f'{name}.thumbnail.jpg'}
+
+    ret = []
+    for i in range(n):
+        movie_id = f'ABC-{i:06d}'
+        ret.append({
+            'movie_id': movie_id,
+            'series': f'series {rnd.randint(0, 1000)}',
+            'title': f'title of {movie_id} ' * 3,
+            'tags': [f'tag {rnd.randint(0, 200)}' for _ in range(rnd.randint(3, 10))],
+            'outline': None,
+            'plot': None,
+            'director': f'director {rnd.randint(0, 500)}',
+            'studio': f'studio {rnd.randint(0, 100)}',
+            'publisher': f'publisher {rnd.randint(0, 100)}',
+            'actors': [f'actor {rnd.randint(0, 5000)}' for _ in range(rnd.randint(1, 4))],
+            'movie_length': f'{rnd.randint(60, 240)}分鐘',
+            'premiered': '2019-01-31',
+            'cover_image': image('cover'),
+            'fanart_images': [image('fanart_0')],
+            'screenshot_images': [image(f'screenshot_{j}') for j in range(rnd.randint(0, 20))],
+            'info_born_time': time.time(),
+        })
+    return ret
+
+
+def make_config(d) -> AVInfo:
+    kwargs = {k: v for k, v in d.items() if v is not None}
+    if d['cover_image'] is not None:
+        kwargs['cover_image'] = AVInfoImage(**d['cover_image'])
+    for key in ('fanart_images', 'screenshot_images'):
+        if d[key] is not None:
+            kwargs[key] = [AVInfoImage(**i) for i in d[key]]
+    return AVInfo(**kwargs)
+
+
+def config_to_info_dict(info: AVInfo):
+    # the conversion used by `make_av_assets` and `JSONIndexer` before
+    ret = mltk.config_to_dict(info)
+    if info.cover_image is not None:
+        ret['cover_image'] = mltk.config_to_dict(info.cover_image)
+    for key in ('fanart_images', 'screenshot_images'):
+        if getattr(info, key):
+            ret[key] = [mltk.config_to_dict(i) for i in getattr(info, key)]
+    return ret
+
+
+def measure(label, dicts, load, dump):
+    gc.collect()
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    objects = [load(d) for d in dicts]
+    load_time = time.perf_counter() - start_time
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    start_time = time.perf_counter()
+    for o in objects:
+        dump(o)
+    dump_time = time.perf_counter() - start_time
+
+    n = len(dicts)
+    print(f'{label:>8s}: memory {memory / 2 ** 20:8.1f} MiB, '
+          f'from dict {n / load_time:10,.0f} /s, '
+          f'to dict {n / dump_time:10,.0f} /s')
+
+
+@click.command()
+@click.option('-n', '--entries', default=100000, type=click.INT,
+              help='Number of entries in the synthetic library.')
+def main(entries):
+    dicts = make_entry_dicts(entries)
+    print(f'Library: {len(dicts)} entries')
+    print('AVEntry:')
+    measure('Config', dicts, lambda d: AVEntry(**d), mltk.config_to_dict)
+    measure('Record', dicts, AVEntryRecord.from_dict, entry_to_dict)
+
+    dicts = make_info_dicts(entries)
+    print('AVInfo:')
+    measure('Config', dicts, make_config, config_to_info_dict)
+    measure('Record', dicts, AVInfoRecord.from_dict, info_to_dict)
+
+
+if __name__ == '__main__':
+    main()
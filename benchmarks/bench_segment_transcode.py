@@ -0,0 +1,76 @@
+"""
+Benchmark of the segment-parallel encoding of a single movie.
+
+A test clip is generated by the ffmpeg ``testsrc`` and ``sine`` sources,
+encoded as MPEG-4 part 2 (thus it needs a re-encode), and then transcoded
+as a whole with all the cores, and in N segments with ``cores / N``
+threads each, for N up to the core count.  The wall-clock time, the
+speedup against the whole encode on one core, and the output duration
+(which should match the clip) are reported.
+
+Note that the ``testsrc`` clips always start at 0, thus the handling of a
+non-zero container ``start_time`` (common in the MPEG-TS recordings) by
+:func:`avtool.transcode.get_keyframe_times` is not exercised here.
+
+Usage::
+
+    python benchmarks/bench_segment_transcode.py [--duration 120] [--cores 8]
+"""
+import os
+import time
+from tempfile import TemporaryDirectory
+
+import click
+import ffmpeg
+
+from avtool.transcode import *
+
+
+def make_test_clip(path, duration, size, gop):
+    video = ffmpeg.input(f'testsrc=duration={duration}:size={size}:rate=30', format='lavfi')
+    audio = ffmpeg.input(f'sine=frequency=440:duration={duration}', format='lavfi')
+    ffmpeg.output(video, audio, path, vcodec='mpeg4', g=gop, acodec='mp3',
+                  **{'q:v': 5}).overwrite_output().run(quiet=True)
+
+
+def get_duration(path):
+    return float(ffmpeg.probe(path)['format']['duration'])
+
+
+@click.command()
+@click.option('--duration', default=120, type=click.INT,
+              help='Duration of the test clip, in seconds.')
+@click.option('--size', default='1280x720', help='Frame size of the test clip.')
+@click.option('--gop', default=60, type=click.INT,
+              help='Keyframe interval of the test clip, in frames.')
+@click.option('--cores', default=os.cpu_count(), type=click.INT,
+              help='Number of cores to use.')
+def main(duration, size, gop, cores):
+    with TemporaryDirectory() as temp_dir:
+        input_file = os.path.join(temp_dir, 'clip.avi')
+        make_test_clip(input_file, duration, size, gop)
+        plan = plan_transcode([input_file], os.path.join(temp_dir, 'out.mp4'))
+        print(f'Clip: {duration}s {size}, {len(get_keyframe_times(input_file))} keyframes')
+
+        def run(threads, segments):
+            start_time = time.perf_counter()
+            execute_transcode(plan, threads=threads, segments=segments)
+            elapsed = time.perf_counter() - start_time
+            return elapsed, get_duration(plan.output_file)
+
+        base, _ = run(1, 1)
+        print(f'{"whole x1":>16s}: {base:7.1f}s')
+        n = 1
+        while n <= cores:
+            for name, threads, segments in [(f'whole x{n}', n, 1),
+                                            (f'{n} segments x1', 1, n)]:
+                if n == 1 and segments == 1:
+                    continue
+                elapsed, out_duration = run(threads, segments)
+                print(f'{name:>16s}: {elapsed:7.1f}s, speedup {base / elapsed:5.2f}, '
+                      f'output {out_duration:.2f}s')
+            n *= 2
+
+
+if __name__ == '__main__':
+    main()